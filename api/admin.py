@@ -1,9 +1,47 @@
 from django.contrib import admin
-from api.models import Account, Expense, Payment
+from api.models import Account, AmountModifier, Expense, Income, Payment, RevokedToken
+from api.rollups import following_rollups
 # Register your models here.
 
 
-admin.site.register(Account)
-admin.site.register(Expense)
-admin.site.register(Payment)
+class ExpenseAdmin(admin.ModelAdmin):
+    """Keeps the rollups of the expenses changed in the admin up to date, as the API does."""
+
+    def save_model(self, request, obj, form, change):
+        with following_rollups({obj.pk} if change else set()) as expense_ids:
+            super().save_model(request, obj, form, change)
+            expense_ids.add(obj.pk)
+
+    def delete_model(self, request, obj):
+        with following_rollups({obj.pk}):
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with following_rollups(set(queryset.values_list('pk', flat=True))):
+            super().delete_queryset(request, queryset)
+
+
+class PaymentAdmin(admin.ModelAdmin):
+    """Keeps the rollups of the expenses whose payments are changed in the admin up to date."""
 
+    def save_model(self, request, obj, form, change):
+        # A payment moved to another expense changes the months of both.
+        expense_ids = set(Payment.objects.filter(pk=obj.pk).values_list('expense_id', flat=True)) if change else set()
+        with following_rollups(expense_ids | {obj.expense_id}):
+            super().save_model(request, obj, form, change)
+
+    def delete_model(self, request, obj):
+        with following_rollups({obj.expense_id}):
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with following_rollups(set(queryset.values_list('expense_id', flat=True))):
+            super().delete_queryset(request, queryset)
+
+
+admin.site.register(Account)
+admin.site.register(Expense, ExpenseAdmin)
+admin.site.register(Income)
+admin.site.register(Payment, PaymentAdmin)
+admin.site.register(AmountModifier)
+admin.site.register(RevokedToken)
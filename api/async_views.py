@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.utils.decorators import classonlymethod
+from asgiref.sync import sync_to_async
+from functools import update_wrapper
+
+
+class AsyncViewSetMixin:
+    """
+    Serves the routes of `async_actions` with coroutine views when `settings.ASYNC_VIEWS` is on.
+    Routes that also have other actions, like writes sharing the URL of a list, stay synchronous.
+
+    Under ASGI a synchronous view makes every synchronous middleware and the view itself hop
+    between the event loop and a worker thread. A coroutine view keeps the middleware on the
+    event loop and runs the whole DRF request (authentication, queries, serialization) in a
+    single hop to the request's thread, leaving the loop free for other requests while the
+    database works. Django 4.0 has no async ORM, so the queries themselves stay synchronous.
+
+    Under WSGI coroutine views need an event loop per request, so the setting is off by default.
+    """
+    async_actions = ()
+
+    @classonlymethod
+    def as_view(cls, actions=None, **initkwargs):
+        view = super().as_view(actions, **initkwargs)
+        if not getattr(settings, 'ASYNC_VIEWS', False) or not set(actions.values()) <= set(cls.async_actions):
+            return view
+        sync_view = sync_to_async(view, thread_sensitive=True)
+
+        async def async_view(request, *args, **kwargs):
+            return await sync_view(request, *args, **kwargs)
+
+        # Keeps cls, actions and csrf_exempt, which the router and middleware read from the view.
+        return update_wrapper(async_view, view)
@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTTokenUserAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from datetime import datetime
+from time import monotonic
+
+from api.models import RevokedToken
+
+
+class TokenDenylist:
+    """
+    In-process copy of the ids of revoked tokens that haven't expired yet.
+    It is reloaded from the database every `TOKEN_DENYLIST_TTL` seconds, so a token
+    revoked through another process stops working within that time.
+    """
+
+    def __init__(self):
+        self.jtis = frozenset()
+        self.expires = None
+
+    def __contains__(self, jti):
+        if self.expires is None or monotonic() >= self.expires:
+            self.load()
+        return jti in self.jtis
+
+    def load(self):
+        revoked = RevokedToken.objects.filter(expires_at__gt=timezone.now()).values_list('jti', flat=True)
+        self.jtis = frozenset(revoked)
+        self.expires = monotonic() + getattr(settings, 'TOKEN_DENYLIST_TTL', 30)
+
+    def revoke(self, token):
+        jti = token[api_settings.JTI_CLAIM]
+        expires_at = datetime.fromtimestamp(token['exp'], tz=timezone.utc)
+        RevokedToken.objects.filter(expires_at__lte=timezone.now()).delete()
+        RevokedToken.objects.get_or_create(jti=jti, defaults={'expires_at': expires_at})
+        self.jtis = self.jtis | {jti}
+
+
+denylist = TokenDenylist()
+
+
+class AccountJWTAuthentication(JWTTokenUserAuthentication):
+    """
+    Authenticates with the claims of the access token alone: the user is a `TokenUser`
+    and the account comes from the token's `account_id` claim, so no query is needed.
+    """
+
+    def get_validated_token(self, raw_token):
+        validated_token = super().get_validated_token(raw_token)
+        if validated_token.get(api_settings.JTI_CLAIM) in denylist:
+            raise InvalidToken(_("Token is revoked"))
+        return validated_token
@@ -0,0 +1,154 @@
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import serializers, status
+
+from api.models import Expense
+from api.rollups import RollupDelta
+from api.serializers import ExpenseSerializer, parse_payment_date
+from api.sqlite import retry_on_busy
+
+OPERATIONS = ('create', 'update', 'delete')
+
+
+class ExpenseBatch:
+    """
+    A list of `{"op": "create", "data": {...}}`, `{"op": "update", "id": 1, "data": {...}}` and
+    `{"op": "delete", "id": 1}` operations on the expenses of an account, applied in one
+    transaction: all of them or, when any of them is invalid, none.
+
+    `results` has an entry per operation, in the same order, with its HTTP-like `status` and the
+    expense `data` or the `errors`. Operations that were valid but not applied because of
+    others get 424 Failed Dependency.
+    """
+
+    def __init__(self, operations, account, context):
+        self.operations = operations
+        self.account = account
+        self.context = context
+        self.results = []
+        self.rollup_delta = RollupDelta()
+        self.attempted = False
+
+    def fail(self, i, code, errors):
+        self.results[i] = {'op': self.operations[i].get('op'), 'status': code, 'errors': errors}
+
+    def is_valid(self):
+        operations = self.operations
+        if not isinstance(operations, list) or not operations:
+            raise serializers.ValidationError({"error": "Expected a non-empty list of operations."})
+        limit = settings.EXPENSE_BATCH_LIMIT
+        if len(operations) > limit:
+            raise serializers.ValidationError({"error": f"At most {limit} operations per batch."})
+        if not all(isinstance(operation, dict) for operation in operations):
+            raise serializers.ValidationError({"error": "Every operation must be an object."})
+
+        self.results = [None] * len(operations)
+        ids = [operation.get('id') for operation in operations if operation.get('op') != 'create']
+        expenses = Expense.objects.filter(account=self.account).in_bulk([pk for pk in ids if type(pk) is int])
+        today = timezone.localtime().strftime("%Y-%m-%d %H:%M:%S")
+        self.creates, self.updates, self.deletes = [], [], []
+        create_data, payment_dates, seen = [], [], set()
+        context = dict(self.context, rollup_delta=self.rollup_delta)
+
+        for i, operation in enumerate(operations):
+            op, data = operation.get('op'), operation.get('data', {})
+            if op not in OPERATIONS:
+                self.fail(i, status.HTTP_400_BAD_REQUEST, {'op': [f"Expected one of {', '.join(OPERATIONS)}."]})
+            elif op != 'delete' and not isinstance(data, dict):
+                self.fail(i, status.HTTP_400_BAD_REQUEST, {'data': ["Expected an object."]})
+            elif op == 'create':
+                data = dict(data)
+                try:
+                    payment_dates.append(parse_payment_date(data.pop('payment_date', today)))
+                except (TypeError, ValueError):
+                    self.fail(i, status.HTTP_400_BAD_REQUEST, {'payment_date': ["Expected YYYY-MM-DD HH:MM:SS."]})
+                    continue
+                self.creates.append(i)
+                create_data.append(data)
+            elif operation.get('id') not in expenses:
+                self.fail(i, status.HTTP_404_NOT_FOUND, {'id': ["Not found."]})
+            elif operation['id'] in seen:
+                self.fail(i, status.HTTP_400_BAD_REQUEST, {'id': ["Appears in more than one operation."]})
+            elif op == 'update':
+                seen.add(operation['id'])
+                serializer = ExpenseSerializer(expenses[operation['id']], data=data, partial=True, context=context)
+                if serializer.is_valid():
+                    self.updates.append((i, serializer))
+                else:
+                    self.fail(i, status.HTTP_400_BAD_REQUEST, serializer.errors)
+            else:
+                seen.add(operation['id'])
+                self.deletes.append((i, expenses[operation['id']]))
+
+        self.create_serializer = ExpenseSerializer(
+            data=create_data, many=True, context=dict(context, payment_dates=payment_dates),
+        )
+        if not self.create_serializer.is_valid():
+            self.add_errors(self.creates, self.create_serializer.errors)
+        return not self.failed
+
+    @property
+    def failed(self):
+        return any(result is not None and result['status'] >= 400 for result in self.results)
+
+    def add_errors(self, indexes, errors):
+        for i, detail in zip(indexes, errors):
+            if detail:
+                self.fail(i, status.HTTP_400_BAD_REQUEST, detail)
+
+    def save(self):
+        try:
+            self.apply()
+        except serializers.ValidationError:
+            # Raised by the serializers before the transaction commits, nothing was applied.
+            return
+
+        updated = [serializer.instance for _, serializer in self.updates]
+        saved = Expense.objects.filter(pk__in=[expense.pk for expense in self.created + updated])
+        serializer = ExpenseSerializer(context=self.context)
+        data = {row['id']: row for row in serializer.values_data(serializer.values_queryset(saved))}
+        for i, expense in zip(self.creates, self.created):
+            self.results[i] = {'op': 'create', 'status': status.HTTP_201_CREATED, 'data': data[expense.pk]}
+        for (i, _), expense in zip(self.updates, updated):
+            self.results[i] = {'op': 'update', 'status': status.HTTP_200_OK, 'data': data[expense.pk]}
+        for i, expense in self.deletes:
+            self.results[i] = {'op': 'delete', 'status': status.HTTP_204_NO_CONTENT, 'id': expense.pk}
+
+    @retry_on_busy
+    def apply(self):
+        self.rollup_delta.clear()
+        with transaction.atomic():
+            if self.attempted and self.updates:
+                # The failed attempt changed the instances in memory, the rollups must remove the stored values.
+                stored = Expense.objects.in_bulk([serializer.instance.pk for _, serializer in self.updates])
+                for _, serializer in self.updates:
+                    serializer.instance = stored[serializer.instance.pk]
+            self.attempted = True
+            self.created = []
+            if self.creates:
+                self.create_serializer.instance = None
+                try:
+                    self.created = self.create_serializer.save(account=self.account)
+                except serializers.ValidationError as e:
+                    self.add_errors(self.creates, e.detail)
+                    raise
+            for i, serializer in self.updates:
+                try:
+                    serializer.save()
+                except serializers.ValidationError as e:
+                    self.fail(i, status.HTTP_400_BAD_REQUEST, e.detail)
+                    raise
+            if self.deletes:
+                for _, expense in self.deletes:
+                    self.rollup_delta.remove(expense, expense.rollup_months())
+                Expense.objects.filter(pk__in=[expense.pk for _, expense in self.deletes]).delete()
+            self.rollup_delta.apply()
+
+    @property
+    def data(self):
+        if self.failed:
+            results = [result or {'op': operation.get('op'), 'status': status.HTTP_424_FAILED_DEPENDENCY}
+                       for operation, result in zip(self.operations, self.results)]
+            return {"error": "No operation was applied.", "results": results}
+        return {"results": self.results}
@@ -0,0 +1,4 @@
+def percentile(timings, fraction):
+    """The timing below which `fraction` of `timings` fall, e.g. 0.95 for the p95."""
+    timings = sorted(timings)
+    return timings[min(int(len(timings) * fraction), len(timings) - 1)]
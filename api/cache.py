@@ -0,0 +1,135 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from rest_framework.response import Response
+from functools import wraps
+from urllib.parse import urlencode
+
+from api.metrics import registry
+from api.permissions import get_account
+
+
+def version_key(account_id):
+    return f'account-version:{account_id}'
+
+
+def get_account_version(account_id):
+    key = version_key(account_id)
+    cache.add(key, 1, timeout=None)
+    return cache.get(key, 1)
+
+
+def bump_account_version(account_id):
+    """Invalidates every cached response of the account by moving it to a new version."""
+    key = version_key(account_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 2, timeout=None)
+
+
+def invalidate_account(account_id):
+    bump_account_version(account_id)
+    # Until the write commits, other requests may still cache the data from before it.
+    transaction.on_commit(lambda: bump_account_version(account_id))
+
+
+def response_key(request, view, account_id):
+    params = urlencode(sorted(request.query_params.lists()), doseq=True)
+    version = get_account_version(account_id)
+    endpoint = ':'.join([view.basename, view.action, *map(str, view.kwargs.values())])
+    # Responses depending on today's date must not outlive it.
+    return f'response:{account_id}:{version}:{timezone.localdate()}:{request.get_host()}:{endpoint}:{params}'
+
+
+def cached_response(method):
+    """
+    Caches the data of successful responses of a viewset action for the caller's account,
+    keyed by the account's version, the action and the normalized query params.
+    """
+
+    @wraps(method)
+    def wrapper(view, request, *args, **kwargs):
+        key = response_key(request, view, get_account(request).pk)
+        data = cache.get(key)
+        match = request.resolver_match
+        route = match.view_name if match else 'unmatched'
+        registry.record_cache(route, hit=data is not None)
+        if data is not None:
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+        response = method(view, request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 300))
+        response['X-Cache'] = 'MISS'
+        return response
+
+    return wrapper
+
+
+def queryset_validators(queryset, modified_field='date_modified'):
+    """
+    ETag and Last-Modified of the rows of `queryset`, from their count and latest modification.
+    Adding, changing or deleting a row changes the ETag. Deleting a row doesn't move Last-Modified.
+    """
+    values = queryset.order_by().aggregate(count=Count('pk'), last_modified=Max(modified_field))
+    last_modified = values['last_modified']
+    version = last_modified.timestamp() if last_modified else 0
+    return f'"{values["count"]}-{version}"', last_modified, values['count']
+
+
+class ConditionalGetMixin:
+    """
+    Rows whose count and `modified_field` validate the list and detail responses of a viewset:
+    the filtered rows of a list, so writes outside the filters don't change its validators, and
+    the requested row of a detail. Pages of a list share its validators, they are different URLs.
+    """
+    modified_field = 'date_modified'
+
+    def get_validator_queryset(self):
+        queryset = self.get_queryset()
+        if not self.detail:
+            return self.filter_queryset(queryset)
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            return queryset.filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        except (TypeError, ValueError, ValidationError):
+            return queryset.none()
+
+
+def conditional_response(method):
+    """
+    Answers `If-None-Match` and `If-Modified-Since` with 304 Not Modified before the action runs,
+    using the validators of a `ConditionalGetMixin` view. Detail requests of missing rows fall
+    through to the action. Lists only have an ETag: deleting one of their rows doesn't change
+    their latest modification, so Last-Modified alone would keep answering 304.
+    """
+
+    @wraps(method)
+    def wrapper(view, request, *args, **kwargs):
+        etag, last_modified, count = queryset_validators(view.get_validator_queryset(), view.modified_field)
+        if not view.detail:
+            last_modified = None
+        # JSON and MessagePack responses are different representations.
+        etag = f'{etag[:-1]}-{request.accepted_renderer.format}"'
+        if view.detail and not count:
+            return method(view, request, *args, **kwargs)
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = method(view, request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        response['ETag'] = etag
+        patch_vary_headers(response, ['Accept'])
+        if timestamp is not None:
+            response['Last-Modified'] = http_date(timestamp)
+        return response
+
+    return wrapper
@@ -0,0 +1,57 @@
+from django.utils import timezone
+from datetime import datetime, time, timedelta
+from dateutil.relativedelta import relativedelta
+
+
+def day_start(day, tz=None):
+    return timezone.make_aware(datetime.combine(day, time.min), tz or timezone.get_current_timezone())
+
+
+def day_range(day, tz=None):
+    return day_start(day, tz), day_start(day + timedelta(days=1), tz)
+
+
+def month_range(year, month, tz=None):
+    first = datetime(year, month, 1).date()
+    return day_start(first, tz), day_start(first + relativedelta(months=1), tz)
+
+
+def month_span(first, last, tz=None):
+    """The `[start, end)` range of whole months containing the datetimes `first` and `last`."""
+    first, last = timezone.localtime(first, tz), timezone.localtime(last, tz)
+    return month_range(first.year, first.month, tz)[0], month_range(last.year, last.month, tz)[1]
+
+
+def year_range(year, tz=None):
+    first = datetime(year, 1, 1).date()
+    return day_start(first, tz), day_start(first + relativedelta(years=1), tz)
+
+
+def schedule(start, step, count):
+    # Every date is offset from start, so month ends don't drift (Jan 31, Feb 28, Mar 31...).
+    return [start + step * i for i in range(count + 1)]
+
+
+def schedule_index(first, step, count, date):
+    """How many dates of `schedule(first, step, count)` fall before `date`, without walking the schedule."""
+    if date <= first:
+        return 0
+    if isinstance(step, timedelta):
+        i = (date - first) // step
+    else:
+        months = (date.year - first.year) * 12 + date.month - first.month
+        i = months // (step.years * 12 + step.months)
+    # The estimate may be off by one step around month ends and DST changes.
+    i = min(max(i, 0), count + 1)
+    while i > 0 and first + step * (i - 1) >= date:
+        i -= 1
+    while i <= count and first + step * i < date:
+        i += 1
+    return i
+
+
+def schedule_between(first, step, count, start=None, end=None):
+    """Dates of `schedule(first, step, count)` inside `[start, end)`, without walking the whole schedule."""
+    i = 0 if start is None else schedule_index(first, step, count, start)
+    stop = count + 1 if end is None else schedule_index(first, step, count, end)
+    return [first + step * i for i in range(i, stop)]
@@ -0,0 +1,73 @@
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.permissions import SAFE_METHODS
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+REPLICA = 'replica'
+
+use_replica = ContextVar('use_replica', default=False)
+
+
+def replica_configured():
+    return REPLICA in settings.DATABASES
+
+
+def pin_key(user_id):
+    return f'primary-pin:{user_id}'
+
+
+def pin_to_primary(user_id):
+    cache.set(pin_key(user_id), True, settings.REPLICA_PIN_SECONDS)
+
+
+def pinned_to_primary(user_id):
+    return cache.get(pin_key(user_id), False)
+
+
+@contextmanager
+def read_from_replica():
+    token = use_replica.set(True)
+    try:
+        yield
+    finally:
+        use_replica.reset(token)
+
+
+class ReplicaRouter:
+    """Sends reads to the `replica` database while `use_replica` is set, everything else to `default`."""
+
+    def db_for_read(self, model, **hints):
+        if use_replica.get() and replica_configured():
+            return REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary.
+        return True
+
+
+class ReplicaReadMixin:
+    """
+    Runs the safe requests of a viewset against the replica, unless the user wrote something in the
+    last REPLICA_PIN_SECONDS: those users read from the primary, so they see their own writes
+    while the replica catches up.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS and replica_configured() and not pinned_to_primary(request.user.id):
+            self.replica_token = use_replica.set(True)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, 'replica_token', None)
+        if token is not None:
+            use_replica.reset(token)
+            self.replica_token = None
+        if (request.method not in SAFE_METHODS and response.status_code < 400 and replica_configured()
+                and request.user.is_authenticated):
+            pin_to_primary(request.user.id)
+        return super().finalize_response(request, response, *args, **kwargs)
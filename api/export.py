@@ -0,0 +1,119 @@
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence
+from rest_framework.fields import DateTimeField
+from datetime import datetime
+import csv
+import heapq
+import io
+import orjson
+import re
+
+from api.models import Expense
+from api.renderers import NDJSON_OPTIONS
+
+# Rows fetched from the database at a time, and bytes of output sent at a time.
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_BUFFER_SIZE = 64 * 1024
+
+EXPENSE_FIELDS = [
+    'id', 'name', 'amount', 'category', 'recurrence', 'number_of_recurrences', 'virtual_payments',
+    'first_payment_date', 'last_payment_date', 'date_created', 'date_modified',
+]
+SCHEDULE_FIELDS = ['first_payment_date', 'recurrence', 'number_of_recurrences']
+CSV_HEADER = [*EXPENSE_FIELDS, 'payment_id', 'payment_date']
+ACCEPTS_GZIP = re.compile(r'\bgzip\b')
+
+datetime_field = DateTimeField()
+
+
+def represent(value):
+    """Dates as the API shows them, in the current time zone."""
+    return datetime_field.to_representation(value) if isinstance(value, datetime) else value
+
+
+def with_projected(expense, payments, start, end):
+    """The `(id, date)` payments of a virtual expense row with the ones projected in `[start, end)`, without id."""
+    stored = {date for _, date in payments}
+    schedule = Expense(**{field: expense[field] for field in SCHEDULE_FIELDS})
+    projected = [(None, date) for date in schedule.occurrences(start, end) if date not in stored]
+    return list(heapq.merge(payments, projected, key=lambda payment: payment[1]))
+
+
+def expenses_with_payments(expenses, payments, start=None, end=None):
+    """
+    Yields every expense of `expenses` as a values() row, with the `(id, date)` of its rows in
+    `payments`. Both are read EXPORT_CHUNK_SIZE rows at a time, in expense order, and merged,
+    so memory use doesn't depend on the number of rows. Virtual expenses also get the payments
+    projected from their schedule between `start` and `end`, as the payment list shows them.
+    """
+    expenses = expenses.prefetch_related(None).order_by('pk').values(*EXPENSE_FIELDS)
+    payments = payments.order_by('expense_id', 'date', 'pk').values_list('expense_id', 'pk', 'date')
+    payments = payments.iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    pending = next(payments, None)
+    for expense in expenses.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        own = []
+        while pending is not None and pending[0] <= expense['id']:
+            if pending[0] == expense['id']:
+                own.append(pending[1:])
+            pending = next(payments, None)
+        if expense['virtual_payments'] and expense['first_payment_date'] is not None:
+            own = with_projected(expense, own, start, end)
+        yield expense, own
+
+
+def csv_chunks(rows):
+    """A row per payment with the columns of its expense, expenses without payments get one row."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_HEADER)
+    for expense, payments in rows:
+        columns = [represent(expense[field]) for field in EXPENSE_FIELDS]
+        for payment_id, date in payments or [(None, None)]:
+            writer.writerow([*columns, payment_id, represent(date)])
+        if buffer.tell() >= EXPORT_BUFFER_SIZE:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+def ndjson_chunks(rows):
+    """A line per expense with its payments."""
+    buffer = bytearray()
+    for expense, payments in rows:
+        line = {field: represent(expense[field]) for field in EXPENSE_FIELDS}
+        line['payments'] = [{'id': payment_id, 'date': represent(date)} for payment_id, date in payments]
+        buffer += orjson.dumps(line, option=NDJSON_OPTIONS)
+        if len(buffer) >= EXPORT_BUFFER_SIZE:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+
+EXPORTS = {
+    'csv': ('text/csv; charset=utf-8', csv_chunks),
+    'ndjson': ('application/x-ndjson', ndjson_chunks),
+}
+
+
+def export_response(request, expenses, payments, export_format, start=None, end=None):
+    """
+    Streams `expenses` with their `payments`, and the projected ones from `start` to `end`, as
+    CSV or NDJSON, gzipped on the fly when the client accepts it. The queries run while the
+    response is sent.
+    """
+    content_type, chunks = EXPORTS[export_format]
+    # Read from the database the view chose, the router's state is reset once the view returns.
+    rows = expenses_with_payments(expenses.using(expenses.db), payments.using(payments.db), start, end)
+    content = chunks(rows)
+    gzip = bool(ACCEPTS_GZIP.search(request.headers.get('Accept-Encoding', '')))
+    response = StreamingHttpResponse(compress_sequence(content) if gzip else content, content_type=content_type)
+    if gzip:
+        response['Content-Encoding'] = 'gzip'
+    patch_vary_headers(response, ['Accept-Encoding'])
+    filename = f'expenses-{timezone.localdate()}.{export_format}'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,98 @@
+from django.db.models import Exists, OuterRef
+from django.db.models.constants import LOOKUP_SEP
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+from datetime import date, timedelta
+
+from api.dates import day_start, month_range, year_range
+
+
+class DateRangeFilter(BaseFilterBackend):
+    """
+    Filters the view's `date_range_field` with half-open `start <= date < end` ranges,
+    so the database can use an index on the column instead of extracting date parts.
+
+    `month` and `year` select a calendar month or year, `from` and `to` select a span
+    of days (both inclusive). When combined, the ranges are intersected. Bounds are
+    resolved in the current time zone.
+    """
+
+    def get_month_range(self, request):
+        today = timezone.localdate()
+        month = request.query_params.get('month', today.month)
+        year = request.query_params.get('year', today.year)
+        try:
+            year, month = int(year), int(month)
+        except (TypeError, ValueError, OverflowError) as e:
+            raise ValidationError({"error": f"Query must be valid integer: {e}"})
+        try:
+            return month_range(year, month)
+        except (ValueError, OverflowError) as e:
+            raise ValidationError({"error": f"Query must be a supported month: {e}"})
+
+    def get_year_range(self, request):
+        try:
+            year = int(request.query_params['year'])
+        except (TypeError, ValueError, OverflowError) as e:
+            raise ValidationError({"error": f"Query must be valid integer: {e}"})
+        try:
+            return year_range(year)
+        except (ValueError, OverflowError) as e:
+            raise ValidationError({"error": f"Query must be a supported year: {e}"})
+
+    def get_day(self, request, param):
+        try:
+            day = parse_date(request.query_params[param])
+        except ValueError:
+            day = None
+        if day is None:
+            raise ValidationError({"error": f"Query '{param}' must be a valid date (YYYY-MM-DD)."})
+        return day
+
+    def get_date_range(self, request, month_default=False):
+        """
+        Returns the `(start, end)` range requested, either bound may be None.
+        With `month_default` the range is always limited to one month, the current one
+        unless `month` or `year` are given.
+        """
+        params = request.query_params
+        start = end = None
+        if month_default or 'month' in params:
+            start, end = self.get_month_range(request)
+        elif 'year' in params:
+            start, end = self.get_year_range(request)
+        if 'from' in params:
+            day = day_start(self.get_day(request, 'from'))
+            start = day if start is None else max(start, day)
+        if 'to' in params:
+            try:
+                day = day_start(self.get_day(request, 'to') + timedelta(days=1))
+            except OverflowError:
+                raise ValidationError({"error": f"Query 'to' must be before {date.max}."})
+            end = day if end is None else min(end, day)
+        return start, end
+
+    def filter_date_range(self, queryset, field, start, end):
+        related, _, name = field.rpartition(LOOKUP_SEP)
+        lookups = {}
+        if start is not None:
+            lookups[f'{name}__gte'] = start
+        if end is not None:
+            lookups[f'{name}__lt'] = end
+        if not related:
+            return queryset.filter(**lookups)
+        # Joining a multi-valued relation would repeat rows, test for a matching row instead.
+        relation = queryset.model._meta.get_field(related)
+        rows = relation.related_model.objects.filter(**{relation.field.name: OuterRef('pk')}, **lookups)
+        return queryset.filter(Exists(rows))
+
+    def filter_queryset(self, request, queryset, view):
+        field = getattr(view, 'date_range_field', None)
+        if field is None:
+            return queryset
+        start, end = self.get_date_range(request)
+        if start is None and end is None:
+            return queryset
+        return self.filter_date_range(queryset, field, start, end)
@@ -0,0 +1,178 @@
+from django.db.models import Count, Q
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from collections import defaultdict
+from datetime import timedelta
+import numpy as np
+
+from api.dates import day_start
+from api.models import AmountModifier, Expense, Income, Payment, Recurrence
+
+# Longest horizon a forecast can cover.
+FORECAST_MAX_DAYS = 366 * 10
+
+STEP_DAYS = {Recurrence.DAILY: 1, Recurrence.WEEKLY: 7, Recurrence.BIWEEKLY: 14}
+STEP_MONTHS = {Recurrence.MONTHLY: 1, Recurrence.YEARLY: 12}
+
+
+def ramp(counts):
+    """The rule index and the position within the rule of every occurrence, for `counts` occurrences per rule."""
+    rules = np.repeat(np.arange(len(counts)), counts)
+    positions = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return rules, positions
+
+
+def day_step_totals(firsts, steps, counts, amounts, days):
+    """
+    Amounts per day of `[0, days)` of the rules occurring on day `first + step * i` for i in
+    `[0, count]`, with the days counted from the start of the horizon.
+    """
+    first_step = np.maximum(0, -(firsts // steps))
+    last_step = np.minimum(counts, (days - 1 - firsts) // steps)
+    occurrences = np.maximum(last_step - first_step + 1, 0)
+    rules, positions = ramp(occurrences)
+    offsets = firsts[rules] + steps[rules] * (first_step[rules] + positions)
+    return np.bincount(offsets, weights=amounts[rules], minlength=days)
+
+
+def month_step_totals(firsts, steps, counts, amounts, start, days):
+    """
+    Like day_step_totals for rules stepping `step` months from the date `first`, with the day
+    clamped to the end of shorter months, as `first + relativedelta(months=step * i)` does.
+    """
+    end = start + np.timedelta64(days - 1, 'D')
+    first_months = firsts.astype('datetime64[M]').astype(np.int64)
+    day_of_month = (firsts - firsts.astype('datetime64[M]').astype('datetime64[D]')).astype(np.int64)
+    start_month, end_month = (np.datetime64(date, 'M').astype(np.int64) for date in (start, end))
+    first_step = np.maximum(0, -((first_months - start_month) // steps))
+    last_step = np.minimum(counts, (end_month - first_months) // steps)
+    occurrences = np.maximum(last_step - first_step + 1, 0)
+    rules, positions = ramp(occurrences)
+    months = first_months[rules] + steps[rules] * (first_step[rules] + positions)
+    month_starts = months.astype('datetime64[M]').astype('datetime64[D]')
+    month_lengths = ((months + 1).astype('datetime64[M]').astype('datetime64[D]') - month_starts).astype(np.int64)
+    dates = month_starts + np.minimum(day_of_month[rules], month_lengths - 1)
+    offsets = (dates - start).astype(np.int64)
+    # The first and last months of the horizon may be partial.
+    inside = (offsets >= 0) & (offsets < days)
+    return np.bincount(offsets[inside], weights=amounts[rules][inside], minlength=days)
+
+
+def daily_totals(rules, start, days):
+    """
+    Amounts per day of the horizon of `rules`, `(first date, recurrence, number_of_recurrences, amount)`
+    tuples. Recurrences without a step, i.e. once, only occur on their first date.
+    """
+    totals = np.zeros(days)
+    by_unit = {'days': [], 'months': []}
+    for first, recurrence, count, amount in rules:
+        if recurrence in STEP_MONTHS:
+            by_unit['months'].append((first, STEP_MONTHS[recurrence], max(count, 0), amount))
+        else:
+            step, count = (STEP_DAYS[recurrence], max(count, 0)) if recurrence in STEP_DAYS else (1, 0)
+            by_unit['days'].append((first, step, count, amount))
+    for unit, unit_rules in by_unit.items():
+        if not unit_rules:
+            continue
+        firsts, steps, counts, amounts = (np.array(column) for column in zip(*unit_rules))
+        firsts = firsts.astype('datetime64[D]')
+        steps, counts = steps.astype(np.int64), counts.astype(np.int64)
+        amounts = amounts.astype(np.float64)
+        if unit == 'days':
+            totals += day_step_totals((firsts - start).astype(np.int64), steps, counts, amounts, days)
+        else:
+            totals += month_step_totals(firsts, steps, counts, amounts, start, days)
+    return totals
+
+
+def modified_amount(amount, modifiers):
+    for modifier in modifiers:
+        amount = modifier.percent_formula(amount)
+    return amount
+
+
+def account_modifiers(account):
+    """The modifiers of the account's incomes and expenses by `('income', pk)` or `('expense', pk)`."""
+    modifiers = defaultdict(list)
+    for modifier in AmountModifier.objects.filter(Q(income__account=account) | Q(expense__account=account)):
+        key = ('income', modifier.income_id) if modifier.income_id is not None else ('expense', modifier.expense_id)
+        modifiers[key].append(modifier)
+    return modifiers
+
+
+def account_rules(account, modifiers):
+    """
+    The `(income rules, expense rules)` of the account for daily_totals, with their modifiers applied.
+    Only virtual expenses have rules, the others occur on their stored payments. Incomes without a
+    first payment date are left out.
+    """
+    virtual = (
+        Expense.objects.filter(account=account, virtual_payments=True, first_payment_date__isnull=False)
+        .values_list('pk', 'first_payment_date', 'recurrence', 'number_of_recurrences', 'amount')
+    )
+    incomes = Income.objects.filter(account=account, first_payment_date__isnull=False).values_list(
+        'pk', 'first_payment_date', 'recurrence', 'number_of_recurrences', 'amount',
+    )
+    return [
+        [
+            (timezone.localtime(first).date(), recurrence, count, modified_amount(amount, modifiers[(kind, pk)]))
+            for pk, first, recurrence, count, amount in rows
+        ]
+        for kind, rows in [('income', incomes), ('expense', virtual)]
+    ]
+
+
+def stored_totals(account, modifiers, start, days):
+    """
+    Amounts per day of the horizon of the stored payments of the account's other expenses, as edited.
+    The database counts them per expense and local day, the modifiers apply once per expense.
+    """
+    end = start + timedelta(days=days)
+    rows = (
+        Payment.objects.filter(
+            expense__account=account, expense__virtual_payments=False,
+            date__gte=day_start(start), date__lt=day_start(end),
+        )
+        .annotate(day=TruncDate('date'))
+        .order_by()
+        .values('expense_id', 'day', 'expense__amount')
+        .annotate(count=Count('pk'))
+        .values_list('expense_id', 'day', 'expense__amount', 'count')
+    )
+    columns = list(zip(*rows))
+    if not columns:
+        return np.zeros(days)
+    expense_ids, dates, amounts, counts = (np.array(column) for column in columns)
+    expenses, first_rows, rows_expense = np.unique(expense_ids, return_index=True, return_inverse=True)
+    modified = np.array([
+        modified_amount(amount, modifiers[('expense', pk)])
+        for pk, amount in zip(expenses.tolist(), amounts[first_rows].tolist())
+    ], dtype=np.float64)
+    offsets = (dates.astype('datetime64[D]') - np.datetime64(start, 'D')).astype(np.int64)
+    return np.bincount(offsets, weights=modified[rows_expense] * counts, minlength=days)
+
+
+def cash_flow(account, start, days, granularity='daily', opening_balance=0):
+    """
+    Income, expenses, net cash flow and running balance of the account for each day, or month,
+    of the `days` days from the date `start`.
+    """
+    modifiers = account_modifiers(account)
+    incomes, expenses = account_rules(account, modifiers)
+    spent = stored_totals(account, modifiers, start, days)
+    start = np.datetime64(start, 'D')
+    income = daily_totals(incomes, start, days)
+    spent += daily_totals(expenses, start, days)
+    dates = start + np.arange(days)
+    if granularity == 'monthly':
+        months = dates.astype('datetime64[M]')
+        boundaries = np.flatnonzero(np.r_[True, months[1:] != months[:-1]])
+        income, spent = np.add.reduceat(income, boundaries), np.add.reduceat(spent, boundaries)
+        dates = months[boundaries]
+    net = income - spent
+    balance = opening_balance + np.cumsum(net)
+    columns = [np.round(column, 2).tolist() for column in (income, spent, net, balance)]
+    return [
+        {'date': date, 'income': i, 'expenses': e, 'net': n, 'balance': b}
+        for date, i, e, n, b in zip(dates.astype(str).tolist(), *columns)
+    ]
@@ -0,0 +1,161 @@
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import serializers
+import csv
+import orjson
+import os
+
+from api.models import Expense
+from api.serializers import RECURRENCES_OVERFLOW, ExpenseListSerializer, ExpenseSerializer
+from api.sqlite import retry_on_busy
+
+# Expenses inserted per transaction, and row errors kept for the report, the rest are only counted.
+IMPORT_BATCH_SIZE = 500
+IMPORT_MAX_ERRORS = 1000
+
+CONTENT_TYPES = {'text/csv': 'csv', 'application/x-ndjson': 'ndjson', 'application/jsonl': 'ndjson'}
+EXTENSIONS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}
+
+
+def detect_format(name=None, content_type=None):
+    """'csv' or 'ndjson' from a file name or a content type, None when it is neither."""
+    if name:
+        return EXTENSIONS.get(os.path.splitext(name)[1].lower())
+    if content_type:
+        return CONTENT_TYPES.get(content_type.split(';')[0].strip().lower())
+    return None
+
+
+def decode_lines(stream, invalid):
+    """
+    The lines of a UTF-8 binary stream as text. Lines that aren't valid UTF-8 are decoded with
+    replacement characters and their numbers added to `invalid`.
+    """
+    for number, line in enumerate(stream, 1):
+        try:
+            yield line.decode('utf-8-sig' if number == 1 else 'utf-8')
+        except UnicodeDecodeError:
+            invalid.add(number)
+            yield line.decode('utf-8', errors='replace')
+
+
+def read_csv(stream):
+    """
+    Yields `(line number, row, error)` for the rows of a CSV binary stream, a line at a time.
+    Empty cells are left out so the fields get their defaults. Rows repeating the `id` of the
+    previous one are the other payments of the same expense in an export, and are skipped.
+    Rows that aren't valid UTF-8 or can't be parsed, e.g. with a field over the csv module's
+    field size limit, are errors.
+    """
+    invalid = set()
+    reader = csv.DictReader(decode_lines(stream, invalid))
+    previous = None
+    while True:
+        # The lines read by the underlying reader, DictReader only updates its own count on success.
+        first_line = reader.reader.line_num + 1
+        try:
+            row = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as exc:
+            yield reader.reader.line_num, None, {'error': [f"CSV parse error - {exc}"]}
+            continue
+        if any(number in invalid for number in range(first_line, reader.line_num + 1)):
+            yield reader.line_num, None, {'error': ["The row isn't valid UTF-8."]}
+            continue
+        if row.get('id') and row['id'] == previous:
+            continue
+        previous = row.get('id')
+        yield reader.line_num, {name: value for name, value in row.items() if name and value}, None
+
+
+def read_ndjson(stream):
+    """Yields `(line number, row, error)` for the lines of a newline delimited JSON binary stream."""
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = orjson.loads(line)
+        except orjson.JSONDecodeError as exc:
+            yield number, None, {'error': [f"JSON parse error - {exc}"]}
+            continue
+        if not isinstance(row, dict):
+            yield number, None, {'error': ["Expected an object."]}
+            continue
+        yield number, row, None
+
+
+READERS = {'csv': read_csv, 'ndjson': read_ndjson}
+
+
+class ExpenseImporter:
+    """
+    Imports expense rows into an account. Rows are validated with the fields of ExpenseSerializer,
+    plus `payment_date` (or `first_payment_date`, as exported), and inserted together with their
+    payments in transactions of `batch_size` expenses. Invalid rows are reported and skipped.
+    """
+
+    def __init__(self, account, batch_size=IMPORT_BATCH_SIZE):
+        self.account = account
+        self.batch_size = batch_size
+        self.created = 0
+        self.failed = 0
+        self.errors = []
+
+    def run(self, rows):
+        validator = ExpenseSerializer()
+        batch, dates = [], []
+        for number, row, errors in rows:
+            if errors is None:
+                attrs, payment_date, errors = self.validate(validator, row)
+            if errors is not None:
+                self.failed += 1
+                if len(self.errors) < IMPORT_MAX_ERRORS:
+                    self.errors.append({'row': number, 'errors': errors})
+                continue
+            batch.append(attrs)
+            dates.append(payment_date)
+            if len(batch) >= self.batch_size:
+                self.insert(batch, dates)
+                batch, dates = [], []
+        if batch:
+            self.insert(batch, dates)
+        return self
+
+    def validate(self, validator, row):
+        row = dict(row)
+        row.pop('account', None)
+        value = row.pop('payment_date', None) or row.get('first_payment_date')
+        try:
+            payment_date = timezone.now() if value is None else parse_datetime(str(value))
+        except ValueError:
+            payment_date = None
+        if payment_date is None:
+            return None, None, {'payment_date': ["Expected YYYY-MM-DD HH:MM:SS or ISO 8601."]}
+        if timezone.is_naive(payment_date):
+            payment_date = timezone.make_aware(payment_date)
+        else:
+            # Schedules step through the local calendar, not the fixed offset of an ISO 8601 date.
+            payment_date = timezone.localtime(payment_date)
+        try:
+            attrs = validator.run_validation(row)
+        except serializers.ValidationError as exc:
+            return None, None, exc.detail
+        try:
+            Expense(**attrs).schedule_payments(payment_date)
+        except (ValueError, OverflowError):
+            return None, None, {'number_of_recurrences': [RECURRENCES_OVERFLOW]}
+        return attrs, payment_date, None
+
+    @retry_on_busy
+    def insert(self, batch, dates):
+        serializer = ExpenseListSerializer(child=ExpenseSerializer(), context={'payment_dates': dates})
+        with transaction.atomic():
+            # Each batch updates the rollups it affects as it commits.
+            serializer.create([dict(attrs, account=self.account) for attrs in batch])
+        self.created += len(batch)
+
+    @property
+    def report(self):
+        return {'created': self.created, 'failed': self.failed, 'errors': self.errors}
@@ -0,0 +1,117 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from dateutil.relativedelta import relativedelta
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from time import perf_counter
+import asyncio
+
+from api.models import Account, Expense, Recurrence
+from api.rollups import rebuild_rollups
+from api.serializers import AccountTokenObtainPairSerializer
+
+ENDPOINTS = [
+    'api:expenses-list',
+    'api:expenses-expenses-by-month',
+    'api:expenses-expenses-so-far',
+    'api:payments-list',
+    'api:payments-upcoming-payments',
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the concurrent throughput of the read endpoints served in this process by the WSGI "
+        "application (a thread per concurrent client) and by the ASGI application (one event loop). "
+        "Run it again with ASYNC_VIEWS=1 to measure the coroutine views. The response cache is "
+        "disabled. Needs a migrated database, the sample data is deleted afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--expenses', type=int, default=200)
+        parser.add_argument('--requests', type=int, default=200, help="Requests per endpoint.")
+        parser.add_argument('--concurrency', type=int, default=16)
+
+    def handle(self, *args, **options):
+        user = User.objects.create_user(username="benchmark_asgi")
+        try:
+            self.seed(Account.objects.create(owner=user), options['expenses'])
+            token = str(AccountTokenObtainPairSerializer.get_token(user).access_token)
+            self.stdout.write(f"ASYNC_VIEWS={int(settings.ASYNC_VIEWS)}, concurrency {options['concurrency']}")
+            caches = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+            with override_settings(CACHES=caches):
+                for name in ENDPOINTS:
+                    paths = [reverse(name)] * options['requests']
+                    for server, run in [("WSGI", self.run_wsgi), ("ASGI", self.run_asgi)]:
+                        started = perf_counter()
+                        statuses = run(paths, token, options['concurrency'])
+                        elapsed = perf_counter() - started
+                        errors = sum(status != 200 for status in statuses)
+                        self.stdout.write(
+                            f"{server} {paths[0]}: {len(paths) / elapsed:.0f} req/s, {errors} errors"
+                        )
+        finally:
+            user.delete()
+
+    def seed(self, account, expenses):
+        first = timezone.now() - relativedelta(months=6)
+        for i in range(expenses):
+            expense = Expense.objects.create(name=f"Expense {i}", account=account, amount=i % 500,
+                                             recurrence=Recurrence.MONTHLY, number_of_recurrences=11)
+            expense.create_payments(expense.schedule_payments(first + relativedelta(days=i % 28)))
+            expense.save(update_fields=['first_payment_date', 'last_payment_date'])
+        rebuild_rollups(account)
+
+    def run_wsgi(self, paths, token, concurrency):
+        application = get_wsgi_application()
+
+        def call(path):
+            statuses = []
+            environ = {
+                'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '', 'SERVER_NAME': 'localhost',
+                'SERVER_PORT': '80', 'HTTP_HOST': 'localhost', 'HTTP_AUTHORIZATION': f'Bearer {token}',
+                'wsgi.input': BytesIO(), 'wsgi.url_scheme': 'http', 'wsgi.errors': self.stderr,
+            }
+            result = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+            try:
+                b''.join(result)
+            finally:
+                result.close()
+            return int(statuses[0].split()[0])
+
+        with ThreadPoolExecutor(concurrency) as pool:
+            return list(pool.map(call, paths))
+
+    def run_asgi(self, paths, token, concurrency):
+        application = get_asgi_application()
+
+        async def call(path, semaphore):
+            messages = []
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'',
+                'root_path': '', 'server': ('localhost', 80), 'client': ('127.0.0.1', 0),
+                'headers': [(b'host', b'localhost'), (b'authorization', f'Bearer {token}'.encode())],
+            }
+
+            async def receive():
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+            async def send(message):
+                messages.append(message)
+
+            async with semaphore:
+                await application(scope, receive, send)
+            return messages[0]['status']
+
+        async def run():
+            semaphore = asyncio.Semaphore(concurrency)
+            return await asyncio.gather(*(call(path, semaphore) for path in paths))
+
+        return asyncio.run(run())
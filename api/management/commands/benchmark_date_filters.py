@@ -0,0 +1,66 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from dateutil.relativedelta import relativedelta
+from time import perf_counter
+
+from api.dates import month_range
+from api.models import Account, Expense, Payment
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares query plans and timings of month filters written with date part extraction "
+        "(__month/__year) against half-open date ranges. Sample data is rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--expenses', type=int, default=5000)
+        parser.add_argument('--payments', type=int, default=12, help="Payments per expense.")
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            account = self.seed(options['expenses'], options['payments'])
+            today = timezone.localdate()
+            start, end = month_range(today.year, today.month)
+            extraction = {"payments__date__month": today.month, "payments__date__year": today.year}
+            payments = Payment.objects.filter(expense=OuterRef('pk'), date__gte=start, date__lt=end)
+            queries = [
+                ("expenses, before (__month/__year)", account.expenses.filter(**extraction).distinct()),
+                ("expenses, after (range)", account.expenses.filter(Exists(payments))),
+                ("payments, before (__month/__year)",
+                 Payment.objects.filter(date__month=today.month, date__year=today.year)),
+                ("payments, after (range)", Payment.objects.filter(date__gte=start, date__lt=end)),
+            ]
+            for name, queryset in queries:
+                self.report(name, queryset, options['repeat'])
+            transaction.set_rollback(True)
+
+    def seed(self, expenses, payments):
+        user = User.objects.create_user(username="benchmark_date_filters")
+        account = Account.objects.create(owner=user)
+        categories = Expense.Category.values
+        rows = Expense.objects.bulk_create(
+            Expense(name=f"Expense {i}", account=account, amount=i % 500, category=categories[i % len(categories)])
+            for i in range(expenses)
+        )
+        first = timezone.now() - relativedelta(months=payments // 2)
+        Payment.objects.bulk_create(
+            (Payment(expense=expense, date=first + relativedelta(months=i)) for expense in rows for i in range(payments)),
+            batch_size=1000,
+        )
+        return account
+
+    def report(self, name, queryset, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = perf_counter()
+            count = queryset.count()
+            timings.append(perf_counter() - started)
+        timings.sort()
+        self.stdout.write(self.style.MIGRATE_HEADING(name))
+        self.stdout.write(queryset.explain())
+        self.stdout.write(f"rows: {count}, median: {timings[len(timings) // 2] * 1000:.2f} ms\n\n")
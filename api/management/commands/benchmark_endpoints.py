@@ -0,0 +1,139 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, get_resolver, reverse
+from django.utils import timezone
+from time import perf_counter
+import json
+import subprocess
+
+from api import urls
+from api.benchmarks import percentile
+from api.models import Expense, Payment
+from api.seeding import seed
+from api.serializers import AccountTokenObtainPairSerializer
+
+# Query strings of the routes that need one to do any work.
+QUERIES = {
+    'expenses-expenses-by-category': '?category=FO',
+}
+
+
+def flatten(patterns):
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            yield from flatten(pattern.url_patterns)
+        else:
+            yield pattern
+
+
+def count_rows(data):
+    """Serialized objects in a response: the dicts with an id, at any depth."""
+    if isinstance(data, list):
+        return sum(count_rows(item) for item in data)
+    if isinstance(data, dict):
+        return ('id' in data) + sum(count_rows(value) for value in data.values())
+    return 0
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=settings.BASE_DIR).stdout.strip() or None
+    except OSError:
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "GETs every route of api/urls.py through the test client and reports p50/p95 latency, SQL "
+        "queries and serialized rows as JSON, to compare runs across commits. Uses a seeded account, "
+        "or --username, and the response cache is disabled. Every run is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--expenses', type=int, default=500, help="Expenses of the seeded account.")
+        parser.add_argument('--username', help="Benchmark an existing user instead of seeding one.")
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--output', help="JSON file, stdout by default.")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options['username']:
+                user = User.objects.filter(username=options['username'], account__isnull=False).first()
+                if user is None:
+                    raise CommandError(f"User '{options['username']}' with an account not found.")
+            else:
+                account = seed(1, options['expenses'], prefix='benchmark_endpoints').get()
+                user = account.owner
+            expenses = Expense.objects.filter(account__owner=user).count()
+            results = self.run(user, options['repeat'])
+            transaction.set_rollback(True)
+
+        report = json.dumps({
+            'commit': git_commit(),
+            'date': timezone.now().isoformat(),
+            'expenses': expenses,
+            'repeat': options['repeat'],
+            'endpoints': results,
+        }, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(report + '\n')
+        else:
+            self.stdout.write(report)
+
+    def get_paths(self, user):
+        objects = {
+            'expenses': Expense.objects.filter(account__owner=user).first(),
+            'payments': Payment.objects.filter(expense__account__owner=user).first(),
+        }
+        prefix = get_resolver().namespace_dict[urls.app_name][0]
+        paths = {}
+        for pattern in flatten(urls.urlpatterns):
+            params = pattern.pattern.regex.groupindex
+            actions = getattr(pattern.callback, 'actions', None)
+            if 'format' in params or (actions is not None and 'get' not in actions):
+                continue
+            if pattern.name is None:
+                path = f'/{prefix}{pattern.pattern}'
+                paths.setdefault(path, path)
+                continue
+            if params:
+                instance = objects.get(pattern.name.rsplit('-', 1)[0])
+                if instance is None:
+                    continue
+                path = reverse(f'{urls.app_name}:{pattern.name}', kwargs={name: instance.pk for name in params})
+            else:
+                path = reverse(f'{urls.app_name}:{pattern.name}')
+            paths.setdefault(path + QUERIES.get(pattern.name, ''), pattern.name)
+        return paths
+
+    def run(self, user, repeat):
+        token = str(AccountTokenObtainPairSerializer.get_token(user).access_token)
+        client = Client(HTTP_AUTHORIZATION=f'Bearer {token}')
+        caches = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+        results = []
+        with override_settings(CACHES=caches, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for path, name in self.get_paths(user).items():
+                client.get(path)
+                timings = []
+                for _ in range(repeat):
+                    with CaptureQueriesContext(connection) as queries:
+                        started = perf_counter()
+                        response = client.get(path)
+                        timings.append(perf_counter() - started)
+                rows = count_rows(response.json()) if response.get('Content-Type') == 'application/json' else 0
+                results.append({
+                    'name': name,
+                    'path': path,
+                    'status': response.status_code,
+                    'p50_ms': round(percentile(timings, 0.5) * 1000, 2),
+                    'p95_ms': round(percentile(timings, 0.95) * 1000, 2),
+                    'queries': len(queries),
+                    'rows': rows,
+                })
+        return results
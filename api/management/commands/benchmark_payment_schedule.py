@@ -0,0 +1,59 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from dateutil.relativedelta import relativedelta
+from time import perf_counter
+
+from api.models import Account, Expense, Payment, Recurrence
+
+
+class QueryLogger:
+
+    def __init__(self, queries):
+        self.queries = queries
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append(sql)
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = (
+        "Times creating one recurring expense with a row-per-query payment loop against the "
+        "bulk schedule used by ExpenseSerializer. Every run is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recurrences', type=int, default=10000)
+        parser.add_argument('--recurrence', default=Recurrence.DAILY, choices=Recurrence.values)
+
+    def handle(self, *args, **options):
+        for name, create in [("row by row", self.create_row_by_row), ("bulk schedule", self.create_bulk)]:
+            with transaction.atomic():
+                user = User.objects.create_user(username="benchmark_payment_schedule")
+                account = Account.objects.create(owner=user)
+                queries = []
+                with connection.execute_wrapper(QueryLogger(queries)):
+                    started = perf_counter()
+                    expense = create(account, options['recurrence'], options['recurrences'])
+                    elapsed = perf_counter() - started
+                payments = expense.payments.count()
+                transaction.set_rollback(True)
+            self.stdout.write(f"{name}: {payments} payments, {len(queries)} queries, {elapsed * 1000:.1f} ms")
+
+    def create_row_by_row(self, account, recurrence, recurrences):
+        first_date = timezone.now()
+        expense = Expense.objects.create(name="Benchmark", account=account, amount=100,
+                                         recurrence=recurrence, number_of_recurrences=recurrences)
+        Payment.objects.create(expense=expense, date=first_date)
+        for i in range(recurrences):
+            Payment.objects.create(expense=expense, date=first_date + relativedelta(months=i + 1))
+        return expense
+
+    def create_bulk(self, account, recurrence, recurrences):
+        with transaction.atomic():
+            expense = Expense.objects.create(name="Benchmark", account=account, amount=100,
+                                             recurrence=recurrence, number_of_recurrences=recurrences)
+            expense.create_payments(expense.payment_dates(timezone.now()))
+        return expense
@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from time import perf_counter
+
+from api.models import Expense, Payment
+from api.renderers import MessagePackRenderer, ORJSONRenderer
+from api.seeding import seed
+from api.serializers import ExpenseSerializer, PaymentSerializer
+
+RENDERERS = [
+    ("JSONRenderer", JSONRenderer),
+    ("ORJSONRenderer", ORJSONRenderer),
+    ("MessagePackRenderer", MessagePackRenderer),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures the encode time and size of expenses_by_month and paginated payments responses of "
+        "--rows rows with each renderer. Only rendering is timed, the data is serialized beforehand. "
+        "The sample data is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000])
+        parser.add_argument('--repeat', type=int, default=5, help="Runs of each case, the best one is reported.")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            accounts = seed(1, max(options['rows']), prefix='benchmark_renderers', random_seed=0)
+            expenses = Expense.objects.filter(account__in=accounts).prefetch_related('payments')
+            payments = Payment.objects.filter(expense__account__in=accounts).select_related('expense')
+            for rows in options['rows']:
+                responses = [
+                    ("expenses_by_month", {
+                        'month': "April",
+                        'expenses': ExpenseSerializer(expenses[:rows], many=True).data,
+                        'total': 0,
+                    }),
+                    ("payments", {
+                        'count': rows, 'next': None, 'previous': None,
+                        'results': PaymentSerializer(payments[:rows], many=True).data,
+                        'total': 0, 'page_total': 0,
+                    }),
+                ]
+                for label, data in responses:
+                    baseline = None
+                    for name, renderer_class in RENDERERS:
+                        seconds, content = self.measure(options['repeat'], renderer_class().render, data)
+                        baseline = baseline or seconds
+                        self.stdout.write(
+                            f"{label} ({rows} rows) {name:<20} {seconds * 1000:>8.1f} ms "
+                            f"{len(content) / 1024:>8.0f} KiB  {baseline / seconds:>5.1f}x"
+                        )
+            transaction.set_rollback(True)
+
+    def measure(self, repeat, render, data):
+        timings = []
+        for _ in range(repeat):
+            started = perf_counter()
+            content = render(data)
+            timings.append(perf_counter() - started)
+        return min(timings), content
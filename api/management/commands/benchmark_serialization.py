@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from time import perf_counter
+
+from api.models import Expense, Payment
+from api.seeding import seed
+from api.serializers import ExpenseSerializer, PaymentSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Renders the same rows as JSON through the serializers and from .values() rows, as the list "
+        "endpoints do, checks that both give identical output and reports the time each takes, "
+        "queries included. The sample data is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help="Expenses, and payments, per response.")
+        parser.add_argument('--repeat', type=int, default=3, help="Runs of each case, the best one is reported.")
+        parser.add_argument('--fields', default='id,name,amount', help="Sparse fieldset of the expenses.")
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        with transaction.atomic():
+            accounts = seed(1, rows, prefix='benchmark_serialization', random_seed=0)
+            expenses = Expense.objects.filter(account__in=accounts).prefetch_related('payments')
+            payments = Payment.objects.filter(expense__account__in=accounts).select_related('expense')[:rows]
+            cases = [
+                ("expenses", ExpenseSerializer, expenses, None),
+                (f"expenses ?fields={options['fields']}", ExpenseSerializer, expenses, options['fields'].split(',')),
+                ("payments", PaymentSerializer, payments, None),
+            ]
+            for label, serializer_class, queryset, fields in cases:
+                regular, expected = self.measure(options['repeat'], lambda: JSONRenderer().render(
+                    serializer_class(queryset.all(), many=True, fields=fields).data
+                ))
+                serializer = serializer_class(fields=fields)
+                values, content = self.measure(options['repeat'], lambda: JSONRenderer().render(
+                    serializer.values_data(serializer.values_queryset(queryset.all()))
+                ))
+                if content != expected:
+                    raise CommandError(f"{label}: the values() output differs from the serializer's.")
+                self.stdout.write(
+                    f"{label} ({rows} rows, {len(content) / 1024:.0f} KiB): serializer {regular * 1000:.0f} ms, "
+                    f"values() {values * 1000:.0f} ms, {regular / values:.1f}x faster, identical output"
+                )
+            transaction.set_rollback(True)
+
+    def measure(self, repeat, function):
+        timings = []
+        for _ in range(repeat):
+            started = perf_counter()
+            result = function()
+            timings.append(perf_counter() - started)
+        return min(timings), result
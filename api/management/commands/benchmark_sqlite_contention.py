@@ -0,0 +1,99 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections
+from django.test import override_settings
+from django.utils import timezone
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import os
+
+from api import sqlite
+from api.benchmarks import percentile
+from api.models import Account, Recurrence
+from api.serializers import ExpenseSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs concurrent writers creating recurring expenses through ExpenseSerializer against a fresh "
+        "SQLite database, with the default settings and with SQLITE_TUNED_PRAGMAS, and reports "
+        "throughput, create latency, busy retries and lock errors. The configured database is not touched."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8)
+        parser.add_argument('--expenses', type=int, default=50, help="Expenses created by each writer.")
+        parser.add_argument('--recurrences', type=int, default=24)
+        parser.add_argument('--retries', type=int, default=sqlite.BUSY_RETRIES,
+                            help="Busy retries of the create path, 0 disables them.")
+
+    def handle(self, *args, **options):
+        database = connections.settings['default']
+        if database['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError("The default database isn't SQLite.")
+        name, retries = database['NAME'], sqlite.BUSY_RETRIES
+        sqlite.BUSY_RETRIES = options['retries']
+        try:
+            for profile, pragmas in [("default", {}), ("tuned", settings.SQLITE_TUNED_PRAGMAS)]:
+                with TemporaryDirectory() as directory, override_settings(SQLITE_PRAGMAS=pragmas):
+                    connections.close_all()
+                    database['NAME'] = os.path.join(directory, 'db.sqlite3')
+                    call_command('migrate', verbosity=0)
+                    self.report(profile, self.run(options))
+                    connections.close_all()
+        finally:
+            database['NAME'] = name
+            sqlite.BUSY_RETRIES = retries
+
+    def run(self, options):
+        users = User.objects.bulk_create(
+            User(username=f"benchmark_sqlite_{i}") for i in range(options['writers'])
+        )
+        accounts = [Account.objects.create(owner=User.objects.get(username=user.username)) for user in users]
+        connections.close_all()
+        data = {
+            'name': "Benchmark", 'amount': 100, 'category': 'UT',
+            'recurrence': Recurrence.MONTHLY, 'number_of_recurrences': options['recurrences'],
+        }
+        payment_date = timezone.localtime().strftime("%Y-%m-%d %H:%M:%S")
+
+        def write(account):
+            timings, errors = [], Counter()
+            try:
+                for _ in range(options['expenses']):
+                    started = perf_counter()
+                    serializer = ExpenseSerializer(data=data, context={'payment_date': payment_date})
+                    serializer.is_valid(raise_exception=True)
+                    try:
+                        serializer.save(account=account)
+                    except OperationalError as e:
+                        errors[str(e)] += 1
+                    timings.append(perf_counter() - started)
+            finally:
+                connections.close_all()
+            return timings, errors
+
+        sqlite.stats.clear()
+        started = perf_counter()
+        with ThreadPoolExecutor(len(accounts)) as pool:
+            results = list(pool.map(write, accounts))
+        elapsed = perf_counter() - started
+        timings = [seconds for thread_timings, _ in results for seconds in thread_timings]
+        errors = sum((thread_errors for _, thread_errors in results), Counter())
+        return elapsed, timings, errors, sqlite.stats['retries']
+
+    def report(self, profile, results):
+        elapsed, timings, errors, retries = results
+        created = len(timings) - sum(errors.values())
+        self.stdout.write(self.style.MIGRATE_HEADING(profile))
+        self.stdout.write(
+            f"{created}/{len(timings)} expenses in {elapsed:.2f} s, {created / elapsed:.0f} creates/s, "
+            f"p50 {percentile(timings, 0.5) * 1000:.1f} ms, p95 {percentile(timings, 0.95) * 1000:.1f} ms, "
+            f"{retries} busy retries"
+        )
+        for message, count in errors.most_common():
+            self.stdout.write(self.style.ERROR(f"{count:>6}  {message}"))
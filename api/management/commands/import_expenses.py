@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+from time import perf_counter
+import json
+import sys
+
+from api.imports import IMPORT_BATCH_SIZE, READERS, ExpenseImporter, detect_format
+from api.models import Account
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports the expenses of a CSV or NDJSON file into a user's account, like "
+        "POST /api/expenses/import/. The file is read a line at a time and the expenses are "
+        "inserted in batches; invalid rows are reported and skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or NDJSON file, - for the standard input.")
+        parser.add_argument('--username', required=True, help="Owner of the account to import into.")
+        parser.add_argument('--format', choices=sorted(READERS),
+                            help="Format of the file, by default from its extension.")
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE, help="Expenses per transaction.")
+
+    def handle(self, *args, **options):
+        account = Account.objects.filter(owner__username=options['username']).first()
+        if account is None:
+            raise CommandError(f"User '{options['username']}' has no account.")
+        path = options['path']
+        import_format = options['format'] or detect_format(name=path)
+        if import_format is None:
+            raise CommandError("Can't tell the format from the file name, pass --format.")
+
+        started = perf_counter()
+        stream = sys.stdin.buffer if path == '-' else open(path, 'rb')
+        try:
+            importer = ExpenseImporter(account, options['batch_size']).run(READERS[import_format](stream))
+        finally:
+            if stream is not sys.stdin.buffer:
+                stream.close()
+        elapsed = perf_counter() - started
+
+        for error in importer.errors:
+            self.stderr.write(f"line {error['row']}: {json.dumps(error['errors'])}")
+        if importer.failed > len(importer.errors):
+            self.stderr.write(f"... and {importer.failed - len(importer.errors)} more rows with errors")
+        self.stdout.write(
+            f"Imported {importer.created} expenses in {elapsed:.2f} s, {importer.failed} rows with errors"
+        )
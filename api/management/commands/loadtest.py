@@ -0,0 +1,188 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from time import perf_counter
+from urllib.error import HTTPError, URLError
+from urllib.parse import urljoin
+from urllib.request import Request, urlopen
+import json
+import random
+import re
+
+from api.benchmarks import percentile
+from api.models import Expense, Recurrence
+
+# (operation, weight) of the requests a simulated user makes after logging in.
+SCENARIO = [
+    ('create_expense', 15),
+    ('create_recurring_expense', 5),
+    ('expenses_by_month', 20),
+    ('upcoming_payments', 20),
+    ('expenses_page', 20),
+    ('payments_cursor', 20),
+]
+EXCEPTION_VALUE = re.compile(r'<pre class="exception_value">(.*?)</pre>', re.S)
+
+
+def error_message(status, body):
+    """A short description of a failed request, e.g. the exception of Django's debug page."""
+    text = body.decode(errors='replace')
+    match = EXCEPTION_VALUE.search(text)
+    if match:
+        text = match.group(1)
+    return f"{status} {' '.join(text.split())[:120]}"
+
+
+class SimulatedUser:
+
+    def __init__(self, base_url, username, password, rng):
+        self.base_url = base_url
+        self.username = username
+        self.password = password
+        self.rng = rng
+        self.token = None
+        self.results = []
+
+    def request(self, operation, method, path, data=None):
+        url = urljoin(self.base_url, path)
+        headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        body = json.dumps(data).encode() if data is not None else None
+        started = perf_counter()
+        try:
+            with urlopen(Request(url, body, headers, method=method), timeout=60) as response:
+                status, content = response.status, response.read()
+        except HTTPError as e:
+            status, content = e.code, e.read()
+        except (URLError, OSError) as e:
+            status, content = None, str(getattr(e, 'reason', e)).encode()
+        elapsed = perf_counter() - started
+        error = None if status is not None and status < 400 else error_message(status, content)
+        self.results.append((operation, elapsed, error))
+        return json.loads(content) if error is None and content else None
+
+    def login(self):
+        credentials = {'username': self.username, 'password': self.password}
+        # 400 when the user is left over from a previous run, the token request still works.
+        self.request('register', 'POST', '/api/', credentials)
+        operation, _, error = self.results[-1]
+        if error and error.startswith('400 '):
+            self.results.pop()
+        tokens = self.request('token', 'POST', '/api/token/', credentials)
+        self.token = tokens and tokens['access']
+        return self.token is not None
+
+    def expense(self, recurring):
+        date = timezone.localtime() + timedelta(days=self.rng.randint(-90, 90))
+        data = {
+            'name': f"Load {self.rng.randrange(10000)}",
+            'amount': round(self.rng.uniform(10, 2000), 2),
+            'category': self.rng.choice(Expense.Category.values),
+            'payment_date': date.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        if recurring:
+            data['recurrence'] = self.rng.choice([Recurrence.WEEKLY, Recurrence.MONTHLY, Recurrence.DAILY])
+            data['number_of_recurrences'] = self.rng.randint(3, 60)
+        return data
+
+    def pages(self, operation, path, pages=2):
+        for _ in range(pages):
+            page = self.request(operation, 'GET', path)
+            if not page or not page['next']:
+                break
+            path = page['next']
+
+    def run(self, requests):
+        if not self.login():
+            return self.results
+        operations, weights = zip(*SCENARIO)
+        for operation in self.rng.choices(operations, weights=weights, k=requests):
+            if operation == 'create_expense':
+                self.request(operation, 'POST', '/api/expenses/', self.expense(recurring=False))
+            elif operation == 'create_recurring_expense':
+                self.request(operation, 'POST', '/api/expenses/', self.expense(recurring=True))
+            elif operation == 'expenses_by_month':
+                self.request(operation, 'GET', '/api/expenses/expenses_by_month/')
+            elif operation == 'upcoming_payments':
+                self.request(operation, 'GET', '/api/payments/upcoming_payments/?this_month=1')
+            elif operation == 'expenses_page':
+                self.pages(operation, '/api/expenses/?page_size=20')
+            elif operation == 'payments_cursor':
+                self.pages(operation, '/api/payments/?pagination=cursor&page_size=20')
+        return self.results
+
+
+class Command(BaseCommand):
+    help = (
+        "Load tests a running server: simulated users register, obtain a JWT from api/token/ and run "
+        "a weighted mix of expense creation (some recurring) and reads of expenses_by_month, "
+        "upcoming_payments and paginated lists, all concurrently. Reports throughput, latency "
+        "percentiles per operation and the errors, e.g. SQLite's 'database is locked'. Run the "
+        "server with DEBUG=1 to get the exception of failed requests."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000/')
+        parser.add_argument('--users', type=int, default=20, help="Simulated users, all running at once.")
+        parser.add_argument('--requests', type=int, default=50, help="Requests per user after logging in.")
+        parser.add_argument('--prefix', default='load')
+        parser.add_argument('--password', default='load-test-password')
+        parser.add_argument('--seed', type=int, default=0, help="Seed of the users' random choices.")
+        parser.add_argument('--output', help="Also write the report as JSON to this file.")
+
+    def handle(self, *args, **options):
+        users = [
+            SimulatedUser(options['url'], f"{options['prefix']}_{i}", options['password'],
+                          random.Random(options['seed'] * 100003 + i))
+            for i in range(options['users'])
+        ]
+        started = perf_counter()
+        with ThreadPoolExecutor(len(users)) as pool:
+            results = [result for user_results in pool.map(lambda user: user.run(options['requests']), users)
+                       for result in user_results]
+        elapsed = perf_counter() - started
+        if not results:
+            raise CommandError("No requests were made.")
+
+        timings = defaultdict(list)
+        errors = Counter()
+        for operation, seconds, error in results:
+            timings[operation].append(seconds)
+            if error:
+                errors[f"{operation}: {error}"] += 1
+        report = {
+            'users': options['users'],
+            'requests': len(results),
+            'seconds': round(elapsed, 2),
+            'throughput': round(len(results) / elapsed, 1),
+            'errors': sum(errors.values()),
+            'operations': {
+                operation: {
+                    'count': len(seconds),
+                    'p50_ms': round(percentile(seconds, 0.5) * 1000, 1),
+                    'p95_ms': round(percentile(seconds, 0.95) * 1000, 1),
+                    'p99_ms': round(percentile(seconds, 0.99) * 1000, 1),
+                }
+                for operation, seconds in sorted(timings.items())
+            },
+            'error_messages': dict(errors.most_common()),
+        }
+
+        self.stdout.write(
+            f"{report['requests']} requests in {report['seconds']} s, {report['throughput']} req/s, "
+            f"{report['errors']} errors"
+        )
+        for operation, stats in report['operations'].items():
+            self.stdout.write(
+                f"{operation:<26} {stats['count']:>6}  p50 {stats['p50_ms']:>8} ms  "
+                f"p95 {stats['p95_ms']:>8} ms  p99 {stats['p99_ms']:>8} ms"
+            )
+        for message, count in report['error_messages'].items():
+            self.stdout.write(self.style.ERROR(f"{count:>6}  {message}"))
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+                output.write('\n')
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from api.models import Account
+from api.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the monthly expense rollups of every account, or of the accounts given."
+
+    def add_arguments(self, parser):
+        parser.add_argument('accounts', nargs='*', type=int, help="Account ids, all accounts by default.")
+
+    def handle(self, *args, **options):
+        accounts = Account.objects.order_by('pk')
+        if options['accounts']:
+            accounts = accounts.filter(pk__in=options['accounts'])
+        for account in accounts.iterator():
+            rebuild_rollups(account)
+            self.stdout.write(f"Rebuilt rollups of account {account.pk}: {account.rollups.count()} rows")
@@ -0,0 +1,35 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from time import perf_counter
+
+from api.models import Expense, Payment
+from api.seeding import seed
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds users, accounts, expenses with a realistic mix of recurrences, payments and monthly "
+        "rollups using bulk inserts. Users are named <prefix>_<n>."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--expenses', type=int, default=100, help="Expenses per account.")
+        parser.add_argument('--prefix', default='seed')
+        parser.add_argument('--password', default='seed')
+        parser.add_argument('--seed', type=int, help="Random seed, to generate the same data again.")
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=f"{prefix}_").exists():
+            raise CommandError(f"Users starting with '{prefix}_' already exist, choose another --prefix.")
+        started = perf_counter()
+        with transaction.atomic():
+            accounts = seed(options['users'], options['expenses'], prefix, options['password'], options['seed'])
+        expenses = Expense.objects.filter(account__in=accounts)
+        payments = Payment.objects.filter(expense__in=expenses)
+        self.stdout.write(
+            f"Created {accounts.count()} accounts, {expenses.count()} expenses and {payments.count()} payments "
+            f"in {perf_counter() - started:.1f} s"
+        )
@@ -0,0 +1,99 @@
+from collections import defaultdict
+from threading import Lock
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+# Any other method is labelled `other`, so clients can't create series at will.
+METHODS = frozenset(['GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'])
+
+
+def format_labels(labels):
+    return ','.join(f'{name}="{value}"' for name, value in labels)
+
+
+class Counter:
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.values = defaultdict(float)
+
+    def inc(self, labels, amount=1):
+        self.values[labels] += amount
+
+    def expose(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} counter'
+        for labels, value in sorted(self.values.items()):
+            yield f'{self.name}{{{format_labels(labels)}}} {value:g}'
+
+
+class Histogram:
+
+    def __init__(self, name, documentation, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        # Per label set: a count per bucket (plus +Inf), then the sum of the observations.
+        self.values = defaultdict(lambda: [0] * (len(buckets) + 1) + [0.0])
+
+    def observe(self, labels, value):
+        counts = self.values[labels]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        else:
+            counts[len(self.buckets)] += 1
+        counts[-1] += value
+
+    def expose(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} histogram'
+        for labels, counts in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip([*map(str, self.buckets), '+Inf'], counts):
+                cumulative += count
+                yield f'{self.name}_bucket{{{format_labels(labels + (("le", bound),))}}} {cumulative}'
+            yield f'{self.name}_sum{{{format_labels(labels)}}} {counts[-1]:g}'
+            yield f'{self.name}_count{{{format_labels(labels)}}} {cumulative}'
+
+
+class Registry:
+    """The metrics of this process. Every worker process keeps and exposes its own."""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.requests = Counter('api_requests_total', "Requests by route, method and status.")
+        self.latency = Histogram('api_request_duration_seconds', "Request latency.", LATENCY_BUCKETS)
+        self.queries = Histogram('api_sql_queries', "SQL queries per request.", QUERY_BUCKETS)
+        self.sql_time = Histogram('api_sql_duration_seconds', "SQL time per request.", LATENCY_BUCKETS)
+        self.over_budget = Counter('api_query_budget_exceeded_total',
+                                   "Requests that ran more SQL queries than SQL_QUERY_BUDGET.")
+        self.cache_hits = Counter('api_response_cache_hits_total', "Responses served from the response cache.")
+        self.cache_misses = Counter('api_response_cache_misses_total',
+                                    "Responses of cached actions computed by the view.")
+
+    def record(self, route, method, status, seconds, queries, sql_seconds, over_budget=False):
+        labels = (('route', route), ('method', method if method in METHODS else 'other'))
+        with self.lock:
+            self.requests.inc(labels + (('status', str(status)),))
+            self.latency.observe(labels, seconds)
+            self.queries.observe(labels, queries)
+            self.sql_time.observe(labels, sql_seconds)
+            if over_budget:
+                self.over_budget.inc(labels)
+
+    def record_cache(self, route, hit):
+        with self.lock:
+            (self.cache_hits if hit else self.cache_misses).inc((('route', route),))
+
+    def expose(self):
+        metrics = [self.requests, self.latency, self.queries, self.sql_time, self.over_budget,
+                   self.cache_hits, self.cache_misses]
+        with self.lock:
+            lines = [line for metric in metrics for line in metric.expose()]
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
@@ -0,0 +1,208 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connections
+from django.http import JsonResponse
+from django.utils import timezone
+from django.utils.text import slugify
+from rest_framework.exceptions import APIException
+from rest_framework.response import Response
+from rest_framework.serializers import BaseSerializer
+from asgiref.sync import async_to_sync, sync_to_async
+from contextlib import ExitStack, contextmanager
+from time import perf_counter
+import asyncio
+import cProfile
+import logging
+import os
+import pstats
+
+from api.authentication import AccountJWTAuthentication
+from api.metrics import registry
+from api.serializers import ValuesSerializerMixin
+
+logger = logging.getLogger(__name__)
+
+
+class QueryTimer:
+
+    def __init__(self, statements=False):
+        self.count = 0
+        self.seconds = 0
+        self.statements = [] if statements else None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = perf_counter() - started
+            self.count += 1
+            self.seconds += elapsed
+            if self.statements is not None:
+                self.statements.append((sql, elapsed))
+
+
+@contextmanager
+def timed_queries(timer):
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(timer))
+        yield timer
+
+
+class AsyncCapableMiddleware:
+    """
+    Base of middleware that runs in the mode of the handler: under ASGI `get_response` is a
+    coroutine function and `acall` awaits it on the event loop, without a hop to a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # Marks the instance as a coroutine function for the handler, as MiddlewareMixin does.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.acall(request)
+        return self.call(request)
+
+
+class MetricsMiddleware(AsyncCapableMiddleware):
+    """
+    Records the latency, SQL query count and SQL time of every request by route (the URL name of
+    the view, e.g. `api:expenses-list`), and logs a warning for requests over SQL_QUERY_BUDGET.
+    """
+
+    def call(self, request):
+        timer = QueryTimer()
+        started = perf_counter()
+        with timed_queries(timer):
+            response = self.get_response(request)
+        self.record(request, response, perf_counter() - started, timer)
+        return response
+
+    async def acall(self, request):
+        timer = QueryTimer()
+        started = perf_counter()
+        # Connections are per thread, and the queries of the request run in the thread its sync
+        # code shares (one per request under ASGIHandler), so the wrappers go on that thread's.
+        queries = ExitStack()
+        await sync_to_async(queries.enter_context)(timed_queries(timer))
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(queries.close)()
+        self.record(request, response, perf_counter() - started, timer)
+        return response
+
+    def record(self, request, response, seconds, timer):
+        match = request.resolver_match
+        route = match.view_name if match else 'unmatched'
+        over_budget = timer.count > settings.SQL_QUERY_BUDGET
+        registry.record(route, request.method, response.status_code, seconds, timer.count, timer.seconds, over_budget)
+        if over_budget:
+            logger.warning("%s %s ran %d SQL queries, over the budget of %d", request.method,
+                           request.path, timer.count, settings.SQL_QUERY_BUDGET)
+
+
+def function_name(key):
+    filename, line, name = key
+    return f'{filename}:{line}({name})'
+
+
+def cumulative_time(stats, function):
+    """Seconds spent in `function` and everything it called, 0 if it didn't run."""
+    code = function.__code__
+    entry = stats.stats.get((code.co_filename, code.co_firstlineno, code.co_name))
+    return entry[3] if entry else 0
+
+
+class ProfilingMiddleware(AsyncCapableMiddleware):
+    """
+    Profiles a single request of a staff user with cProfile when it carries `?profile=summary` or
+    `X-Profile: summary`: the response is replaced by a JSON report with the time spent in SQL
+    (with every statement), in serializers and in DRF rendering, and the top functions.
+    With `dump` instead, the profile is written to PROFILE_DIR for snakeviz or pstats and the
+    response is returned as usual, naming the file in its X-Profile header.
+    """
+    modes = ('summary', 'dump')
+    functions = 40
+
+    def call(self, request):
+        return self.profile(request, self.get_response)
+
+    async def acall(self, request):
+        if self.mode(request) not in self.modes:
+            return await self.get_response(request)
+        # Profiled in a thread, the view joins it instead of taking a thread of its own.
+        return await sync_to_async(self.profile, thread_sensitive=True)(request, async_to_sync(self.get_response))
+
+    def mode(self, request):
+        return request.GET.get('profile') or request.headers.get('X-Profile')
+
+    def profile(self, request, get_response):
+        mode = self.mode(request)
+        if mode not in self.modes or not self.is_staff(request):
+            return get_response(request)
+
+        profiler = cProfile.Profile()
+        timer = QueryTimer(statements=True)
+        started = perf_counter()
+        with timed_queries(timer):
+            profiler.enable()
+            try:
+                response = get_response(request)
+            finally:
+                profiler.disable()
+        seconds = perf_counter() - started
+
+        if mode == 'dump':
+            os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+            name = f"{timezone.now():%Y%m%dT%H%M%S%f}-{request.method}-{slugify(request.path)}.prof"
+            profiler.dump_stats(os.path.join(settings.PROFILE_DIR, name))
+            response['X-Profile'] = name
+            return response
+
+        stats = pstats.Stats(profiler)
+        functions = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:self.functions]
+        return JsonResponse({
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'total_ms': round(seconds * 1000, 2),
+            # Serialization includes the queries of lazily loaded relations.
+            'serialization_ms': round(sum(
+                cumulative_time(stats, function)
+                for function in [BaseSerializer.data.fget, ValuesSerializerMixin.values_data]
+            ) * 1000, 2),
+            'rendering_ms': round(cumulative_time(stats, Response.rendered_content.fget) * 1000, 2),
+            'sql': {
+                'count': timer.count,
+                'ms': round(timer.seconds * 1000, 2),
+                'statements': [{'sql': sql, 'ms': round(elapsed * 1000, 3)} for sql, elapsed in timer.statements],
+            },
+            'functions': [
+                {
+                    'function': function_name(key),
+                    'calls': calls,
+                    'own_ms': round(own * 1000, 3),
+                    'cumulative_ms': round(cumulative * 1000, 3),
+                }
+                for key, (_, calls, own, cumulative, _) in functions
+            ],
+        })
+
+    def is_staff(self, request):
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return user.is_staff
+        try:
+            authenticated = AccountJWTAuthentication().authenticate(request)
+        except APIException:
+            return False
+        # Staff status isn't part of the token, and may have been revoked since it was issued.
+        return authenticated is not None and User.objects.filter(pk=authenticated[0].id, is_staff=True).exists()
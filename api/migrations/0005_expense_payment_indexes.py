@@ -0,0 +1,21 @@
+# Generated by Django 4.0.10 on 2026-10-17 22:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_alter_expense_number_of_recurrences'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['account', 'category', 'date_created'], name='expense_account_category_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['expense', 'date'], name='payment_expense_date_idx'),
+        ),
+    ]
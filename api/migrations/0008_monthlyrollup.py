@@ -0,0 +1,30 @@
+# Generated by Django 4.0.10 on 2026-10-17 22:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_revokedtoken'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField()),
+                ('month', models.PositiveSmallIntegerField()),
+                ('category', models.CharField(choices=[('HO', 'Housing'), ('TR', 'Transportation'), ('FO', 'Food'), ('UT', 'Utilities'), ('IN', 'Insurance'), ('ME', 'Medical & Healthcare'), ('SA', 'Savings, Investing & Debt Payments'), ('PE', 'Personal Spending'), ('EN', 'Recreation and Entertainment'), ('MI', 'Miscellaneous'), ('UN', 'Uncategorized')], max_length=2)),
+                ('total', models.FloatField(default=0)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='api.account')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='monthlyrollup',
+            constraint=models.UniqueConstraint(fields=('account', 'year', 'month', 'category'), name='unique_monthly_rollup'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.0.10 on 2026-10-17 22:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_monthlyrollup'),
+    ]
+
+    operations = [
+        # Existing incomes keep no date rather than the time of the migration, which would restart
+        # their schedules. The default only applies to new ones.
+        migrations.AddField(
+            model_name='income',
+            name='first_payment_date',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='income',
+            name='first_payment_date',
+            field=models.DateTimeField(blank=True, default=django.utils.timezone.now, null=True),
+        ),
+        migrations.AlterField(
+            model_name='amountmodifier',
+            name='expense',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='modifier', to='api.expense'),
+        ),
+        migrations.AlterField(
+            model_name='amountmodifier',
+            name='income',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='modifier', to='api.income'),
+        ),
+    ]
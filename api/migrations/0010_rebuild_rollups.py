@@ -0,0 +1,71 @@
+# Generated by Django 4.0.10 on 2026-10-18 09:12
+
+from django.db import migrations
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+from collections import defaultdict
+from datetime import timedelta
+from dateutil.relativedelta import relativedelta
+
+# The recurrence steps as of this migration.
+STEPS = {
+    'DA': timedelta(days=1),
+    'WE': timedelta(weeks=1),
+    'BW': timedelta(weeks=2),
+    'MO': relativedelta(months=1),
+    'YE': relativedelta(years=1),
+}
+
+
+def rebuild_all_rollups(apps, schema_editor):
+    # Rollups only follow the writes made after 0008, fill them in for the existing payments: one
+    # per local month an expense has stored payments in, or projected ones for virtual expenses.
+    alias = schema_editor.connection.alias
+    Expense = apps.get_model('api', 'Expense')
+    Payment = apps.get_model('api', 'Payment')
+    MonthlyRollup = apps.get_model('api', 'MonthlyRollup')
+
+    months = defaultdict(set)
+    stored = (
+        Payment.objects.using(alias).filter(expense__virtual_payments=False)
+        .annotate(month=TruncMonth('date', tzinfo=timezone.get_current_timezone()))
+        .values_list('expense_id', 'month').order_by().distinct()
+    )
+    for expense_id, month in stored.iterator():
+        month = timezone.localtime(month) if timezone.is_aware(month) else month
+        months[expense_id].add((month.year, month.month))
+    virtual = Expense.objects.using(alias).filter(virtual_payments=True, first_payment_date__isnull=False)
+    for pk, first, recurrence, count in virtual.values_list(
+        'pk', 'first_payment_date', 'recurrence', 'number_of_recurrences',
+    ).iterator():
+        first, step = timezone.localtime(first), STEPS.get(recurrence)
+        dates = [first] if step is None else [first + step * i for i in range(count + 1)]
+        months[pk].update((date.year, date.month) for date in dates)
+
+    totals = defaultdict(lambda: [0, 0])
+    expenses = Expense.objects.using(alias).values_list('pk', 'account_id', 'category', 'amount')
+    for pk, account_id, category, amount in expenses.iterator():
+        for year, month in months.get(pk, ()):
+            totals[(account_id, year, month, category)][0] += amount
+            totals[(account_id, year, month, category)][1] += 1
+
+    MonthlyRollup.objects.using(alias).all().delete()
+    MonthlyRollup.objects.using(alias).bulk_create(
+        (
+            MonthlyRollup(account_id=account_id, year=year, month=month, category=category,
+                          total=round(total, 6), count=count)
+            for (account_id, year, month, category), (total, count) in totals.items()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_income_first_payment_date_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(rebuild_all_rollups, migrations.RunPython.noop),
+    ]
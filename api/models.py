@@ -3,8 +3,14 @@ from django.core.exceptions import ValidationError
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.db import models
-from datetime import datetime, timedelta
+from django.db.models.functions import TruncMonth
+from datetime import timedelta
 from calendar import monthrange
+from dateutil.relativedelta import relativedelta
+
+from api.dates import schedule, schedule_between
+
+PAYMENT_BATCH_SIZE = 1000
 
 
 # Create your models here.
@@ -15,22 +21,19 @@ class Account(models.Model):
     date_created = models.DateTimeField(auto_now_add=True)
     date_modified = models.DateTimeField(auto_now=True)
 
+    def month_total(self, date):
+        return self.rollups.filter(year=date.year, month=date.month).aggregate(total=models.Sum('total'))['total'] or 0
+
     @property
     def this_month_expense_average(self):
-        today = datetime.today()
-        days = timedelta(days=today.day)
-        filters = {'payment_date__month': today.month, 'payment_date__year': today.year}
-        expenses = self.expenses.filter(**filters)
-        expense_sum = 0
-        for expense in expenses:
-            expense_sum += expense.amount
-        return expense_sum / days.days
+        today = timezone.localdate()
+        expense_sum = self.month_total(today)
+        return expense_sum / today.day
 
     def monthly_expense_average(self, date):
-        filters = {'payment_date__month': date.month, 'payment_date__year': date.year}
-        expenses = self.expenses.filter(**filters)
+        expense_sum = self.month_total(date)
         days_range = monthrange(date.year, date.month)
-        average = expenses / days_range[1]
+        average = expense_sum / days_range[1]
         return average
 
 
@@ -43,6 +46,15 @@ class Recurrence(models.TextChoices):
     ONCE = 'ON', _('Once')
 
 
+RECURRENCE_STEPS = {
+    Recurrence.DAILY: timedelta(days=1),
+    Recurrence.WEEKLY: timedelta(weeks=1),
+    Recurrence.BIWEEKLY: timedelta(weeks=2),
+    Recurrence.MONTHLY: relativedelta(months=1),
+    Recurrence.YEARLY: relativedelta(years=1),
+}
+
+
 class Income(models.Model):
     name = models.CharField(max_length=255)
     account = models.ForeignKey(Account, on_delete=models.CASCADE)
@@ -53,6 +65,8 @@ class Income(models.Model):
         choices=Recurrence.choices,
         default=Recurrence.ONCE,
     )
+    # Incomes from before the schedule was stored have none and are left out of the forecast.
+    first_payment_date = models.DateTimeField(default=timezone.now, null=True, blank=True)
 
     @property
     def recurring(self):
@@ -91,6 +105,9 @@ class Expense(models.Model):
         choices=Recurrence.choices,
         default=Recurrence.ONCE,
     )
+    virtual_payments = models.BooleanField(default=False)
+    first_payment_date = models.DateTimeField(null=True, blank=True)
+    last_payment_date = models.DateTimeField(null=True, blank=True)
     date_created = models.DateTimeField(auto_now_add=True)
     date_modified = models.DateTimeField(auto_now=True)
 
@@ -102,11 +119,70 @@ class Expense(models.Model):
     def payment_date(self):
         return self.payments.first()
 
+    def payment_dates(self, first_date):
+        step = RECURRENCE_STEPS.get(self.recurrence)
+        if step is None:
+            return [first_date]
+        return schedule(first_date, step, self.number_of_recurrences)
+
+    def schedule_payments(self, first_date):
+        """
+        Sets the bounds of the payment schedule and returns the dates that must be stored
+        as payments. Expenses with virtual payments only store the first one, the rest are
+        projected from the recurrence when requested.
+        """
+        step = RECURRENCE_STEPS.get(self.recurrence)
+        self.first_payment_date = self.last_payment_date = first_date
+        if step is not None:
+            self.last_payment_date = first_date + step * self.number_of_recurrences
+        if self.virtual_payments:
+            return [first_date]
+        return self.payment_dates(first_date)
+
+    def schedule_rule(self):
+        """
+        The `(first, step, count)` of the payment schedule. The schedule steps through the local
+        calendar, as the stored payments did when they were created.
+        """
+        first = timezone.localtime(self.first_payment_date)
+        step = RECURRENCE_STEPS.get(self.recurrence)
+        if step is None:
+            return first, timedelta(days=1), 0
+        return first, step, self.number_of_recurrences
+
+    def occurrences(self, start=None, end=None):
+        return schedule_between(*self.schedule_rule(), start, end)
+
+    def projected_payments(self, start=None, end=None):
+        return [Payment(expense=self, date=date) for date in self.occurrences(start, end)]
+
+    def rollup_months(self, dates=None):
+        """
+        The local `(year, month)` pairs the expense has payments in, projected ones included.
+        `dates` are the dates of its stored payments, when the caller has them.
+        """
+        if self.virtual_payments:
+            dates = self.occurrences()
+        elif dates is None:
+            dates = (
+                self.payments.annotate(month=TruncMonth('date', tzinfo=timezone.get_current_timezone()))
+                .values_list('month', flat=True).order_by().distinct()
+            )
+        dates = (timezone.localtime(date) if timezone.is_aware(date) else date for date in dates)
+        return {(date.year, date.month) for date in dates}
+
+    def create_payments(self, dates):
+        payments = [Payment(expense=self, date=date) for date in dates]
+        return Payment.objects.bulk_create(payments, batch_size=PAYMENT_BATCH_SIZE)
+
     def __str__(self):
         return f"{self.name}: {self.amount} | {self.category}"
 
     class Meta:
         ordering = ['-date_created']
+        indexes = [
+            models.Index(fields=['account', 'category', 'date_created'], name='expense_account_category_idx'),
+        ]
 
 
 class Payment(models.Model):
@@ -114,10 +190,17 @@ class Payment(models.Model):
     expense = models.ForeignKey(Expense, on_delete=models.CASCADE, related_name='payments')
 
     def __str__(self):
-        return f"{self.date.date()} | {self.expense.name}"
+        return self.describe(self.date, self.expense.name)
+
+    @staticmethod
+    def describe(date, expense_name):
+        return f"{date.date()} | {expense_name}"
 
     class Meta:
         ordering = ['-date']
+        indexes = [
+            models.Index(fields=['expense', 'date'], name='payment_expense_date_idx'),
+        ]
 
 
 class AmountModifier(models.Model):
@@ -134,8 +217,8 @@ class AmountModifier(models.Model):
         default=Modifier.PERCENT_NONE,
     )
     percent = models.FloatField()
-    income = models.ForeignKey(Income, on_delete=models.CASCADE, related_name="modifier")
-    expense = models.ForeignKey(Expense, on_delete=models.CASCADE, related_name="modifier")
+    income = models.ForeignKey(Income, on_delete=models.CASCADE, related_name="modifier", null=True, blank=True)
+    expense = models.ForeignKey(Expense, on_delete=models.CASCADE, related_name="modifier", null=True, blank=True)
 
     @property
     def value(self):
@@ -160,3 +243,33 @@ class AmountModifier(models.Model):
             raise ValidationError(_('Either income or expense must be specified.'))
         if self.income is not None and self.expense is not None:
             raise ValidationError(_("Modifier can't have both income and expense attribute."))
+
+
+class RevokedToken(models.Model):
+    jti = models.CharField(max_length=255, unique=True)
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return self.jti
+
+
+class MonthlyRollup(models.Model):
+    """
+    Total and count of the expenses with payments in a month, per account and category.
+    API and admin writes keep them up to date, after changing expenses or payments with the ORM
+    directly run the rebuild_rollups command.
+    """
+    account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name='rollups')
+    year = models.PositiveSmallIntegerField()
+    month = models.PositiveSmallIntegerField()
+    category = models.CharField(max_length=2, choices=Expense.Category.choices)
+    total = models.FloatField(default=0)
+    count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.year}-{self.month:02} | {self.category}: {self.total}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'year', 'month', 'category'], name='unique_monthly_rollup'),
+        ]
@@ -1,6 +1,153 @@
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from django.db.models import Count, Q, QuerySet, Sum
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.utils.functional import cached_property
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from collections import OrderedDict
+import binascii
+import json
+
+
+class KeysetPaginationMixin:
+    """
+    Lets clients switch a paginator to keyset pagination with `?pagination=cursor`.
+
+    Rows are ordered by the model's `Meta.ordering` with the primary key as a tiebreaker,
+    and each page is read with `WHERE (ordering, pk) < cursor` instead of an OFFSET and
+    without counting the rows, so deep pages cost the same as the first one.
+    Results that are not querysets keep page number pagination.
+    """
+    cursor_query_param = 'cursor'
+    pagination_query_param = 'pagination'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def use_keyset(self, request, queryset):
+        if not isinstance(queryset, QuerySet):
+            return False
+        params = request.query_params
+        return self.cursor_query_param in params or params.get(self.pagination_query_param) == 'cursor'
+
+    def get_ordering(self, model):
+        ordering = list(model._meta.ordering)
+        pk = model._meta.pk.name
+        ordering.append(f'-{pk}' if ordering and ordering[0].startswith('-') else pk)
+        return ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.use_keyset(request, queryset)
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.ordering = self.get_ordering(queryset.model)
+        self.fields = [queryset.model._meta.get_field(field.lstrip('-')) for field in self.ordering]
+        position, self.reverse = self.decode_cursor(request)
+        page_size = self.get_page_size(request)
+
+        ordering = self.ordering
+        if self.reverse:
+            ordering = [field[1:] if field.startswith('-') else f'-{field}' for field in ordering]
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.keyset_filter(ordering, position))
+
+        results = list(queryset[:page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if self.reverse:
+            results.reverse()
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        self.page = results
+        return results
+
+    def keyset_filter(self, ordering, position):
+        # (a, b) < (x, y)  =>  a < x OR (a = x AND b < y)
+        condition = Q()
+        for i, field in enumerate(ordering):
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            equal = {name.lstrip('-'): value for name, value in zip(ordering[:i], position[:i])}
+            condition |= Q(**equal, **{f'{field.lstrip("-")}__{lookup}': position[i]})
+        return condition
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, False
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            position = [field.to_python(value) for field, value in zip(self.fields, cursor['p'], strict=True)]
+            return position, bool(cursor['r'])
+        except (TypeError, ValueError, KeyError, UnicodeEncodeError, binascii.Error, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def values_fields(self, model):
+        """The columns a page of `.values()` rows needs to build the cursors."""
+        return [model._meta.get_field(field.lstrip('-')).attname for field in self.get_ordering(model)]
+
+    def encode_cursor(self, instance, reverse):
+        if isinstance(instance, dict):
+            position = [instance[field.attname] for field in self.fields]
+        else:
+            position = [getattr(instance, field.attname) for field in self.fields]
+        cursor = json.dumps({'p': position, 'r': int(reverse)}, default=str)
+        encoded = urlsafe_b64encode(cursor.encode('ascii')).decode('ascii')
+        url = remove_query_param(self.request.build_absolute_uri(), self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super().get_next_link()
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.keyset:
+            return super().get_previous_link()
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+
+class PaymentPaginator(Paginator):
+    """
+    Counts the payments and adds up their amounts with the same aggregate query. Sequences that
+    know their totals without being read, like UpcomingPayments, provide them in `totals`.
+    """
+
+    @cached_property
+    def totals(self):
+        if isinstance(self.object_list, QuerySet):
+            return self.object_list.aggregate(count=Count('pk'), total=Sum('expense__amount'))
+        if hasattr(self.object_list, 'totals'):
+            return self.object_list.totals
+        return {
+            'count': len(self.object_list),
+            'total': sum(payment.expense.amount for payment in self.object_list),
+        }
+
+    @cached_property
+    def count(self):
+        return self.totals['count']
+
+    @cached_property
+    def total(self):
+        return self.totals['total'] or 0
 
 
 class LargeResultsSetPagination(PageNumberPagination):
@@ -9,23 +156,27 @@ class LargeResultsSetPagination(PageNumberPagination):
     max_page_size = 10000
 
 
-class StandardResultsSetPagination(PageNumberPagination):
+class StandardResultsSetPagination(KeysetPaginationMixin, PageNumberPagination):
     page_size = 100
     page_size_query_param = 'page_size'
     max_page_size = 1000
 
 
-class PaymentResultsSetPagination(PageNumberPagination):
+class PaymentResultsSetPagination(KeysetPaginationMixin, PageNumberPagination):
+    django_paginator_class = PaymentPaginator
     page_size = 100
     page_size_query_param = 'page_size'
     max_page_size = 1000
 
     def get_paginated_response(self, data):
-        total = sum(float(payment['expense']) for payment in data)
-        return Response(OrderedDict([
-            ('count', self.page.paginator.count),
-            ('next', self.get_next_link()),
-            ('previous', self.get_previous_link()),
-            ('results', data),
-            ('total', total),
-        ]))
+        response = super().get_paginated_response(data)
+        if not self.keyset:
+            response.data['total'] = self.page.paginator.total
+        response.data['page_total'] = sum(
+            payment['expense__amount'] if isinstance(payment, dict) else payment.expense.amount
+            for payment in self.page
+        )
+        return response
+
+    def values_fields(self, model):
+        return [*super().values_fields(model), 'expense__amount']
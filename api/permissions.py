@@ -1,22 +1,43 @@
-from django.contrib.auth.models import User
+from django.db import router
+from django.http import Http404
 from django.shortcuts import get_object_or_404
-from rest_framework.permissions import BasePermission
+from rest_framework.permissions import SAFE_METHODS, BasePermission
 from api.models import Account
 
 
+def get_account(request):
+    """
+    Returns the authenticated user's account, loading it only once per request.
+    When the access token carries the account id, reads make no query and only the
+    `id` and `owner` fields are loaded, the rest are deferred. Writes check that the
+    account still exists, so a deleted one gets a 404 instead of failing foreign keys.
+    """
+    if not hasattr(request, 'account'):
+        account_id = request.auth.get('account_id') if request.auth is not None else None
+        if account_id is not None:
+            accounts = Account.objects.filter(pk=account_id, owner=request.user.id)
+            if request.method not in SAFE_METHODS and not accounts.exists():
+                raise Http404("No account matches the token.")
+            alias = router.db_for_read(Account)
+            request.account = Account.from_db(alias, ['id', 'owner_id'], [account_id, request.user.id])
+        else:
+            request.account = get_object_or_404(Account, owner=request.user.id)
+    return request.account
+
+
 class IsOwner(BasePermission):
 
     def has_object_permission(self, request, view, obj):
-        return obj.owner == get_object_or_404(User, pk=request.user.id)
+        return obj.owner_id == request.user.id
 
 
 class AccountPermission(BasePermission):
 
     def has_object_permission(self, request, view, obj):
-        return obj.account == get_object_or_404(Account, owner=request.user.id)
+        return obj.account_id == get_account(request).pk
 
 
 class PaymentPermission(BasePermission):
 
     def has_object_permission(self, request, view, obj):
-        return obj.expense.account == get_object_or_404(Account, owner=request.user.id)
+        return obj.expense.account_id == get_account(request).pk
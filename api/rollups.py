@@ -0,0 +1,166 @@
+from django.db import connection, transaction
+from django.db.models import Max, Min, Q
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+from collections import defaultdict
+from contextlib import contextmanager
+
+from api.dates import month_span
+from api.models import Account, Expense, MonthlyRollup, Payment
+
+
+# Digits kept in the totals, so adding and removing amounts leaves no floating point residue.
+TOTAL_DIGITS = 6
+
+
+def lock_account(account_id):
+    """
+    Serializes the writers of an account's rollups until the end of the transaction. SQLite has
+    no row locks, it already lets a single transaction write at a time.
+    """
+    if connection.features.has_select_for_update:
+        list(Account.objects.select_for_update().filter(pk=account_id).values_list('pk', flat=True))
+
+
+class RollupDelta:
+    """
+    Changes to the MonthlyRollup rows of the expenses created, changed or deleted in a request.
+    Each expense adds its amount, and one to the count, to every month it has payments in,
+    so applying the changes only touches those rows and reads no other payment.
+    """
+
+    def __init__(self):
+        self.rows = defaultdict(lambda: [0, 0])
+
+    def add(self, expense, months, sign=1):
+        for year, month in months:
+            row = self.rows[(expense.account_id, year, month, expense.category)]
+            row[0] += sign * expense.amount
+            row[1] += sign
+
+    def remove(self, expense, months):
+        self.add(expense, months, sign=-1)
+
+    def clear(self):
+        self.rows.clear()
+
+    @transaction.atomic
+    def apply(self):
+        changes = defaultdict(dict)
+        for (account_id, year, month, category), (total, count) in self.rows.items():
+            if count or total:
+                changes[account_id][(year, month, category)] = (total, count)
+        for account_id, rows in sorted(changes.items()):
+            lock_account(account_id)
+            years = [year for year, _, _ in rows]
+            existing = {
+                (rollup.year, rollup.month, rollup.category): rollup
+                for rollup in MonthlyRollup.objects.filter(
+                    account_id=account_id, year__gte=min(years), year__lte=max(years),
+                    category__in={category for _, _, category in rows},
+                )
+            }
+            created, updated, deleted = [], [], []
+            for (year, month, category), (total, count) in rows.items():
+                rollup = existing.get((year, month, category))
+                if rollup is None:
+                    rollup = MonthlyRollup(account_id=account_id, year=year, month=month, category=category)
+                    created.append(rollup)
+                elif rollup.count + count > 0:
+                    updated.append(rollup)
+                rollup.total = round(rollup.total + total, TOTAL_DIGITS)
+                rollup.count += count
+                if rollup.count <= 0:
+                    deleted.append(rollup.pk)
+            MonthlyRollup.objects.bulk_create([rollup for rollup in created if rollup.count > 0])
+            MonthlyRollup.objects.bulk_update(updated, ['total', 'count'])
+            MonthlyRollup.objects.filter(pk__in=[pk for pk in deleted if pk is not None]).delete()
+        self.clear()
+
+
+def apply_or_defer(context, delta):
+    """Applies the delta, unless the caller collects the changes in the `rollup_delta` context."""
+    deferred = context.get('rollup_delta')
+    if deferred is None:
+        delta.apply()
+        return
+    for key, (total, count) in delta.rows.items():
+        deferred.rows[key][0] += total
+        deferred.rows[key][1] += count
+
+
+@contextmanager
+def following_rollups(expense_ids):
+    """
+    Updates the rollups of the expenses in the set `expense_ids` for the writes made in the block,
+    for writes that don't go through the serializers, e.g. the admin's. Expenses created in the
+    block are added to the set.
+    """
+    with transaction.atomic():
+        delta = RollupDelta()
+        for expense in Expense.objects.filter(pk__in=expense_ids):
+            delta.remove(expense, expense.rollup_months())
+        yield expense_ids
+        for expense in Expense.objects.filter(pk__in=expense_ids):
+            delta.add(expense, expense.rollup_months())
+        delta.apply()
+
+
+def refresh_rollups(account_id, months):
+    """
+    Recomputes the account's MonthlyRollup rows for the `[start, end)` range of whole months,
+    from the stored payments and the projected payments of virtual expenses. Requests keep the
+    rows up to date with a RollupDelta, this rebuilds them after writes that bypass the API.
+    """
+    if months is None:
+        return
+    start, end = months
+    expenses = {}
+    rows = (
+        Payment.objects
+        .filter(expense__account_id=account_id, date__gte=start, date__lt=end)
+        .annotate(month=TruncMonth('date', tzinfo=timezone.get_current_timezone()))
+        .values_list('expense_id', 'expense__category', 'expense__amount', 'month')
+        .order_by()
+        .distinct()
+    )
+    for expense_id, category, amount, month in rows:
+        month = timezone.localtime(month) if timezone.is_aware(month) else month
+        expenses[(expense_id, month.year, month.month)] = (category, amount)
+    virtual = Expense.objects.filter(
+        account_id=account_id, virtual_payments=True, first_payment_date__lt=end, last_payment_date__gte=start,
+    )
+    for expense in virtual:
+        for date in expense.occurrences(start, end):
+            date = timezone.localtime(date)
+            expenses[(expense.pk, date.year, date.month)] = (expense.category, expense.amount)
+
+    totals = defaultdict(lambda: [0, 0])
+    for (_, year, month), (category, amount) in expenses.items():
+        totals[(year, month, category)][0] += amount
+        totals[(year, month, category)][1] += 1
+
+    first, last = timezone.localtime(start), timezone.localtime(end)
+    in_range = (
+        (Q(year__gt=first.year) | Q(year=first.year, month__gte=first.month))
+        & (Q(year__lt=last.year) | Q(year=last.year, month__lt=last.month))
+    )
+    with transaction.atomic():
+        lock_account(account_id)
+        MonthlyRollup.objects.filter(in_range, account_id=account_id).delete()
+        MonthlyRollup.objects.bulk_create(
+            MonthlyRollup(account_id=account_id, year=year, month=month, category=category,
+                          total=round(total, TOTAL_DIGITS), count=count)
+            for (year, month, category), (total, count) in totals.items()
+        )
+
+
+def rebuild_rollups(account):
+    payments = Payment.objects.filter(expense__account=account).aggregate(first=Min('date'), last=Max('date'))
+    virtual = account.expenses.filter(virtual_payments=True).aggregate(last=Max('last_payment_date'))
+    months = None
+    if payments['first'] is not None:
+        months = month_span(payments['first'], max(filter(None, [payments['last'], virtual['last']])))
+    with transaction.atomic():
+        account.rollups.all().delete()
+        refresh_rollups(account.pk, months)
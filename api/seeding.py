@@ -0,0 +1,80 @@
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.utils import timezone
+from datetime import timedelta
+from itertools import islice
+import random
+
+from api.models import PAYMENT_BATCH_SIZE, Account, Expense, Payment, Recurrence
+from api.rollups import rebuild_rollups
+
+# (recurrence, weight, number_of_recurrences range), roughly what a household budget looks like.
+RECURRENCE_MIX = [
+    (Recurrence.ONCE, 60, (0, 0)),
+    (Recurrence.MONTHLY, 20, (3, 36)),
+    (Recurrence.WEEKLY, 8, (4, 52)),
+    (Recurrence.BIWEEKLY, 5, (4, 26)),
+    (Recurrence.YEARLY, 4, (1, 5)),
+    (Recurrence.DAILY, 3, (7, 365)),
+]
+# Share of the daily expenses stored with virtual payments.
+VIRTUAL_SHARE = 0.5
+AMOUNTS = {
+    Expense.Category.HOUSING: (2000, 15000),
+    Expense.Category.UTILITIES: (150, 1500),
+    Expense.Category.INSURANCE: (300, 3000),
+    Expense.Category.SAVINGS: (500, 5000),
+}
+DEFAULT_AMOUNTS = (20, 1200)
+
+
+def random_expense(account, rng, now):
+    recurrences, weights, ranges = zip(*RECURRENCE_MIX)
+    index = rng.choices(range(len(recurrences)), weights=weights)[0]
+    category = rng.choice(Expense.Category.values)
+    low, high = AMOUNTS.get(category, DEFAULT_AMOUNTS)
+    expense = Expense(
+        name=f"{Expense.Category(category).label} {rng.randrange(10000)}",
+        account=account,
+        amount=round(rng.uniform(low, high), 2),
+        category=category,
+        recurrence=recurrences[index],
+        number_of_recurrences=rng.randint(*ranges[index]),
+    )
+    expense.virtual_payments = expense.recurrence == Recurrence.DAILY and rng.random() < VIRTUAL_SHARE
+    # First payments spread over the last year.
+    expense.schedule_payments(now - timedelta(days=rng.randrange(365), minutes=rng.randrange(24 * 60)))
+    return expense
+
+
+def bulk_create(model, objs):
+    # bulk_create() builds a list of every object first, feed it one batch at a time.
+    objs = iter(objs)
+    while batch := list(islice(objs, PAYMENT_BATCH_SIZE)):
+        model.objects.bulk_create(batch)
+
+
+def seed(users, expenses, prefix='seed', password='seed', random_seed=None):
+    """
+    Creates `users` users named `<prefix>_<n>` with an account and `expenses` expenses each, with
+    their payments and monthly rollups, using bulk inserts. Returns the accounts as a queryset.
+    """
+    rng = random.Random(random_seed)
+    now = timezone.now()
+    password = make_password(password)
+    bulk_create(User, (User(username=f"{prefix}_{i}", password=password) for i in range(users)))
+    owners = User.objects.filter(username__startswith=f"{prefix}_")
+    bulk_create(Account, (Account(owner=owner) for owner in owners.iterator()))
+    accounts = Account.objects.filter(owner__in=owners)
+
+    bulk_create(Expense, (random_expense(account, rng, now) for account in accounts.iterator() for _ in range(expenses)))
+    payments = (
+        Payment(expense=expense, date=date)
+        for expense in Expense.objects.filter(account__in=accounts).iterator()
+        for date in ([expense.first_payment_date] if expense.virtual_payments
+                     else expense.payment_dates(expense.first_payment_date))
+    )
+    bulk_create(Payment, payments)
+    for account in accounts.iterator():
+        rebuild_rollups(account)
+    return accounts
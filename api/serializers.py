@@ -1,10 +1,25 @@
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.relations import ManyRelatedField, PKOnlyObject, RelatedField
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth.models import User
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from django.db import connection, transaction
 from django.utils import timezone
+from django.utils.functional import cached_property
 from datetime import datetime
-from dateutil.relativedelta import relativedelta
+from types import SimpleNamespace
 
-from api.models import Account, Expense, Payment
+from api.authentication import denylist
+from api.cache import invalidate_account
+from api.models import PAYMENT_BATCH_SIZE, Account, Expense, Payment
+from api.rollups import RollupDelta, apply_or_defer
+from api.sqlite import retry_on_busy
+
+RECURRENCES_OVERFLOW = "Recurrences go past the year 9999."
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -20,6 +35,120 @@ class UserSerializer(serializers.ModelSerializer):
         return user
 
 
+class AccountTokenObtainPairSerializer(TokenObtainPairSerializer):
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token['account_id'] = Account.objects.filter(owner=user).values_list('pk', flat=True).first()
+        return token
+
+
+class DenylistTokenRefreshSerializer(TokenRefreshSerializer):
+
+    def validate(self, attrs):
+        refresh = RefreshToken(attrs['refresh'])
+        if refresh.get(api_settings.JTI_CLAIM) in denylist:
+            raise InvalidToken("Token is revoked")
+        return super().validate(attrs)
+
+
+class SparseFieldsMixin:
+    """
+    Limits the fields to the `fields` argument or, for safe requests, to the comma separated
+    `?fields=` query parameter, e.g. `?fields=id,name,amount`.
+    """
+    fields_query_param = 'fields'
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if fields is None and request is not None and request.method in SAFE_METHODS:
+            param = request.query_params.get(self.fields_query_param)
+            fields = param and [name.strip() for name in param.split(',') if name.strip()]
+        if not fields:
+            return
+        unknown = set(fields) - set(self.fields)
+        if unknown:
+            raise serializers.ValidationError({"error": f"Unknown fields: {', '.join(sorted(unknown))}."})
+        for name in set(self.fields) - set(fields):
+            self.fields.pop(name)
+
+
+class ValuesSerializerMixin:
+    """
+    Represents many rows read with `.values()` instead of model instances, with the same data as
+    `to_representation`. Columns, and fields following foreign keys, come from the rows. Model
+    properties are computed from the columns listed for them in `values_requires`, and any other
+    field by a `values_for_<field name>(rows)` method returning one value per row.
+    """
+    values_requires = {}
+
+    @cached_property
+    def values_plan(self):
+        model = self.Meta.model
+        plan = []
+        for field in self._readable_fields:
+            name = field.field_name
+            method = getattr(self, f'values_for_{name}', None)
+            if method is not None:
+                plan.append((name, 'method', method, None))
+                continue
+            lookup = '__'.join(field.source_attrs)
+            attribute = getattr(model, lookup, None)
+            if isinstance(attribute, property):
+                plan.append((name, 'property', attribute.fget, field.to_representation))
+                continue
+            try:
+                column = self.resolve_column(model, field.source_attrs)
+            except FieldDoesNotExist:
+                column = None
+            pk_only = isinstance(field, RelatedField) and field.use_pk_only_optimization()
+            if column is None or isinstance(field, ManyRelatedField) or (column.is_relation and not pk_only):
+                raise ImproperlyConfigured(
+                    f"{type(self).__name__}.{name} can't be read from values(), add values_for_{name}()."
+                )
+            plan.append((name, 'pk' if pk_only else 'column', lookup, field.to_representation))
+        return plan
+
+    @staticmethod
+    def resolve_column(model, attrs):
+        for attr in attrs[:-1]:
+            model = model._meta.get_field(attr).related_model
+        return model._meta.get_field(attrs[-1])
+
+    def values_lookups(self, extra=()):
+        lookups = []
+        for name, kind, source, _ in self.values_plan:
+            if kind in ('column', 'pk'):
+                lookups.append(source)
+            lookups.extend(self.values_requires.get(name, ()))
+        return list(dict.fromkeys([*lookups, *extra]))
+
+    def values_queryset(self, queryset, extra=()):
+        return queryset.prefetch_related(None).values(*self.values_lookups(extra))
+
+    def values_data(self, rows):
+        rows = list(rows)
+        computed = {name: source(rows) for name, kind, source, _ in self.values_plan if kind == 'method'}
+        properties = any(kind == 'property' for _, kind, _, _ in self.values_plan)
+        data = []
+        for i, row in enumerate(rows):
+            instance = SimpleNamespace(**row) if properties else None
+            item = {}
+            for name, kind, source, to_representation in self.values_plan:
+                if kind == 'method':
+                    item[name] = computed[name][i]
+                    continue
+                value = row[source] if kind != 'property' else source(instance)
+                if value is None:
+                    item[name] = None
+                else:
+                    item[name] = to_representation(PKOnlyObject(pk=value) if kind == 'pk' else value)
+            data.append(item)
+        return data
+
+
 class AccountSerializer(serializers.ModelSerializer):
 
     class Meta:
@@ -27,7 +156,7 @@ class AccountSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class PaymentSerializer(serializers.ModelSerializer):
+class PaymentSerializer(SparseFieldsMixin, ValuesSerializerMixin, serializers.ModelSerializer):
     expense = serializers.StringRelatedField(source='expense.amount')
     name = serializers.StringRelatedField(source='expense.name')
 
@@ -36,21 +165,113 @@ class PaymentSerializer(serializers.ModelSerializer):
         fields = ['id', 'expense', 'date', 'name']
 
 
-class ExpenseSerializer(serializers.ModelSerializer):
+def parse_payment_date(value):
+    return timezone.make_aware(datetime.strptime(value, "%Y-%m-%d %H:%M:%S"))
+
+
+class ExpenseListSerializer(serializers.ListSerializer):
+    """
+    Creates many expenses with a bulk insert of the expenses and one of all their payments.
+    Their first payment dates come from the `payment_dates` context, in the same order.
+    """
+
+    def create(self, validated_data):
+        expenses, schedules, errors = [], [], []
+        for attrs, payment_date in zip(validated_data, self.context['payment_dates'], strict=True):
+            expense = Expense(**attrs)
+            try:
+                schedules.append(expense.schedule_payments(payment_date))
+            except (ValueError, OverflowError):
+                errors.append({'number_of_recurrences': [RECURRENCES_OVERFLOW]})
+                continue
+            errors.append({})
+            expenses.append(expense)
+        if any(errors):
+            raise serializers.ValidationError(errors)
+
+        with transaction.atomic():
+            if connection.features.can_return_rows_from_bulk_insert:
+                Expense.objects.bulk_create(expenses, batch_size=PAYMENT_BATCH_SIZE)
+            else:
+                for expense in expenses:
+                    expense.save()
+            payments = (
+                Payment(expense=expense, date=date) for expense, dates in zip(expenses, schedules) for date in dates
+            )
+            Payment.objects.bulk_create(payments, batch_size=PAYMENT_BATCH_SIZE)
+            delta = RollupDelta()
+            for expense, dates in zip(expenses, schedules):
+                delta.add(expense, expense.rollup_months(dates))
+            apply_or_defer(self.context, delta)
+            for account_id in {expense.account_id for expense in expenses}:
+                # Bulk inserts don't send the signals that invalidate the cached responses.
+                invalidate_account(account_id)
+        return expenses
+
+
+class ExpenseSerializer(SparseFieldsMixin, ValuesSerializerMixin, serializers.ModelSerializer):
     recurring = serializers.ReadOnlyField()
-    recurrence_until_cancelled = serializers.ReadOnlyField()
     payments = serializers.StringRelatedField(many=True, read_only=True)
+    values_requires = {'recurring': ['number_of_recurrences'], 'payments': ['id', 'name']}
 
     class Meta:
         model = Expense
         fields = '__all__'
+        read_only_fields = ['first_payment_date', 'last_payment_date']
+        list_serializer_class = ExpenseListSerializer
+
+    def values_for_payments(self, rows):
+        if not rows:
+            return []
+        payments = {row['id']: [] for row in rows}
+        names = {row['id']: row['name'] for row in rows}
+        for expense_id, date in Payment.objects.filter(expense__in=list(payments)).values_list('expense_id', 'date'):
+            payments[expense_id].append(Payment.describe(date, names[expense_id]))
+        return [payments[row['id']] for row in rows]
+
+    def validate_virtual_payments(self, value):
+        # Switching would leave the schedule half stored, or stored twice.
+        if self.instance is not None and value != self.instance.virtual_payments:
+            raise serializers.ValidationError("Can't be changed once the expense is created.")
+        return value
 
     def create(self, validated_data):
-        recurrences = validated_data.get('number_of_recurrences', 0)
-        payment_date = datetime.strptime(self.context['payment_date'], "%Y-%m-%d %H:%M:%S")
-        payment_date_aware = timezone.make_aware(payment_date)
-        expense = Expense.objects.create(**validated_data)
-        Payment.objects.create(expense=expense, date=payment_date_aware)
-        for i in range(recurrences):
-            Payment.objects.create(expense=expense, date=(payment_date_aware+relativedelta(months=i+1)))
+        expense = Expense(**validated_data)
+        try:
+            dates = expense.schedule_payments(parse_payment_date(self.context['payment_date']))
+        except (ValueError, OverflowError):
+            raise serializers.ValidationError({'number_of_recurrences': RECURRENCES_OVERFLOW})
+        self.save_with_payments(expense, dates)
+        return expense
+
+    @retry_on_busy
+    def save_with_payments(self, expense, dates):
+        # A retried attempt starts over from an unsaved expense.
+        expense.pk = None
+        with transaction.atomic():
+            expense.save()
+            expense.create_payments(dates)
+            delta = RollupDelta()
+            delta.add(expense, expense.rollup_months(dates))
+            delta.apply()
+
+    def update(self, instance, validated_data):
+        schedule_fields = {'recurrence', 'number_of_recurrences'}
+        rollup_fields = schedule_fields | {'amount', 'category'}
+        delta = RollupDelta()
+        if rollup_fields & set(validated_data):
+            months = instance.rollup_months()
+            delta.remove(instance, months)
+        with transaction.atomic():
+            expense = super().update(instance, validated_data)
+            if expense.first_payment_date is not None and schedule_fields & set(validated_data):
+                try:
+                    expense.schedule_payments(expense.first_payment_date)
+                except (ValueError, OverflowError):
+                    raise serializers.ValidationError({'number_of_recurrences': RECURRENCES_OVERFLOW})
+                expense.save(update_fields=['last_payment_date'])
+            if rollup_fields & set(validated_data):
+                # Only virtual schedules change with the recurrence, stored payments stay.
+                delta.add(expense, expense.rollup_months() if expense.virtual_payments else months)
+                apply_or_defer(self.context, delta)
         return expense
@@ -0,0 +1,41 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from api.cache import invalidate_account
+from api.models import Account, AmountModifier, Expense, Income, Payment
+from api.sqlite import apply_pragmas
+
+
+@receiver([post_save, post_delete], sender=Account)
+def account_changed(sender, instance, **kwargs):
+    invalidate_account(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Expense)
+def expense_changed(sender, instance, **kwargs):
+    invalidate_account(instance.account_id)
+
+
+# No post_delete receiver: it would stop the payments of a deleted expense from being
+# deleted with a single query. Deleting the expense already bumps the version.
+@receiver(post_save, sender=Payment)
+def payment_changed(sender, instance, **kwargs):
+    invalidate_account(instance.expense.account_id)
+
+
+@receiver([post_save, post_delete], sender=Income)
+def income_changed(sender, instance, **kwargs):
+    invalidate_account(instance.account_id)
+
+
+@receiver([post_save, post_delete], sender=AmountModifier)
+def modifier_changed(sender, instance, **kwargs):
+    owner = instance.income if instance.income_id is not None else instance.expense
+    if owner is not None:
+        invalidate_account(owner.account_id)
+
+
+@receiver(connection_created)
+def tune_sqlite(sender, connection, **kwargs):
+    apply_pragmas(connection)
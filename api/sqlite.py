@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.db import OperationalError, transaction
+from collections import Counter
+from functools import wraps
+from time import sleep
+import random
+
+# Attempts after the first one, and the base of the exponential backoff between them in seconds.
+BUSY_RETRIES = 5
+BUSY_BACKOFF = 0.02
+
+stats = Counter()
+
+
+def apply_pragmas(connection, pragmas=None):
+    pragmas = settings.SQLITE_PRAGMAS if pragmas is None else pragmas
+    if connection.vendor != 'sqlite' or not pragmas:
+        return
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def is_busy(error):
+    message = str(error)
+    return 'database is locked' in message or 'database table is locked' in message or 'busy' in message
+
+
+def retry_on_busy(function):
+    """
+    Runs `function` again, after a growing random delay, when SQLite reports that the database is
+    locked by another writer. A deferred SQLite transaction that reads before writing fails right
+    away instead of waiting for the busy timeout, so this is what lets concurrent writers through.
+    Only retries when the call isn't part of an outer transaction, which would be left broken.
+    """
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        outer = transaction.get_connection().in_atomic_block
+        for attempt in range(BUSY_RETRIES + 1):
+            try:
+                return function(*args, **kwargs)
+            except OperationalError as e:
+                if outer or attempt == BUSY_RETRIES or not is_busy(e):
+                    raise
+                stats['retries'] += 1
+                sleep(BUSY_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5))
+
+    return wrapper
@@ -1,10 +1,47 @@
+from django.conf import settings
+from django.contrib import admin
 from django.urls import reverse
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, transaction
+from django.test import LiveServerTestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory, APITestCase
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
 from freezegun import freeze_time
+from asgiref.sync import async_to_sync
+from datetime import date, datetime, timedelta
+from io import StringIO
+from tempfile import TemporaryDirectory
+from types import SimpleNamespace
+from unittest import skipUnless
+from unittest.mock import patch
+import asyncio
+import csv
+import gzip
+import io
+import json
+import msgpack
+import os
 
-from api.models import Account, Expense, Payment
+from api import sqlite
+from api.authentication import denylist
+from api.dates import schedule
+from api.forecast import FORECAST_MAX_DAYS
+from api.imports import ExpenseImporter, read_ndjson
+from api.db_routers import ReplicaRouter, pinned_to_primary, read_from_replica
+from api.metrics import registry
+from api.middleware import MetricsMiddleware, ProfilingMiddleware
+from api.models import RECURRENCE_STEPS, Account, AmountModifier, Expense, Income, Payment
+from api.renderers import ORJSONRenderer
+from api.rollups import RollupDelta
+from api.sqlite import apply_pragmas, retry_on_busy
+from api.views import ExpenseViewSet, PaymentViewSet
 # Create your tests here.
 
 JWT_URL = 'http://localhost:8000/api/token/'
@@ -31,6 +68,8 @@ RECURRING_EXPENSE_2 = {
     "payment_date": "2022-4-20 23:59:59"
 }
 
+VIRTUAL_EXPENSE = dict(RECURRING_EXPENSE_2, virtual_payments=True)
+
 
 class AccountAndUserTest(APITestCase):
 
@@ -45,6 +84,64 @@ class AccountAndUserTest(APITestCase):
         self.assertEqual(Account.objects.get().owner.username, 'test77')
 
 
+class AuthenticationTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="test77", email="test@gmail.com", password="test77test")
+        cls.account = Account.objects.create(owner=cls.user)
+
+    def setUp(self):
+        cache.clear()
+
+    def obtain_tokens(self):
+        response = self.client.post(JWT_URL, {"username": self.user.username, "password": "test77test"})
+        assert response.status_code == status.HTTP_200_OK
+        return response.data
+
+    def test_token_carries_account(self):
+        tokens = self.obtain_tokens()
+        self.assertEqual(AccessToken(tokens['access'])['account_id'], self.account.pk)
+        response = self.client.post(reverse('token_refresh'), {"refresh": tokens['refresh']})
+        self.assertEqual(AccessToken(response.data['access'])['account_id'], self.account.pk)
+
+    def test_authentication_without_queries(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.obtain_tokens()['access'])
+        url = reverse('api:expenses-list')
+        self.client.get(url, format='json')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse([query for query in queries if '"auth_user"' in query['sql'] or '"api_account"' in query['sql']])
+
+    def test_token_of_deleted_account(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.obtain_tokens()['access'])
+        Account.objects.filter(pk=self.account.pk).delete()
+        response = self.client.post(reverse('api:expenses-list'), BASIC_EXPENSE_1, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(reverse('api:account-list')).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_token_without_account_claim(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(RefreshToken.for_user(self.user).access_token))
+        response = self.client.post(reverse('api:expenses-list'), BASIC_EXPENSE_1, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['account'], self.account.pk)
+
+    def test_revoke_token(self):
+        tokens = self.obtain_tokens()
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + tokens['access'])
+        url = reverse('api:expenses-list')
+        self.assertEqual(self.client.get(url, format='json').status_code, status.HTTP_200_OK)
+        response = self.client.post(reverse('token_revoke'), {"refresh": tokens['refresh']})
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.get(url, format='json').status_code, status.HTTP_401_UNAUTHORIZED)
+        self.client.credentials()
+        response = self.client.post(reverse('token_refresh'), {"refresh": tokens['refresh']})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        denylist.load()
+        self.assertIn(AccessToken(tokens['access'])['jti'], denylist)
+
+
 class ExpenseViewSetTest(APITestCase):
 
     @classmethod
@@ -52,6 +149,9 @@ class ExpenseViewSetTest(APITestCase):
         cls.user = User.objects.create_user(username="test77", email="test@gmail.com", password="test77test")
         Account.objects.create(owner=cls.user)
 
+    def setUp(self):
+        cache.clear()
+
     def addItems(self):
         url = reverse('api:expenses-list')
         self.client.post(url, BASIC_EXPENSE_1, format='json')
@@ -91,6 +191,36 @@ class ExpenseViewSetTest(APITestCase):
         self.assertEqual(len(response.data['payments']), 4)
         self.assertEqual(Payment.objects.count(), 4)
 
+    def test_recurring_expense_follows_recurrence(self):
+        self.authenticate()
+        url = reverse('api:expenses-list')
+        cases = {
+            "DA": ["2022-01-31", "2022-02-01", "2022-02-02"],
+            "WE": ["2022-01-31", "2022-02-07", "2022-02-14"],
+            "BW": ["2022-01-31", "2022-02-14", "2022-02-28"],
+            "MO": ["2022-01-31", "2022-02-28", "2022-03-31"],
+            "YE": ["2022-01-31", "2023-01-31", "2024-01-31"],
+            "ON": ["2022-01-31"],
+        }
+        for recurrence, expected in cases.items():
+            data = dict(RECURRING_EXPENSE_1, recurrence=recurrence, number_of_recurrences=2,
+                        payment_date="2022-1-31 10:00:00")
+            response = self.client.post(url, data, format='json')
+            assert response.status_code == status.HTTP_201_CREATED
+            payments = Payment.objects.filter(expense=response.data['id']).order_by('date')
+            dates = [timezone.localtime(payment.date).strftime("%Y-%m-%d") for payment in payments]
+            self.assertEqual(dates, expected)
+
+    def test_create_recurring_expense_in_bulk(self):
+        self.authenticate()
+        url = reverse('api:expenses-list')
+        data = dict(RECURRING_EXPENSE_1, recurrence="DA", number_of_recurrences=2500)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, data, format='json')
+        assert response.status_code == status.HTTP_201_CREATED
+        self.assertEqual(Payment.objects.count(), 2501)
+        self.assertLess(len(queries), 20)
+
     def test_can_view_all_expenses(self):
         self.authenticate()
         url = reverse('api:expenses-list')
@@ -215,6 +345,177 @@ class ExpenseViewSetTest(APITestCase):
         self.assertEqual(response.data['total'], 1400)
 
 
+    @freeze_time("2022-04-25")
+    def test_view_expenses_by_month_counts_expense_once(self):
+        self.authenticate()
+        url = reverse('api:expenses-list')
+        response = self.client.post(url, BASIC_EXPENSE_1, format='json')
+        expense = Expense.objects.get(pk=response.data['id'])
+        Payment.objects.create(expense=expense, date=expense.payments.get().date - timedelta(days=7))
+        url = reverse('api:expenses-expenses-by-month')
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['expenses']), 1)
+        self.assertEqual(response.data['total'], 220)
+
+    @freeze_time("2022-04-25")
+    def test_view_expenses_by_month_only_own_account(self):
+        other = User.objects.create_user(username="other", email="other@gmail.com", password="other77test")
+        other_expense = Expense.objects.create(name="Rent", amount=900, account=Account.objects.create(owner=other))
+        Payment.objects.create(expense=other_expense)
+        self.authenticate()
+        self.addItems()
+        url = reverse('api:expenses-expenses-by-month')
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['expenses']), 6)
+        self.assertEqual(response.data['total'], 2555)
+
+    @freeze_time("2022-04-25")
+    def test_view_summary(self):
+        self.authenticate()
+        self.addItems()
+        url = reverse('api:expenses-summary')
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['month'], 'April')
+        self.assertEqual(response.data['year'], 2022)
+        self.assertEqual(response.data['total'], 2555)
+        self.assertEqual(response.data['count'], 6)
+        categories = {category['category']: category for category in response.data['categories']}
+        self.assertEqual(set(categories), {'FO', 'HO', 'ME', 'PE', 'UT'})
+        self.assertEqual(categories['UT']['total'], 735)
+        self.assertEqual(categories['UT']['count'], 2)
+        url = reverse('api:expenses-summary')+'?month=1'
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['total'], 0)
+        self.assertEqual(response.data['count'], 0)
+        self.assertEqual(response.data['categories'], [])
+        url = reverse('api:expenses-summary')+'?month=d'
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @freeze_time("2022-04-25")
+    def test_view_summary_single_query(self):
+        self.authenticate()
+        self.addItems()
+        url = reverse('api:expenses-summary')
+        with self.assertNumQueries(1):
+            # monthly rollups
+            response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+    @freeze_time("2022-04-25")
+    def test_view_expenses_with_date_range(self):
+        self.authenticate()
+        self.addItems()
+        url = reverse('api:expenses-list')+'?from=2022-04-01&to=2022-04-30'
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 6)
+        url = reverse('api:expenses-list')+'?from=2022-04-29'
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 4)
+        url = reverse('api:expenses-list')+'?year=2023'
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 1)
+        url = reverse('api:expenses-summary')+'?month=4&to=2022-04-20'
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['total'], 535)
+        url = reverse('api:expenses-list')+'?from=2022-13-01'
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        url = reverse('api:expenses-list')+'?year=9999'
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(reverse('api:expenses-list')+'?year=9999&month=12', format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("supported month", response.data['error'])
+        for name in ['api:expenses-list', 'api:payments-list', 'api:payments-upcoming-payments', 'api:expenses-export']:
+            response = self.client.get(reverse(name)+'?to=9999-12-31')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, name)
+
+    @freeze_time("2022-04-25")
+    def test_account_expense_averages(self):
+        self.authenticate()
+        self.addItems()
+        account = Account.objects.get(owner=self.user)
+        self.assertEqual(account.this_month_expense_average, 2555 / 24)
+        self.assertEqual(account.monthly_expense_average(date(2022, 6, 1)), 970 / 30)
+
+
+    @freeze_time("2022-04-25")
+    def test_rollups_follow_writes(self):
+        self.authenticate()
+        self.addItems()
+        url = reverse('api:expenses-summary')
+        expense = Expense.objects.get(name="Water")
+        response = self.client.patch(reverse('api:expenses-detail', args=[expense.pk]), {"amount": 100}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(url, format='json').data['total'], 2305)
+        response = self.client.patch(reverse('api:expenses-detail', args=[expense.pk]), {"category": "FO"}, format='json')
+        categories = {category['category']: category for category in self.client.get(url, format='json').data['categories']}
+        self.assertEqual(categories['FO']['total'], 320)
+        self.assertEqual(categories['UT']['count'], 1)
+        expense = Expense.objects.get(name="Internet")
+        response = self.client.delete(reverse('api:expenses-detail', args=[expense.pk]), format='json')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.data['total'], 1920)
+        self.assertEqual(response.data['count'], 5)
+        self.assertEqual(self.client.get(url+'?month=10', format='json').data['total'], 0)
+
+    @freeze_time("2022-04-25")
+    def test_rebuild_rollups(self):
+        self.authenticate()
+        self.addItems()
+        response = self.client.post(reverse('api:expenses-list'), dict(VIRTUAL_EXPENSE, name="Phone"), format='json')
+        phone = reverse('api:expenses-detail', args=[response.data['id']])
+        account = Account.objects.get(owner=self.user)
+        fields = ('year', 'month', 'category', 'total', 'count')
+        incremental = list(account.rollups.order_by(*fields).values_list(*fields))
+        account.rollups.all().delete()
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual(list(account.rollups.order_by(*fields).values_list(*fields)), incremental)
+        self.assertEqual(len(incremental), 21)
+
+        self.client.patch(phone, {"number_of_recurrences": 3, "amount": 99.9, "category": "EN"}, format='json')
+        water = Expense.objects.get(name="Water")
+        self.client.patch(reverse('api:expenses-detail', args=[water.pk]), {"amount": 0.1}, format='json')
+        self.client.delete(reverse('api:expenses-detail', args=[Expense.objects.get(name="WoW").pk]))
+        incremental = list(account.rollups.order_by(*fields).values_list(*fields))
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual(list(account.rollups.order_by(*fields).values_list(*fields)), incremental)
+
+    @freeze_time("2022-04-25")
+    def test_admin_writes_update_rollups(self):
+        self.authenticate()
+        self.addItems()
+        account = Account.objects.get(owner=self.user)
+        fields = ('year', 'month', 'category', 'total', 'count')
+        expense_admin, payment_admin = admin.site._registry[Expense], admin.site._registry[Payment]
+        internet = Expense.objects.get(name="Internet")
+        internet.amount, internet.category = 400, "EN"
+        expense_admin.save_model(None, internet, None, True)
+        # The April payment moves to May, and the last one, in April 2023, is deleted.
+        payment = internet.payments.order_by('date').first()
+        payment.date += timedelta(days=15)
+        payment_admin.save_model(None, payment, None, True)
+        payment_admin.delete_model(None, internet.payments.order_by('date').last())
+        expense_admin.delete_queryset(None, Expense.objects.filter(name="WoW"))
+        incremental = list(account.rollups.order_by(*fields).values_list(*fields))
+        months = [(year, month) for year, month, category, _, _ in incremental if category == 'EN']
+        self.assertEqual(months, [(2022, month) for month in range(5, 13)] + [(2023, month) for month in range(1, 4)])
+        self.assertIn((2022, 5, 'EN', 400, 1), incremental)
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual(list(account.rollups.order_by(*fields).values_list(*fields)), incremental)
+
+
 class PaymentViewSetTest(APITestCase):
 
     @classmethod
@@ -222,6 +523,9 @@ class PaymentViewSetTest(APITestCase):
         cls.user = User.objects.create_user(username="test77", email="test@gmail.com", password="test77test")
         Account.objects.create(owner=cls.user)
 
+    def setUp(self):
+        cache.clear()
+
     def addItems(self):
         url = reverse('api:expenses-list')
         self.client.post(url, BASIC_EXPENSE_1, format='json')
@@ -279,3 +583,1318 @@ class PaymentViewSetTest(APITestCase):
         self.assertEqual(response.data['count'], 1)
         self.assertEqual(response.data['total'], 200)
 
+    @freeze_time("2022-04-25")
+    def test_view_upcoming_payments_virtual(self):
+        self.authenticate()
+        url = reverse('api:expenses-list')
+        for expense in [BASIC_EXPENSE_1, BASIC_EXPENSE_2, BASIC_EXPENSE_3, BASIC_EXPENSE_4, BASIC_EXPENSE_5,
+                        BASIC_EXPENSE_6, RECURRING_EXPENSE_1, VIRTUAL_EXPENSE]:
+            self.client.post(url, expense, format='json')
+        self.assertEqual(Payment.objects.filter(expense__name="Internet").count(), 1)
+        url = reverse('api:payments-upcoming-payments')
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 19)
+        self.assertEqual(response.data['total'], 10395)
+        self.assertEqual(response.data['results'][0]['name'], "Internet")
+        self.assertIsNone(response.data['results'][0]['id'])
+        response = self.client.get(url+'?from=2022-05-01&to=2022-05-31', format='json')
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual(response.data['total'], 4805)
+        url = reverse('api:expenses-expenses-by-month')+'?month=10'
+        response = self.client.get(url, format='json')
+        self.assertEqual(len(response.data['expenses']), 1)
+        self.assertEqual(response.data['total'], 385)
+        url = reverse('api:expenses-summary')+'?month=6'
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual(response.data['total'], 970)
+
+    @freeze_time("2022-04-25")
+    def test_view_upcoming_payments_virtual_pages(self):
+        self.authenticate()
+        url = reverse('api:expenses-list')
+        for expense in [BASIC_EXPENSE_1, BASIC_EXPENSE_2, BASIC_EXPENSE_3, RECURRING_EXPENSE_1, VIRTUAL_EXPENSE,
+                        dict(VIRTUAL_EXPENSE, name="Coffee", amount=3, recurrence="DA", number_of_recurrences=30000)]:
+            self.client.post(url, expense, format='json')
+        url = reverse('api:payments-upcoming-payments')
+        first = self.client.get(url + '?page_size=7', format='json').data
+        # Both virtual expenses start on April 20, 12 Internet and 29996 Coffee payments are after today.
+        self.assertEqual(first['count'], 3 + 3 + 12 + 29996)
+        self.assertEqual(first['total'], 220 + 4220 + 385 + 600 + 12 * 385 + 29996 * 3)
+        self.assertEqual(first['results'][0]['name'], "Coffee")
+        seen = []
+        for page in range(1, 7):
+            response = self.client.get(url + f'?page_size=7&page={page}&to=2022-05-31', format='json')
+            seen += response.data['results']
+        dates = [payment['date'] for payment in seen]
+        self.assertEqual(len(dates), 37 + 5)
+        self.assertEqual(dates, sorted(dates, reverse=True))
+        self.assertEqual(response.data['count'], len(dates))
+        self.assertEqual([payment['name'] for payment in seen].count("Internet"), 1)
+
+    @freeze_time("2022-04-25")
+    def test_virtual_payments_cannot_be_switched(self):
+        self.authenticate()
+        response = self.client.post(reverse('api:expenses-list'), VIRTUAL_EXPENSE, format='json')
+        url = reverse('api:expenses-detail', args=[response.data['id']])
+        response = self.client.patch(url, {"virtual_payments": False}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('virtual_payments', response.data)
+        self.assertTrue(Expense.objects.get(name="Internet").virtual_payments)
+        response = self.client.get(reverse('api:payments-upcoming-payments'), format='json')
+        self.assertEqual(response.data['count'], 12)
+        response = self.client.patch(url, {"virtual_payments": True, "amount": 400}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @freeze_time("2022-04-25")
+    def test_view_upcoming_payments_totals_across_pages(self):
+        self.authenticate()
+        self.addItems()
+        url = reverse('api:payments-upcoming-payments')+'?page_size=5'
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 19)
+        self.assertEqual(response.data['total'], 10395)
+        self.assertEqual(response.data['page_total'], sum(float(payment['expense']) for payment in response.data['results']))
+        response = self.client.get(url+'&page=4', format='json')
+        self.assertEqual(response.data['total'], 10395)
+        self.assertEqual(response.data['page_total'], 385 + 200 + 220 + 350)
+
+    def test_view_payments_with_cursor(self):
+        self.authenticate()
+        self.addItems()
+        url = reverse('api:payments-list')
+        expected = list(Payment.objects.order_by('-date', '-id').values_list('id', flat=True))
+        self.assertEqual(len(expected), 23)
+        ids, previous = [], []
+        next_url = url+'?pagination=cursor&page_size=2'
+        while next_url:
+            response = self.client.get(next_url, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.data)
+            ids.extend(payment['id'] for payment in response.data['results'])
+            previous.append(response.data['previous'])
+            next_url = response.data['next']
+        self.assertEqual(ids, expected)
+        self.assertIsNone(previous[0])
+        response = self.client.get(previous[-1], format='json')
+        self.assertEqual([payment['id'] for payment in response.data['results']], expected[-3:-1])
+        response = self.client.get(url+'?cursor=bad', format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @freeze_time("2022-04-25")
+    def test_view_payments_with_date_range(self):
+        self.authenticate()
+        self.addItems()
+        url = reverse('api:payments-list')+'?month=5'
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 3)
+        url = reverse('api:payments-upcoming-payments')+'?to=2022-05-31'
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 6)
+
+
+
+@freeze_time("2022-04-25")
+class QueryCountTest(APITestCase):
+    """Query counts of list endpoints must not depend on the number of rows returned."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="test77", email="test@gmail.com", password="test77test")
+        cls.account = Account.objects.create(owner=cls.user)
+
+    def setUp(self):
+        cache.clear()
+
+    def authenticate(self):
+        response = self.client.post(JWT_URL, {"username": self.user.username, "password": "test77test"})
+        assert response.status_code == status.HTTP_200_OK
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + response.data['access'])
+
+    def addItems(self, number):
+        url = reverse('api:expenses-list')
+        for i in range(number):
+            data = dict(RECURRING_EXPENSE_1, name=f"Expense {i}", payment_date="2022-4-10 23:59:59")
+            self.client.post(url, data, format='json')
+
+    def assertConstantQueries(self, url, expected):
+        self.addItems(2)
+        with self.assertNumQueries(expected):
+            response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.addItems(8)
+        with self.assertNumQueries(expected):
+            response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_account_list(self):
+        self.authenticate()
+        # account
+        self.assertConstantQueries(reverse('api:account-list'), 1)
+
+    def test_expenses_list(self):
+        self.authenticate()
+        # validators, count, expenses, payments
+        self.assertConstantQueries(reverse('api:expenses-list'), 4)
+
+    def test_expenses_list_cursor(self):
+        self.authenticate()
+        # validators, expenses, payments
+        self.assertConstantQueries(reverse('api:expenses-list')+'?pagination=cursor&page_size=5', 3)
+
+    def test_expenses_by_category(self):
+        self.authenticate()
+        # count, expenses, payments
+        self.assertConstantQueries(reverse('api:expenses-expenses-by-category')+'?category=PE', 3)
+
+    def test_most_recent_expenses(self):
+        self.authenticate()
+        # count, expenses, payments
+        self.assertConstantQueries(reverse('api:expenses-most-recent-expenses'), 3)
+
+    def test_expenses_by_month(self):
+        self.authenticate()
+        # virtual schedules, monthly rollups, expenses, payments
+        self.assertConstantQueries(reverse('api:expenses-expenses-by-month'), 4)
+
+    def test_expenses_so_far(self):
+        self.authenticate()
+        # virtual schedules, total, expenses, payments
+        self.assertConstantQueries(reverse('api:expenses-expenses-so-far'), 4)
+
+    def test_summary(self):
+        self.authenticate()
+        # monthly rollups
+        self.assertConstantQueries(reverse('api:expenses-summary'), 1)
+
+    def test_payments_list(self):
+        self.authenticate()
+        # validators, count, payments with expenses
+        self.assertConstantQueries(reverse('api:payments-list'), 3)
+
+    def test_payments_list_cursor(self):
+        self.authenticate()
+        # validators, payments with expenses
+        self.assertConstantQueries(reverse('api:payments-list')+'?pagination=cursor&page_size=5', 2)
+
+    def test_upcoming_payments(self):
+        self.authenticate()
+        # virtual schedules, count, payments with expenses
+        self.assertConstantQueries(reverse('api:payments-upcoming-payments'), 3)
+
+
+@freeze_time("2022-04-25")
+class AccountQueryTest(APITestCase):
+    """Every endpoint loads the caller's account at most once."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="test77", email="test@gmail.com", password="test77test")
+        cls.account = Account.objects.create(owner=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        response = self.client.post(JWT_URL, {"username": self.user.username, "password": "test77test"})
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + response.data['access'])
+        url = reverse('api:expenses-list')
+        self.expense = self.client.post(url, RECURRING_EXPENSE_1, format='json').data
+        self.payment = Payment.objects.filter(expense=self.expense['id']).first()
+
+    def assertAccountQueries(self, method, url, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, data, format='json')
+        self.assertLess(response.status_code, 300)
+        account_queries = [query['sql'] for query in queries if '"api_account"' in query['sql']]
+        self.assertLessEqual(len(account_queries), 1, account_queries)
+
+    def test_account(self):
+        self.assertAccountQueries('get', reverse('api:account-list'))
+
+    def test_expenses(self):
+        detail = reverse('api:expenses-detail', args=[self.expense['id']])
+        self.assertAccountQueries('get', reverse('api:expenses-list'))
+        self.assertAccountQueries('post', reverse('api:expenses-list'), BASIC_EXPENSE_1)
+        self.assertAccountQueries('get', detail)
+        self.assertAccountQueries('patch', detail, {"name": "Renamed"})
+        self.assertAccountQueries('get', reverse('api:expenses-expenses-by-category')+'?category=PE')
+        self.assertAccountQueries('get', reverse('api:expenses-most-recent-expenses'))
+        self.assertAccountQueries('get', reverse('api:expenses-expenses-by-month'))
+        self.assertAccountQueries('get', reverse('api:expenses-expenses-so-far'))
+        self.assertAccountQueries('get', reverse('api:expenses-summary'))
+        self.assertAccountQueries('delete', detail)
+
+    def test_payments(self):
+        self.assertAccountQueries('get', reverse('api:payments-list'))
+        self.assertAccountQueries('get', reverse('api:payments-detail', args=[self.payment.pk]))
+        self.assertAccountQueries('get', reverse('api:payments-upcoming-payments'))
+
+
+@freeze_time("2022-04-25")
+class ResponseCacheTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="test77", email="test@gmail.com", password="test77test")
+        cls.account = Account.objects.create(owner=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        self.authenticate(self.user)
+
+    def authenticate(self, user):
+        response = self.client.post(JWT_URL, {"username": user.username, "password": "test77test"})
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + response.data['access'])
+
+    def test_repeated_get_is_cached(self):
+        url = reverse('api:expenses-expenses-by-month')
+        self.client.post(reverse('api:expenses-list'), BASIC_EXPENSE_1, format='json')
+        first = self.client.get(url)
+        self.assertEqual(first['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            second = self.client.get(url)
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.data, first.data)
+
+    def test_query_params_are_normalized(self):
+        url = reverse('api:expenses-list')
+        self.assertEqual(self.client.get(url + '?page_size=5&page=1')['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(url + '?page=1&page_size=5')['X-Cache'], 'HIT')
+        self.assertEqual(self.client.get(url + '?page=1&page_size=6')['X-Cache'], 'MISS')
+
+    def test_writes_invalidate_account(self):
+        url = reverse('api:expenses-list')
+        self.client.get(url)
+        expense = self.client.post(url, BASIC_EXPENSE_1, format='json').data
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['count'], 1)
+
+        detail = reverse('api:expenses-detail', args=[expense['id']])
+        self.client.patch(detail, {"name": "Renamed"}, format='json')
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['results'][0]['name'], "Renamed")
+
+        self.client.delete(detail)
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['count'], 0)
+
+    def test_accounts_do_not_share_responses(self):
+        url = reverse('api:expenses-list')
+        self.client.post(url, BASIC_EXPENSE_1, format='json')
+        self.client.get(url)
+        other = User.objects.create_user(username="other", password="test77test")
+        Account.objects.create(owner=other)
+        self.authenticate(other)
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['count'], 0)
+
+    def test_stats(self):
+        labels = (('route', 'api:payments-upcoming-payments'),)
+        hits, misses = registry.cache_hits.values[labels], registry.cache_misses.values[labels]
+        url = reverse('api:payments-upcoming-payments')
+        self.client.get(url)
+        self.client.get(url)
+        self.client.get(url)
+        self.assertEqual(registry.cache_misses.values[labels] - misses, 1)
+        self.assertEqual(registry.cache_hits.values[labels] - hits, 2)
+        text = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('api_response_cache_hits_total{route="api:payments-upcoming-payments"}', text)
+        self.assertIn('api_response_cache_misses_total{route="api:payments-upcoming-payments"}', text)
+
+
+class ConditionalGetTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="test77", email="test@gmail.com", password="test77test")
+        cls.account = Account.objects.create(owner=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        response = self.client.post(JWT_URL, {"username": self.user.username, "password": "test77test"})
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + response.data['access'])
+        self.expense = self.client.post(reverse('api:expenses-list'), RECURRING_EXPENSE_1, format='json').data
+
+    def test_unchanged_list_is_not_modified(self):
+        url = reverse('api:expenses-list')
+        response = self.client.get(url)
+        self.assertIn('ETag', response)
+        self.assertNotIn('Last-Modified', response)
+        # validators only
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+
+    def test_if_modified_since(self):
+        url = reverse('api:expenses-detail', args=[self.expense['id']])
+        response = self.client.get(url)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_if_modified_since_after_delete(self):
+        other = self.client.post(reverse('api:expenses-list'), BASIC_EXPENSE_1, format='json').data
+        url = reverse('api:expenses-detail', args=[other['id']])
+        last_modified = self.client.get(url)['Last-Modified']
+        self.client.delete(url)
+        for name in ['api:expenses-list', 'api:payments-list']:
+            response = self.client.get(reverse(name), HTTP_IF_MODIFIED_SINCE=last_modified)
+            self.assertEqual(response.status_code, status.HTTP_200_OK, name)
+
+    def test_writes_change_validators(self):
+        url = reverse('api:payments-list')
+        detail = reverse('api:expenses-detail', args=[self.expense['id']])
+        etags = [self.client.get(url)['ETag']]
+        self.client.patch(detail, {"amount": 250}, format='json')
+        etags.append(self.client.get(url)['ETag'])
+        self.client.post(reverse('api:expenses-list'), BASIC_EXPENSE_1, format='json')
+        etags.append(self.client.get(url)['ETag'])
+        self.client.delete(detail)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etags[-1])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etags.append(response['ETag'])
+        self.assertEqual(len(set(etags)), 4)
+
+    def test_validators_follow_filters(self):
+        url = reverse('api:payments-list') + '?from=2022-04-01&to=2022-04-30'
+        etag = self.client.get(url)['ETag']
+        self.client.post(reverse('api:expenses-list'), BASIC_EXPENSE_3, format='json')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.client.post(reverse('api:expenses-list'), BASIC_EXPENSE_1, format='json')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_detail(self):
+        url = reverse('api:expenses-detail', args=[self.expense['id']])
+        response = self.client.get(url)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        payment = Payment.objects.filter(expense=self.expense['id']).first()
+        url = reverse('api:payments-detail', args=[payment.pk])
+        response = self.client.get(url)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_missing_detail(self):
+        list_etag = self.client.get(reverse('api:expenses-list'))['ETag']
+        for pk in [self.expense['id'] + 100, 'abc']:
+            url = reverse('api:expenses-list') + f'{pk}/'
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=list_etag)
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+            self.assertNotIn('ETag', response)
+
+
+@freeze_time("2022-04-25")
+class AsyncViewTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="test77", email="test@gmail.com", password="test77test")
+        cls.account = Account.objects.create(owner=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        response = self.client.post(JWT_URL, {"username": self.user.username, "password": "test77test"})
+        self.token = response.data['access']
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.token)
+        self.client.post(reverse('api:expenses-list'), RECURRING_EXPENSE_2, format='json')
+
+    def test_read_actions_are_coroutines(self):
+        with self.settings(ASYNC_VIEWS=True):
+            self.assertTrue(asyncio.iscoroutinefunction(ExpenseViewSet.as_view({'get': 'expenses_by_month'})))
+            self.assertTrue(asyncio.iscoroutinefunction(PaymentViewSet.as_view({'get': 'retrieve'})))
+            self.assertFalse(asyncio.iscoroutinefunction(ExpenseViewSet.as_view({'get': 'summary'})))
+            # Writes sharing the route keep it synchronous.
+            self.assertFalse(asyncio.iscoroutinefunction(ExpenseViewSet.as_view({'get': 'list', 'post': 'create'})))
+        self.assertFalse(asyncio.iscoroutinefunction(PaymentViewSet.as_view({'get': 'list'})))
+
+    def test_same_response(self):
+        for viewset, basename, action in [
+            (PaymentViewSet, 'payments', 'list'),
+            (ExpenseViewSet, 'expenses', 'expenses_so_far'),
+            (PaymentViewSet, 'payments', 'upcoming_payments'),
+        ]:
+            url = reverse(f"api:{basename}-{action.replace('_', '-')}")
+            expected = self.client.get(url).data
+            cache.clear()
+            with self.settings(ASYNC_VIEWS=True):
+                view = viewset.as_view({'get': action}, basename=basename)
+            request = APIRequestFactory().get(url, HTTP_AUTHORIZATION='Bearer ' + self.token)
+            response = async_to_sync(view)(request)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data, expected)
+
+    def test_middleware_is_async_capable(self):
+        async def get_response(request):
+            return None
+
+        for middleware in [MetricsMiddleware, ProfilingMiddleware]:
+            self.assertTrue(asyncio.iscoroutinefunction(middleware(get_response)))
+            self.assertFalse(asyncio.iscoroutinefunction(middleware(lambda request: None)))
+        url = reverse('api:payments-upcoming-payments')
+        labels = (('route', 'api:payments-upcoming-payments'), ('method', 'GET'))
+        # The registry is global, only what this request adds is checked.
+        before = registry.queries.values.get(labels, [0])[-1]
+        response = async_to_sync(self.async_client.get)(url, authorization='Bearer ' + self.token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # The queries of the view's thread are counted.
+        self.assertGreater(registry.queries.values[labels][-1], before)
+
+
+class ManagementCommandTest(APITestCase):
+
+    def test_seed_data(self):
+        call_command('seed_data', users=3, expenses=20, seed=1, stdout=StringIO())
+        accounts = Account.objects.filter(owner__username__startswith='seed_')
+        self.assertEqual(accounts.count(), 3)
+        self.assertEqual(Expense.objects.filter(account__in=accounts).count(), 60)
+        for expense in Expense.objects.filter(account__in=accounts):
+            stored = 1 if expense.virtual_payments else expense.number_of_recurrences + 1
+            self.assertEqual(expense.payments.count(), stored)
+        self.assertTrue(self.client.login(username='seed_0', password='seed'))
+
+    def test_seed_data_prefix_in_use(self):
+        call_command('seed_data', users=1, expenses=1, stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command('seed_data', users=1, expenses=1, stdout=StringIO())
+
+    def test_benchmark_endpoints(self):
+        stdout = StringIO()
+        call_command('benchmark_endpoints', expenses=10, repeat=1, stdout=stdout)
+        report = json.loads(stdout.getvalue())
+        endpoints = {endpoint['name']: endpoint for endpoint in report['endpoints']}
+        self.assertIn('expenses-detail', endpoints)
+        self.assertIn('payments-upcoming-payments', endpoints)
+        self.assertTrue(all(endpoint['status'] == 200 for endpoint in endpoints.values()))
+        self.assertGreaterEqual(endpoints['expenses-list']['rows'], 10)
+        self.assertEqual(endpoints['account-list']['queries'], 1)
+        self.assertFalse(User.objects.filter(username__startswith='benchmark_endpoints').exists())
+
+    def test_benchmark_serialization(self):
+        stdout = StringIO()
+        call_command('benchmark_serialization', rows=20, repeat=1, stdout=stdout)
+        self.assertEqual(stdout.getvalue().count('identical output'), 3)
+        self.assertFalse(User.objects.filter(username__startswith='benchmark_serialization').exists())
+
+    def test_benchmark_renderers(self):
+        stdout = StringIO()
+        call_command('benchmark_renderers', rows=[5], repeat=1, stdout=stdout)
+        self.assertEqual(len(stdout.getvalue().splitlines()), 6)
+        self.assertFalse(User.objects.filter(username__startswith='benchmark_renderers').exists())
+
+    def test_benchmark_forecast(self):
+        stdout = StringIO()
+        call_command('benchmark_forecast', rules=20, years=2, repeat=1, stdout=stdout)
+        self.assertIn('same net cash flow', stdout.getvalue())
+        self.assertFalse(User.objects.filter(username__startswith='benchmark_forecast').exists())
+
+
+class LoadTestCommandTest(LiveServerTestCase):
+
+    def test_loadtest(self):
+        # A single user, the in-memory test database locks its tables under concurrent writes.
+        stdout = StringIO()
+        call_command('loadtest', url=self.live_server_url, users=1, requests=20, stdout=stdout)
+        self.assertIn(" 0 errors", stdout.getvalue())
+        self.assertIn("token ", stdout.getvalue())
+        self.assertTrue(Account.objects.filter(owner__username='load_0').exists())
+
+
+class MetricsTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="test77", email="test@gmail.com", password="test77test")
+        cls.account = Account.objects.create(owner=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        response = self.client.post(JWT_URL, {"username": self.user.username, "password": "test77test"})
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + response.data['access'])
+
+    def test_metrics(self):
+        self.client.post(reverse('api:expenses-list'), RECURRING_EXPENSE_1, format='json')
+        self.client.get(reverse('api:expenses-list'))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = response.content.decode()
+        self.assertIn('# TYPE api_request_duration_seconds histogram', text)
+        self.assertIn('api_requests_total{route="api:expenses-list",method="GET",status="200"}', text)
+        self.assertIn('api_sql_queries_bucket{route="api:expenses-list",method="POST",le="+Inf"}', text)
+        self.assertIn('api_sql_duration_seconds_sum{route="api:expenses-list",method="GET"}', text)
+
+    def test_unknown_methods(self):
+        self.client.generic('BREW', reverse('api:expenses-list'))
+        text = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('api_requests_total{route="api:expenses-list",method="other",status="405"}', text)
+        self.assertNotIn('BREW', text)
+
+    def test_query_budget(self):
+        with self.settings(SQL_QUERY_BUDGET=1), self.assertLogs('api.middleware', 'WARNING') as logs:
+            self.client.get(reverse('api:expenses-list'))
+        self.assertIn("over the budget of 1", logs.output[0])
+        text = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('api_query_budget_exceeded_total{route="api:expenses-list",method="GET"}', text)
+
+    def test_metrics_token(self):
+        with self.settings(METRICS_TOKEN='scrape'):
+            self.client.credentials()
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, status.HTTP_401_UNAUTHORIZED)
+            response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scrape')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class ProfilingTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="test77", email="test@gmail.com", password="test77test")
+        cls.account = Account.objects.create(owner=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        self.authenticate()
+        self.client.post(reverse('api:expenses-list'), RECURRING_EXPENSE_1, format='json')
+
+    def authenticate(self):
+        response = self.client.post(JWT_URL, {"username": self.user.username, "password": "test77test"})
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + response.data['access'])
+
+    def test_staff_only(self):
+        response = self.client.get(reverse('api:expenses-list') + '?profile=summary')
+        self.assertEqual(response.data['count'], 1)
+
+    def test_summary(self):
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        response = self.client.get(reverse('api:expenses-list'), HTTP_X_PROFILE='summary')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        report = response.json()
+        self.assertEqual(report['status'], 200)
+        self.assertGreater(report['serialization_ms'], 0)
+        self.assertGreater(report['rendering_ms'], 0)
+        self.assertEqual(report['sql']['count'], len(report['sql']['statements']))
+        self.assertTrue(any('"api_payment"' in query['sql'] for query in report['sql']['statements']))
+        self.assertTrue(report['functions'])
+
+    def test_dump(self):
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        with TemporaryDirectory() as directory, self.settings(PROFILE_DIR=directory):
+            response = self.client.get(reverse('api:payments-list') + '?profile=dump')
+            self.assertEqual(response.data['count'], 4)
+            self.assertEqual(os.listdir(directory), [response['X-Profile']])
+
+
+class ReplicaRouterTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="test77", email="test@gmail.com", password="test77test")
+        cls.account = Account.objects.create(owner=cls.user)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_router(self):
+        router = ReplicaRouter()
+        with patch('api.db_routers.replica_configured', return_value=True):
+            self.assertIsNone(router.db_for_read(Expense))
+            with read_from_replica():
+                self.assertEqual(router.db_for_read(Expense), 'replica')
+                self.assertEqual(router.db_for_write(Expense), 'default')
+        with patch('api.db_routers.replica_configured', return_value=False), read_from_replica():
+            self.assertIsNone(router.db_for_read(Expense))
+
+    def test_writes_pin_user_to_primary(self):
+        response = self.client.post(JWT_URL, {"username": self.user.username, "password": "test77test"})
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + response.data['access'])
+        with patch('api.db_routers.replica_configured', return_value=True):
+            self.client.post(reverse('api:expenses-list'), BASIC_EXPENSE_1, format='json')
+            self.assertTrue(pinned_to_primary(self.user.pk))
+            response = self.client.get(reverse('api:expenses-list'))
+        self.assertEqual(response.data['count'], 1)
+
+
+@skipUnless('replica' in settings.DATABASES, "Set DATABASE_REPLICA_URL, e.g. sqlite:////tmp/replica.sqlite3")
+class ReplicaRoutingTest(APITestCase):
+    """
+    Only runs with a replica configured, on its own, since the other tests only allow queries
+    to the default database:
+    DATABASE_REPLICA_URL=sqlite:////tmp/replica.sqlite3 python manage.py test api.tests.ReplicaRoutingTest
+    """
+    databases = '__all__'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="test77", email="test@gmail.com", password="test77test")
+        cls.account = Account.objects.create(owner=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        response = self.client.post(JWT_URL, {"username": self.user.username, "password": "test77test"})
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + response.data['access'])
+
+    def test_reads_go_to_replica_unless_pinned(self):
+        # The test replica isn't replicated, rows only written to the primary are missing there.
+        self.client.post(reverse('api:expenses-list'), BASIC_EXPENSE_1, format='json')
+        self.assertEqual(self.client.get(reverse('api:expenses-list')).data['count'], 1)
+        cache.clear()
+        self.assertEqual(self.client.get(reverse('api:expenses-list')).data['count'], 0)
+        self.assertEqual(self.client.get(reverse('api:payments-list')).data['count'], 0)
+        self.assertEqual(Expense.objects.count(), 1)
+
+
+class SQLiteTest(TransactionTestCase):
+
+    def test_retry_on_busy(self):
+        calls = []
+
+        @retry_on_busy
+        def create():
+            calls.append(1)
+            if len(calls) < 3:
+                raise OperationalError("database is locked")
+            return "created"
+
+        retries = sqlite.stats['retries']
+        with patch('api.sqlite.sleep'):
+            self.assertEqual(create(), "created")
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(sqlite.stats['retries'] - retries, 2)
+
+    def test_other_errors_are_not_retried(self):
+        calls = []
+
+        @retry_on_busy
+        def create():
+            calls.append(1)
+            raise OperationalError("no such table: api_expense")
+
+        with self.assertRaises(OperationalError):
+            create()
+        self.assertEqual(len(calls), 1)
+
+    def test_no_retry_inside_outer_transaction(self):
+        calls = []
+
+        @retry_on_busy
+        def create():
+            calls.append(1)
+            raise OperationalError("database is locked")
+
+        with self.assertRaises(OperationalError), transaction.atomic():
+            create()
+        self.assertEqual(len(calls), 1)
+
+    def test_apply_pragmas(self):
+        apply_pragmas(connection, {'cache_size': -1000})
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA cache_size')
+            self.assertEqual(cursor.fetchone()[0], -1000)
+
+
+@freeze_time("2022-04-25")
+class ValuesSerializationTest(APITestCase):
+    """List actions read `.values()` rows and must return what the serializers return."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="test77", email="test@gmail.com", password="test77test")
+        cls.account = Account.objects.create(owner=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        response = self.client.post(JWT_URL, {"username": self.user.username, "password": "test77test"})
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + response.data['access'])
+        url = reverse('api:expenses-list')
+        for data in [BASIC_EXPENSE_1, BASIC_EXPENSE_2, BASIC_EXPENSE_6, RECURRING_EXPENSE_1, RECURRING_EXPENSE_2]:
+            self.client.post(url, data, format='json')
+
+    def assertSameContent(self, url):
+        cache.clear()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        cache.clear()
+        with patch.object(ExpenseViewSet, 'values_serialization', False), \
+                patch.object(PaymentViewSet, 'values_serialization', False):
+            expected = self.client.get(url)
+        self.assertEqual(response.content, expected.content)
+        return response
+
+    def test_expenses(self):
+        for url in [
+            reverse('api:expenses-list'),
+            reverse('api:expenses-list') + '?pagination=cursor&page_size=2',
+            reverse('api:expenses-list') + '?from=2022-05-01&to=2022-06-01',
+            reverse('api:expenses-expenses-by-category') + '?category=UT',
+            reverse('api:expenses-most-recent-expenses'),
+            reverse('api:expenses-expenses-by-month'),
+            reverse('api:expenses-expenses-so-far'),
+        ]:
+            with self.subTest(url=url):
+                self.assertSameContent(url)
+
+    def test_payments(self):
+        self.client.post(reverse('api:expenses-list'), VIRTUAL_EXPENSE, format='json')
+        for url in [
+            reverse('api:payments-list'),
+            reverse('api:payments-list') + '?pagination=cursor&page_size=3',
+            reverse('api:payments-upcoming-payments'),
+        ]:
+            with self.subTest(url=url):
+                self.assertSameContent(url)
+
+    def test_cursor_pages(self):
+        url = reverse('api:payments-list') + '?pagination=cursor&page_size=4'
+        ids = []
+        while url:
+            response = self.assertSameContent(url)
+            ids += [payment['id'] for payment in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(len(ids), Payment.objects.count())
+        self.assertEqual(len(set(ids)), len(ids))
+
+    def test_sparse_fields(self):
+        url = reverse('api:expenses-list') + '?fields=id,name,recurring,payments'
+        response = self.assertSameContent(url)
+        self.assertEqual(list(response.data['results'][0]), ['id', 'recurring', 'payments', 'name'])
+        response = self.assertSameContent(reverse('api:payments-list') + '?fields=date,expense')
+        self.assertEqual(list(response.data['results'][0]), ['expense', 'date'])
+        expense = Expense.objects.first()
+        response = self.client.get(reverse('api:expenses-detail', args=[expense.pk]) + '?fields=amount')
+        self.assertEqual(response.data, {'amount': expense.amount})
+
+    def test_unknown_fields(self):
+        response = self.client.get(reverse('api:expenses-list') + '?fields=id,recurrence_until_cancelled')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data, {'error': "Unknown fields: recurrence_until_cancelled."})
+
+    def test_no_instances(self):
+        with patch.object(Expense, 'from_db') as from_db, patch.object(Payment, 'from_db') as payment_from_db:
+            self.client.get(reverse('api:expenses-list'))
+            self.client.get(reverse('api:payments-list'))
+        from_db.assert_not_called()
+        payment_from_db.assert_not_called()
+
+
+@freeze_time("2022-04-25")
+class RendererTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="test77", email="test@gmail.com", password="test77test")
+        cls.account = Account.objects.create(owner=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        response = self.client.post(JWT_URL, {"username": self.user.username, "password": "test77test"})
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + response.data['access'])
+        for data in [BASIC_EXPENSE_1, dict(RECURRING_EXPENSE_2, name="Café \u2028")]:
+            self.client.post(reverse('api:expenses-list'), data, format='json')
+
+    def test_same_json(self):
+        for url in [reverse('api:expenses-expenses-by-month'), reverse('api:payments-list')]:
+            data = self.client.get(url).data
+            self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+        data = {'date': timezone.now(), 'amount': 1.5, 1: [None, True]}
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_messagepack(self):
+        url = reverse('api:payments-list')
+        json_response = self.client.get(url)
+        response = self.client.get(url, HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content), json.loads(json_response.content))
+        self.assertNotEqual(response['ETag'], json_response['ETag'])
+        self.assertIn('Accept', response['Vary'])
+        response = self.client.get(url, HTTP_ACCEPT='application/msgpack', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_messagepack_request(self):
+        response = self.client.post(
+            reverse('api:expenses-list'), msgpack.packb(BASIC_EXPENSE_3), content_type='application/msgpack',
+            HTTP_ACCEPT='application/msgpack',
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(msgpack.unpackb(response.content)['name'], "Gas")
+
+    def test_parse_errors(self):
+        for body, content_type in [(b'{"name": ', 'application/json'), (b'\xc1', 'application/msgpack')]:
+            response = self.client.post(reverse('api:expenses-list'), body, content_type=content_type)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_browsable_api(self):
+        response = self.client.get(reverse('api:expenses-list'), HTTP_ACCEPT='text/html')
+        browsable = 'rest_framework.renderers.BrowsableAPIRenderer' in settings.REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES']
+        expected = status.HTTP_200_OK if browsable else status.HTTP_406_NOT_ACCEPTABLE
+        self.assertEqual(response.status_code, expected)
+
+
+@freeze_time("2022-04-25")
+class ExpenseBatchTest(APITestCase):
+    url = reverse('api:expenses-batch')
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="test77", email="test@gmail.com", password="test77test")
+        cls.account = Account.objects.create(owner=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        response = self.client.post(JWT_URL, {"username": self.user.username, "password": "test77test"})
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + response.data['access'])
+        self.pizza = self.client.post(reverse('api:expenses-list'), BASIC_EXPENSE_1, format='json').data
+        self.internet = self.client.post(reverse('api:expenses-list'), RECURRING_EXPENSE_2, format='json').data
+
+    def rollups(self):
+        fields = ('year', 'month', 'category', 'total', 'count')
+        return list(self.account.rollups.order_by(*fields).values_list(*fields))
+
+    def test_apply(self):
+        self.client.get(reverse('api:expenses-list'))
+        operations = [
+            {"op": "create", "data": BASIC_EXPENSE_2},
+            {"op": "create", "data": dict(RECURRING_EXPENSE_1, virtual_payments=True)},
+            {"op": "update", "id": self.internet['id'], "data": {"amount": 400, "number_of_recurrences": 2}},
+            {"op": "delete", "id": self.pizza['id']},
+        ]
+        response = self.client.post(self.url, operations, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual([result['status'] for result in results], [201, 201, 200, 204])
+        self.assertEqual(results[0]['data']['name'], "TV")
+        self.assertEqual(results[0]['data']['payments'], ["2022-05-21 | TV"])
+        self.assertEqual(len(results[1]['data']['payments']), 1)
+        self.assertEqual(results[1]['data']['last_payment_date'], "2022-06-30T23:59:59-05:00")
+        self.assertEqual(results[2]['data']['amount'], 400)
+        self.assertEqual(results[3]['id'], self.pizza['id'])
+        self.assertEqual(
+            self.client.get(reverse('api:expenses-detail', args=[results[0]['data']['id']])).data,
+            results[0]['data'],
+        )
+        self.assertFalse(Expense.objects.filter(pk=self.pizza['id']).exists())
+        self.assertEqual(self.client.get(reverse('api:expenses-list')).data['count'], 3)
+
+        rollups = self.rollups()
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual(self.rollups(), rollups)
+
+    def test_all_or_nothing(self):
+        rollups = self.rollups()
+        operations = [
+            {"op": "create", "data": BASIC_EXPENSE_2},
+            {"op": "create", "data": dict(BASIC_EXPENSE_3, amount="a lot")},
+            {"op": "update", "id": self.internet['id'], "data": {"amount": 400}},
+            {"op": "delete", "id": self.pizza['id'] + 100},
+            {"op": "delete", "id": self.pizza['id']},
+            {"op": "update", "id": self.pizza['id']},
+            {"op": "move"},
+        ]
+        response = self.client.post(self.url, operations, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual([result['status'] for result in response.data['results']], [424, 400, 424, 404, 424, 400, 400])
+        self.assertIn('amount', response.data['results'][1]['errors'])
+        self.assertEqual(Expense.objects.count(), 2)
+        self.assertEqual(Expense.objects.get(pk=self.internet['id']).amount, 385)
+        self.assertEqual(self.rollups(), rollups)
+
+    def test_errors_while_saving(self):
+        operations = [
+            {"op": "create", "data": BASIC_EXPENSE_2},
+            {"op": "create", "data": dict(RECURRING_EXPENSE_1, recurrence="YE", number_of_recurrences=10000)},
+        ]
+        response = self.client.post(self.url, operations, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual([result['status'] for result in response.data['results']], [424, 400])
+        self.assertEqual(Expense.objects.count(), 2)
+
+    def test_retried_update(self):
+        apply, calls = RollupDelta.apply, []
+
+        def busy_once(delta):
+            calls.append(delta)
+            if len(calls) == 1:
+                raise OperationalError("database is locked")
+            return apply(delta)
+
+        operations = [{"op": "update", "id": self.pizza['id'], "data": {"amount": 300, "category": "HO"}}]
+        # The test's transaction isn't one of the request, the batch's own is rolled back to a savepoint.
+        no_outer = SimpleNamespace(get_connection=lambda: SimpleNamespace(in_atomic_block=False))
+        with patch.object(RollupDelta, 'apply', autospec=True, side_effect=busy_once), \
+                patch('api.sqlite.transaction', no_outer), patch('api.sqlite.sleep'):
+            response = self.client.post(self.url, operations, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(calls), 2)
+        rollups = self.rollups()
+        self.assertIn((2022, 4, 'HO', 300, 1), rollups)
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual(self.rollups(), rollups)
+
+    def test_invalid_batches(self):
+        for body in [{"op": "create"}, [], ["create"]]:
+            response = self.client.post(self.url, body, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('error', response.data)
+        with self.settings(EXPENSE_BATCH_LIMIT=1):
+            response = self.client.post(self.url, [{"op": "delete", "id": 1}] * 2, format='json')
+        self.assertEqual(response.data, {"error": "At most 1 operations per batch."})
+
+    def test_bulk_inserts(self):
+        def batch(size):
+            operations = [{"op": "create", "data": dict(RECURRING_EXPENSE_1, name=f"E{i}")} for i in range(size)]
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(self.url, operations, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return len(queries)
+
+        self.assertEqual(batch(2), batch(20))
+        self.assertEqual(Payment.objects.filter(expense__name="E19").count(), 4)
+
+
+@freeze_time("2022-04-25")
+class ExportTest(APITestCase):
+    url = reverse('api:expenses-export')
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="test77", email="test@gmail.com", password="test77test")
+        cls.account = Account.objects.create(owner=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        response = self.client.post(JWT_URL, {"username": self.user.username, "password": "test77test"})
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + response.data['access'])
+        for data in [BASIC_EXPENSE_1, BASIC_EXPENSE_3, RECURRING_EXPENSE_2]:
+            self.client.post(reverse('api:expenses-list'), data, format='json')
+
+    def export(self, query='', **extra):
+        response = self.client.get(self.url + query, **extra)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+
+    def test_csv(self):
+        response, content = self.export()
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('attachment; filename="expenses-2022-04-24.csv"', response['Content-Disposition'])
+        rows = list(csv.DictReader(io.StringIO(content.decode())))
+        self.assertEqual(len(rows), Payment.objects.count())
+        pizza = next(row for row in rows if row['name'] == "Pizza")
+        self.assertEqual(pizza['payment_date'], "2022-04-28T23:59:59-05:00")
+        self.assertEqual(pizza['amount'], "220.0")
+        internet = [row['payment_date'] for row in rows if row['name'] == "Internet"]
+        self.assertEqual(internet, sorted(internet))
+
+    def test_ndjson(self):
+        response, content = self.export('?format=ndjson')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([line['name'] for line in lines], ["Pizza", "Gas", "Internet"])
+        self.assertEqual(len(lines[2]['payments']), 13)
+        expense = self.client.get(reverse('api:expenses-detail', args=[lines[2]['id']])).data
+        self.assertEqual(lines[2]['first_payment_date'], expense['first_payment_date'])
+
+    def test_filters(self):
+        _, content = self.export('?format=ndjson&category=UT&from=2022-05-01&to=2022-06-30')
+        lines = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([line['name'] for line in lines], ["Gas", "Internet"])
+        self.assertEqual([payment['date'][:7] for payment in lines[1]['payments']], ["2022-05", "2022-06"])
+
+    def test_virtual_expenses(self):
+        self.client.post(reverse('api:expenses-list'), dict(VIRTUAL_EXPENSE, name="Phone"), format='json')
+        _, content = self.export('?format=ndjson')
+        phone = json.loads(content.splitlines()[-1])
+        self.assertEqual(phone['name'], "Phone")
+        self.assertEqual(len(phone['payments']), 13)
+        self.assertIsNotNone(phone['payments'][0]['id'])
+        self.assertEqual({payment['id'] for payment in phone['payments'][1:]}, {None})
+        internet = json.loads(content.splitlines()[-2])
+        self.assertEqual([payment['date'] for payment in phone['payments']],
+                         [payment['date'] for payment in internet['payments']])
+
+        # Only the first payment is stored, the range keeps the expense for its projected ones.
+        _, content = self.export('?category=UT&from=2022-05-01&to=2022-06-30')
+        rows = list(csv.DictReader(io.StringIO(content.decode())))
+        phone = [row for row in rows if row['name'] == "Phone"]
+        self.assertEqual([row['payment_date'][:7] for row in phone], ["2022-05", "2022-06"])
+        self.assertEqual([row['payment_id'] for row in phone], ["", ""])
+
+    def test_gzip(self):
+        _, plain = self.export()
+        response, content = self.export(HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(content), plain)
+
+    def test_chunks(self):
+        with patch('api.export.EXPORT_CHUNK_SIZE', 2), patch('api.export.EXPORT_BUFFER_SIZE', 100):
+            response = self.client.get(self.url)
+            chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), 2)
+        self.assertEqual(b''.join(chunks), self.export()[1])
+
+    def test_invalid_range(self):
+        response = self.client.get(self.url + '?from=never')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@freeze_time("2022-04-25")
+class ImportTest(APITestCase):
+    url = reverse('api:expenses-import-expenses')
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="test77", email="test@gmail.com", password="test77test")
+        cls.account = Account.objects.create(owner=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        response = self.client.post(JWT_URL, {"username": self.user.username, "password": "test77test"})
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + response.data['access'])
+
+    def rollups(self):
+        fields = ('year', 'month', 'category', 'total', 'count')
+        return list(self.account.rollups.order_by(*fields).values_list(*fields))
+
+    def test_csv_body(self):
+        content = (
+            "name,amount,category,recurrence,number_of_recurrences,payment_date\n"
+            "Pizza,220,FO,,,2022-4-28 23:59:59\n"
+            "Internet,385,UT,MO,12,2022-4-20 23:59:59\n"
+            "Broken,lots,FO,,,\n"
+            "Gas,385,XX,,,2022-6-20 23:59:59\n"
+            "Later,10,FO,,,tomorrow\n"
+        )
+        response = self.client.post(self.url, content, content_type='text/csv')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(response.data['failed'], 3)
+        self.assertEqual([error['row'] for error in response.data['errors']], [4, 5, 6])
+        self.assertIn('amount', response.data['errors'][0]['errors'])
+        self.assertIn('payment_date', response.data['errors'][2]['errors'])
+        internet = Expense.objects.get(name="Internet")
+        self.assertEqual(internet.account, self.account)
+        self.assertEqual(internet.payments.count(), 13)
+        self.assertEqual(timezone.localtime(internet.first_payment_date).day, 20)
+        self.assertEqual(self.client.get(reverse('api:expenses-list')).data['count'], 2)
+
+    def test_csv_unreadable_rows(self):
+        content = b''.join([
+            b"name,amount,category,payment_date\n",
+            b"Pizza,220,FO,2022-4-28 23:59:59\n",
+            b"Caf\xe9,80,FO,2022-4-28 23:59:59\n",
+            b"Notes,10,FO,\"" + b"x" * (csv.field_size_limit() + 1) + b"\"\n",
+            b"Gas,385,UT,2022-6-20 23:59:59\n",
+        ])
+        response = self.client.post(self.url, content, content_type='text/csv')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(response.data['failed'], 2)
+        self.assertEqual([error['row'] for error in response.data['errors']], [3, 4])
+        self.assertIn('UTF-8', response.data['errors'][0]['errors']['error'][0])
+        self.assertIn('field larger than field limit', response.data['errors'][1]['errors']['error'][0])
+        self.assertEqual(set(Expense.objects.values_list('name', flat=True)), {"Pizza", "Gas"})
+
+    def test_ndjson_upload(self):
+        lines = [
+            json.dumps(BASIC_EXPENSE_1), '', json.dumps(VIRTUAL_EXPENSE), '{"name": ', '[1]',
+            json.dumps(dict(RECURRING_EXPENSE_1, recurrence="YE", number_of_recurrences=10000)),
+        ]
+        upload = SimpleUploadedFile("expenses.ndjson", '\n'.join(lines).encode())
+        response = self.client.post(self.url, {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual([error['row'] for error in response.data['errors']], [4, 5, 6])
+        self.assertEqual(Payment.objects.filter(expense__virtual_payments=True).count(), 1)
+
+    def test_batches(self):
+        self.client.post(reverse('api:expenses-list'), BASIC_EXPENSE_5, format='json')
+        content = '\n'.join(
+            json.dumps(dict(data, name=f"{data['name']} {i}"))
+            for i in range(3) for data in [BASIC_EXPENSE_1, BASIC_EXPENSE_3, RECURRING_EXPENSE_2]
+        )
+        with patch('api.imports.IMPORT_BATCH_SIZE', 2), CaptureQueriesContext(connection) as queries:
+            importer = ExpenseImporter(self.account, batch_size=2)
+            importer.run(read_ndjson(io.BytesIO(content.encode())))
+        self.assertEqual(importer.created, 9)
+        inserts = [query for query in queries if query['sql'].startswith('INSERT INTO "api_expense"')]
+        self.assertEqual(len(inserts), 5)
+        rollups = self.rollups()
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual(self.rollups(), rollups)
+
+    def test_export_round_trip(self):
+        for data in [BASIC_EXPENSE_1, RECURRING_EXPENSE_2, VIRTUAL_EXPENSE]:
+            self.client.post(reverse('api:expenses-list'), data, format='json')
+        fields = ['name', 'amount', 'category', 'recurrence', 'number_of_recurrences', 'virtual_payments',
+                  'first_payment_date', 'last_payment_date']
+        expected = list(Expense.objects.order_by('pk').values_list(*fields))
+        payments = list(Payment.objects.order_by('date').values_list('date', flat=True))
+        for export_format, content_type in [('csv', 'text/csv'), ('ndjson', 'application/x-ndjson')]:
+            with self.subTest(export_format=export_format):
+                response = self.client.get(reverse('api:expenses-export') + f'?format={export_format}')
+                content = b''.join(response.streaming_content)
+                Expense.objects.all().delete()
+                response = self.client.post(self.url, content, content_type=content_type)
+                self.assertEqual(response.data, {'created': 3, 'failed': 0, 'errors': []})
+                self.assertEqual(list(Expense.objects.order_by('pk').values_list(*fields)), expected)
+                self.assertEqual(list(Payment.objects.order_by('date').values_list('date', flat=True)), payments)
+
+    def test_invalid_requests(self):
+        response = self.client.post(self.url, 'a,b', content_type='text/plain')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(self.url, {'other': 'x'}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_command(self):
+        with TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'expenses.csv')
+            with open(path, 'w') as output:
+                output.write("name,amount,category,payment_date\nPizza,220,FO,2022-4-28 23:59:59\nTV,,HO,\n")
+            stdout, stderr = StringIO(), StringIO()
+            call_command('import_expenses', path, username=self.user.username, stdout=stdout, stderr=stderr)
+        self.assertIn("Imported 1 expenses", stdout.getvalue())
+        self.assertIn("line 3: ", stderr.getvalue())
+        self.assertTrue(Expense.objects.filter(name="Pizza", account=self.account).exists())
+        with self.assertRaises(CommandError):
+            call_command('import_expenses', 'expenses.txt', username=self.user.username)
+        with self.assertRaises(CommandError):
+            call_command('import_expenses', 'expenses.csv', username='nobody')
+
+
+@freeze_time("2022-04-25")
+class ForecastTest(APITestCase):
+    url = reverse('api:account-forecast')
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="test77", email="test@gmail.com", password="test77test")
+        cls.account = Account.objects.create(owner=cls.user)
+        cls.salary = Income.objects.create(
+            name="Salary", account=cls.account, amount=30000, recurrence="BW", number_of_recurrences=40,
+            first_payment_date=timezone.make_aware(datetime(2022, 1, 14, 9)),
+        )
+        Income.objects.create(
+            name="Bonus", account=cls.account, amount=10000,
+            first_payment_date=timezone.make_aware(datetime(2022, 12, 20, 9)),
+        )
+        # Created before the schedule was stored, it starts on its first payment.
+        legacy = Expense.objects.create(name="Dentist", account=cls.account, amount=900)
+        Payment.objects.create(expense=legacy, date=timezone.make_aware(datetime(2022, 5, 3, 18)))
+
+    def setUp(self):
+        cache.clear()
+        response = self.client.post(JWT_URL, {"username": self.user.username, "password": "test77test"})
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + response.data['access'])
+        for expense in [BASIC_EXPENSE_1, BASIC_EXPENSE_5, RECURRING_EXPENSE_1, RECURRING_EXPENSE_2, VIRTUAL_EXPENSE,
+                        dict(BASIC_EXPENSE_2, recurrence="WE", number_of_recurrences=30),
+                        dict(BASIC_EXPENSE_3, recurrence="YE", number_of_recurrences=2),
+                        dict(BASIC_EXPENSE_4, recurrence="DA", number_of_recurrences=100)]:
+            self.client.post(reverse('api:expenses-list'), expense, format='json')
+
+    def expected(self, start, end):
+        """Net amount per local date, walking the occurrences of every rule."""
+        net = {}
+        for expense in Expense.objects.filter(account=self.account):
+            if expense.virtual_payments:
+                # Stepping through the local calendar, as the payments are stored.
+                dates = expense.payment_dates(timezone.localtime(expense.first_payment_date))
+            else:
+                dates = [payment.date for payment in expense.payments.all()]
+            for day in [timezone.localdate(date) for date in dates]:
+                net[day] = net.get(day, 0) - expense.amount
+        for income in Income.objects.filter(account=self.account, first_payment_date__isnull=False):
+            step = RECURRENCE_STEPS.get(income.recurrence)
+            count = income.number_of_recurrences if step else 0
+            for date in schedule(timezone.localtime(income.first_payment_date), step or timedelta(days=1), count):
+                day = timezone.localdate(date)
+                net[day] = net.get(day, 0) + income.amount
+        return [round(net.get(start + timedelta(days=i), 0), 2) for i in range((end - start).days + 1)]
+
+    def test_daily_matches_schedule(self):
+        response = self.client.get(self.url, {"from": "2022-01-01", "to": "2024-12-31"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        periods = response.data['periods']
+        self.assertEqual(len(periods), 1096)
+        self.assertEqual(periods[0]['date'], '2022-01-01')
+        self.assertEqual(periods[-1]['date'], '2024-12-31')
+        self.assertEqual([period['net'] for period in periods], self.expected(date(2022, 1, 1), date(2024, 12, 31)))
+        # Monthly payments from March 31 fall on the last day of shorter months, next to the daily Water.
+        days = {period['date']: period for period in periods}
+        self.assertEqual(days['2022-04-30']['expenses'], 200 + 350)
+        self.assertEqual(days['2022-05-03']['expenses'], 900 + 350)
+        self.assertEqual(days['2022-12-20']['income'], 10000)
+        self.assertAlmostEqual(response.data['closing_balance'], sum(period['net'] for period in periods), places=2)
+
+    def test_defaults_to_a_year_from_today(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['from'], date(2022, 4, 24))
+        self.assertEqual(response.data['to'], date(2023, 4, 23))
+        self.assertEqual(len(response.data['periods']), 365)
+
+    def test_monthly(self):
+        params = {"from": "2022-04-15", "to": "2023-06-10", "opening_balance": 5000}
+        daily = self.client.get(self.url, params).data
+        monthly = self.client.get(self.url, dict(params, granularity="monthly")).data
+        months = [period['date'] for period in monthly['periods']]
+        self.assertEqual(months[0], '2022-04')
+        self.assertEqual(months[-1], '2023-06')
+        self.assertEqual(len(months), 15)
+        for month in monthly['periods']:
+            days = [day for day in daily['periods'] if day['date'].startswith(month['date'])]
+            self.assertAlmostEqual(month['income'], sum(day['income'] for day in days), places=2)
+            self.assertAlmostEqual(month['expenses'], sum(day['expenses'] for day in days), places=2)
+            self.assertAlmostEqual(month['balance'], days[-1]['balance'], places=2)
+        self.assertAlmostEqual(monthly['closing_balance'], daily['closing_balance'], places=2)
+        self.assertAlmostEqual(daily['periods'][0]['balance'], 5000 + daily['periods'][0]['net'], places=2)
+
+    def test_modifiers(self):
+        params = {"from": "2022-04-01", "to": "2022-04-30"}
+        before = self.client.get(self.url, params).data
+        internet = Expense.objects.get(name="Internet", virtual_payments=False)
+        AmountModifier.objects.create(name="Taxes", percent_modifier="PD", percent=0.7, income=self.salary)
+        AmountModifier.objects.create(name="Raise", percent_modifier="PI", percent=0.1, income=self.salary)
+        AmountModifier.objects.create(name="Promo", percent_modifier="PD", percent=0.5, expense=internet)
+        response = self.client.get(self.url, params)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        after = {period['date']: period for period in response.data['periods']}
+        self.assertAlmostEqual(after['2022-04-08']['income'], 30000 * 0.7 * 1.1, places=2)
+        self.assertEqual(after['2022-04-20']['expenses'], 385 + 385 / 2)
+        self.assertEqual(before['expenses'] - response.data['expenses'], 385 / 2)
+
+    def test_stored_payments_and_undated_incomes(self):
+        params = {"from": "2022-05-01", "to": "2022-06-30"}
+        before = {period['date']: period for period in self.client.get(self.url, params).data['periods']}
+        internet = Expense.objects.get(name="Internet", virtual_payments=False)
+        payments = {timezone.localdate(payment.date): payment for payment in internet.payments.all()}
+        payments[date(2022, 5, 20)].delete()
+        moved = payments[date(2022, 6, 20)]
+        moved.date += timedelta(days=5)
+        moved.save()
+        Income.objects.create(name="Old", account=self.account, amount=500, first_payment_date=None)
+        response = self.client.get(self.url, params)
+        after = {period['date']: period for period in response.data['periods']}
+        self.assertEqual(after['2022-05-20']['expenses'], before['2022-05-20']['expenses'] - 385)
+        self.assertEqual(after['2022-06-20']['expenses'], before['2022-06-20']['expenses'] - 385)
+        self.assertEqual(after['2022-06-25']['expenses'], before['2022-06-25']['expenses'] + 385)
+        self.assertEqual([period['income'] for period in after.values()],
+                         [period['income'] for period in before.values()])
+        self.assertEqual([period['net'] for period in response.data['periods']],
+                         self.expected(date(2022, 5, 1), date(2022, 6, 30)))
+
+    def test_invalid_params(self):
+        for params in [{"granularity": "weekly"}, {"days": 0}, {"days": "many"}, {"days": FORECAST_MAX_DAYS + 1},
+                       {"from": "2022-13-01"}, {"from": "2022-05-01", "to": "2022-04-01"}, {"opening_balance": "nan"},
+                       {"from": "9999-12-30", "days": 5}, {"from": "9999-12-30", "to": "9999-12-31"}]:
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+            self.assertIn('error', response.data)
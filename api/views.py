@@ -1,25 +1,151 @@
+from django.conf import settings
+from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
+from django.db import transaction
+from django.db.models import Count, QuerySet, Sum
+from django.utils.functional import cached_property
 from rest_framework.permissions import IsAuthenticated
-from rest_framework.decorators import api_view, action
+from rest_framework.decorators import api_view, action, permission_classes
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import MultiPartParser
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.response import Response
 from rest_framework import viewsets, status
-from datetime import datetime, timedelta
 from django.utils import timezone
+from collections import Counter
+from datetime import date, timedelta
+from itertools import islice
+import heapq
+import math
 
-from api.permissions import AccountPermission, PaymentPermission
+from api.async_views import AsyncViewSetMixin
+from api.batch import ExpenseBatch
+from api.authentication import denylist
+from api.db_routers import ReplicaReadMixin
+from api.cache import ConditionalGetMixin, cached_response, conditional_response
+from api.dates import day_range, month_range, schedule_index
+from api.export import export_response
+from api.imports import READERS, ExpenseImporter, detect_format
+from api.filters import DateRangeFilter
+from api.forecast import FORECAST_MAX_DAYS, cash_flow
+from api.metrics import registry
+from api.permissions import AccountPermission, PaymentPermission, get_account
+from api.renderers import CSVRenderer, NDJSONRenderer
 from api.paginations import PaymentResultsSetPagination, StandardResultsSetPagination
 from api.serializers import (
     UserSerializer,
     AccountSerializer,
     ExpenseSerializer,
-    PaymentSerializer
+    PaymentSerializer,
+    ValuesSerializerMixin
 )
-from api.models import Account, Expense, Payment
+from api.models import Account, Expense, MonthlyRollup, Payment
+from api.rollups import RollupDelta
 
 
 # Create your views here.
 
 
+def virtual_expenses(expenses, start, end):
+    """Expenses with virtual payments whose schedule overlaps `[start, end)`."""
+    expenses = expenses.filter(virtual_payments=True)
+    if start is not None:
+        expenses = expenses.filter(last_payment_date__gte=start)
+    if end is not None:
+        expenses = expenses.filter(first_payment_date__lt=end)
+    return list(expenses.prefetch_related(None).order_by())
+
+
+class UpcomingPayments:
+    """
+    Stored payments together with the projected payments of virtual expenses, newest first, as a
+    sequence for the paginator. Counting and adding up projects no payment, and a page only merges
+    the payments up to its end, so the cost doesn't grow with the length of the schedules.
+    """
+
+    def __init__(self, payments, expenses, start, end):
+        self.payments = payments
+        self.expenses = expenses
+        self.start = start
+        self.end = end
+        # Virtual expenses store their first payment, it isn't projected again.
+        self.stored = set(payments.filter(expense__in=expenses).values_list('expense_id', 'date'))
+
+    def bounds(self, expense):
+        first, step, count = expense.schedule_rule()
+        low = 0 if self.start is None else schedule_index(first, step, count, self.start)
+        high = count + 1 if self.end is None else schedule_index(first, step, count, self.end)
+        return first, step, low, high
+
+    def projected(self, expense):
+        first, step, low, high = self.bounds(expense)
+        for i in range(high - 1, low - 1, -1):
+            date = first + step * i
+            if (expense.pk, date) not in self.stored:
+                yield Payment(expense=expense, date=date)
+
+    @cached_property
+    def totals(self):
+        totals = self.payments.aggregate(count=Count('pk'), total=Sum('expense__amount'))
+        count, total = totals['count'], totals['total'] or 0
+        stored = Counter(expense_id for expense_id, _ in self.stored)
+        for expense in self.expenses:
+            _, _, low, high = self.bounds(expense)
+            projected = max(high - low, 0) - stored[expense.pk]
+            count += projected
+            total += projected * expense.amount
+        return {'count': count, 'total': total}
+
+    def __len__(self):
+        return self.totals['count']
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice) or index.step is not None:
+            raise TypeError("UpcomingPayments only supports slices.")
+        start, stop, _ = index.indices(len(self))
+        streams = [self.payments[:stop].iterator(), *(self.projected(expense) for expense in self.expenses)]
+        merged = heapq.merge(*streams, key=lambda payment: payment.date, reverse=True)
+        return list(islice(merged, start, stop))
+
+
+class ValuesListMixin:
+    """
+    Serializes the querysets of list actions from `.values()` rows, without creating model
+    instances, when the serializer has a ValuesSerializerMixin. Other results, e.g. lists merged
+    with projected payments, go through the serializer.
+    """
+    values_serialization = True
+
+    def values_serializer(self, objects):
+        if not self.values_serialization or not isinstance(objects, QuerySet):
+            return None
+        serializer = self.get_serializer()
+        return serializer if isinstance(serializer, ValuesSerializerMixin) else None
+
+    def serialize(self, objects):
+        serializer = self.values_serializer(objects)
+        if serializer is None:
+            return self.get_serializer(objects, many=True).data
+        return serializer.values_data(serializer.values_queryset(objects))
+
+    def list_response(self, objects):
+        serializer = self.values_serializer(objects)
+        if serializer is not None:
+            extra = self.paginator.values_fields(objects.model) if hasattr(self.paginator, 'values_fields') else ()
+            objects = serializer.values_queryset(objects, extra)
+        page = self.paginate_queryset(objects)
+        rows = objects if page is None else page
+        if serializer is not None:
+            data = serializer.values_data(rows)
+        else:
+            data = self.get_serializer(rows, many=True).data
+        return Response(data) if page is None else self.get_paginated_response(data)
+
+    def list(self, request, *args, **kwargs):
+        return self.list_response(self.filter_queryset(self.get_queryset()))
+
+
 @api_view(['GET', 'POST'])
 def create_user(request):
     if request.method == 'POST':
@@ -30,30 +156,99 @@ def create_user(request):
     return Response({'response': 'Use POST method to create user. (username, email, password)'})
 
 
+def metrics(request):
+    """Request and SQL metrics of this process in the Prometheus text format."""
+    if settings.METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {settings.METRICS_TOKEN}':
+        return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+    return HttpResponse(registry.expose(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def revoke_token(request):
+    denylist.revoke(request.auth)
+    refresh = request.data.get('refresh')
+    if refresh:
+        try:
+            denylist.revoke(RefreshToken(refresh))
+        except TokenError as e:
+            raise InvalidToken(e.args[0])
+    return Response(status=status.HTTP_204_NO_CONTENT)
+
+
 class AccountViewSet(viewsets.ViewSet):
     permission_classes = [IsAuthenticated]
     queryset = Account.objects.all()
 
+    @cached_response
     def list(self, request):
-        account = get_object_or_404(self.queryset, owner=self.request.user.id)
+        account = get_account(request)
+        if account.get_deferred_fields():
+            account = get_object_or_404(self.queryset, pk=account.pk)
         serializer = AccountSerializer(account)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['get'])
+    @cached_response
+    def forecast(self, request):
+        """
+        Income, expenses, net cash flow and running balance per day, or per month with
+        `granularity=monthly`, from `from` (today by default) to `to` (inclusive) or for `days` days.
+        """
+        params = request.query_params
+        dates = DateRangeFilter()
+        start = dates.get_day(request, 'from') if 'from' in params else timezone.localdate()
+        try:
+            if 'to' in params:
+                days = (dates.get_day(request, 'to') - start).days + 1
+            else:
+                days = int(params.get('days', 365))
+            opening_balance = float(params.get('opening_balance', 0))
+            if not math.isfinite(opening_balance):
+                raise ValueError(params['opening_balance'])
+        except ValueError as e:
+            raise ValidationError({"error": f"Query must be a valid number: {e}"})
+        if not 0 < days <= FORECAST_MAX_DAYS:
+            raise ValidationError({"error": f"The forecast must cover between 1 and {FORECAST_MAX_DAYS} days."})
+        # The day after the horizon bounds its payments.
+        if (date.max - start).days < days:
+            raise ValidationError({"error": f"The forecast must end before {date.max}."})
+        granularity = params.get('granularity', 'daily')
+        if granularity not in ('daily', 'monthly'):
+            raise ValidationError({"error": "Query 'granularity' must be daily or monthly."})
 
-class ExpenseViewSet(viewsets.ModelViewSet):
+        periods = cash_flow(get_account(request), start, days, granularity, opening_balance)
+        response = {
+            "from": start,
+            "to": start + timedelta(days=days - 1),
+            "granularity": granularity,
+            "opening_balance": opening_balance,
+            "income": round(sum(period['income'] for period in periods), 2),
+            "expenses": round(sum(period['expenses'] for period in periods), 2),
+            "closing_balance": periods[-1]['balance'],
+            "periods": periods,
+        }
+        return Response(response)
+
+
+class ExpenseViewSet(AsyncViewSetMixin, ReplicaReadMixin, ConditionalGetMixin, ValuesListMixin,
+                     viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated, AccountPermission]
     queryset = Expense.objects.all()
     serializer_class = ExpenseSerializer
     pagination_class = StandardResultsSetPagination
+    date_range_field = 'payments__date'
+    # List and detail share their routes with the writes.
+    async_actions = ('expenses_by_month', 'expenses_so_far')
 
     def get_queryset(self):
-        account = get_object_or_404(Account, owner=self.request.user.id)
+        account = get_account(self.request)
         filters = {"account": account}
-        self.queryset = self.queryset.filter(**filters)
+        self.queryset = self.queryset.filter(**filters).prefetch_related('payments')
         return self.queryset
 
     def create(self, request, *args, **kwargs):
-        today = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        today = timezone.localtime().strftime("%Y-%m-%d %H:%M:%S")
         payment_date = request.data.pop('payment_date', today)
         serializer = self.get_serializer(data=request.data, context={'payment_date': payment_date})
         serializer.is_valid(raise_exception=True)
@@ -61,89 +256,182 @@ class ExpenseViewSet(viewsets.ModelViewSet):
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
+    @conditional_response
+    @cached_response
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional_response
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
     def perform_create(self, serializer):
-        account = get_object_or_404(Account, owner=self.request.user.id)
+        account = get_account(self.request)
         serializer.save(account=account)
 
+    def perform_destroy(self, instance):
+        delta = RollupDelta()
+        delta.remove(instance, instance.rollup_months())
+        with transaction.atomic():
+            instance.delete()
+            delta.apply()
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        batch = ExpenseBatch(request.data, get_account(request), self.get_serializer_context())
+        if batch.is_valid():
+            batch.save()
+        return Response(batch.data, status=status.HTTP_400_BAD_REQUEST if batch.failed else status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'], renderer_classes=[CSVRenderer, NDJSONRenderer])
+    def export(self, request):
+        """
+        Streams the account's expenses with their payments, projected ones included, as CSV or with
+        `?format=ndjson`. Takes the date range params and `category`, the range also limits the payments.
+        """
+        backend = DateRangeFilter()
+        start, end = backend.get_date_range(request)
+        expenses = self.get_queryset() if start is None and end is None else self.get_month_expenses(start, end)
+        category = request.query_params.get('category')
+        if category:
+            expenses = expenses.filter(category=category)
+        payments = backend.filter_date_range(Payment.objects.filter(expense__in=expenses), 'date', start, end)
+        return export_response(request, expenses, payments, request.accepted_renderer.format, start, end)
+
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser])
+    def import_expenses(self, request):
+        """
+        Imports a CSV or NDJSON file sent as the request body, with its content type, or as the
+        `file` field of a multipart form. The file is read a line at a time.
+        """
+        if request.content_type.startswith('multipart/form-data'):
+            upload = request.FILES.get('file')
+            if upload is None:
+                raise ValidationError({"error": "Upload the file in the 'file' field."})
+            stream, import_format = upload, detect_format(name=upload.name)
+        else:
+            stream, import_format = request.stream, detect_format(content_type=request.content_type)
+        if import_format is None:
+            raise ValidationError({"error": "Expected a CSV (text/csv) or NDJSON (application/x-ndjson) file."})
+        if stream is None:
+            raise ValidationError({"error": "The file is empty."})
+        importer = ExpenseImporter(get_account(request)).run(READERS[import_format](stream))
+        return Response(importer.report)
+
     @action(detail=False, methods=['get'])
     def expenses_by_category(self, request):
         category = request.query_params.get('category', None)
         if category:
-            expenses = Expense.objects.filter(category=category).order_by("-date_created")
-            page = self.paginate_queryset(expenses)
-
-            if page:
-                serializer = self.get_serializer(page, many=True)
-                return self.get_paginated_response(serializer.data)
-
-            serializer = self.get_serializer(expenses, many=True)
-            return Response(serializer.data)
+            expenses = self.filter_queryset(self.get_queryset()).filter(category=category).order_by("-date_created")
+            return self.list_response(expenses)
         return Response({"response": "No category chosen."})
 
     @action(detail=False, methods=['get'])
+    @cached_response
     def most_recent_expenses(self, request):
-        expenses = Expense.objects.all().order_by('-date_created')
-        page = self.paginate_queryset(expenses)
+        expenses = self.filter_queryset(self.get_queryset()).order_by('-date_created')
+        return self.list_response(expenses)
 
-        if page:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
+    def get_month_expenses(self, start, end):
+        queryset = self.get_queryset()
+        expenses = DateRangeFilter().filter_date_range(queryset, self.date_range_field, start, end)
+        virtual = [expense.pk for expense in virtual_expenses(queryset, start, end) if expense.occurrences(start, end)]
+        if virtual:
+            expenses = expenses | queryset.filter(pk__in=virtual)
+        return expenses
 
-        serializer = self.get_serializer(expenses, many=True)
-        return Response(serializer.data)
+    def get_month_rollups(self, request, start):
+        """The month's rollups, None when the range requested isn't a whole month."""
+        if 'from' in request.query_params or 'to' in request.query_params:
+            return None
+        start = timezone.localtime(start)
+        rollups = MonthlyRollup.objects.filter(account=get_account(request), year=start.year, month=start.month)
+        return list(rollups.order_by('category').values('category', 'total', 'count'))
 
     @action(detail=False, methods=['get'])
+    @cached_response
     def expenses_by_month(self, request):
-        today = timezone.now()
-        month = request.query_params.get('month', today.month)
-        year = request.query_params.get('year', today.year)
-        try:
-            month = int(month)
-            year = int(year)
-            date = datetime(year, month, 1)
-        except (TypeError, ValueError) as e:
-            return Response({"error": f"Query must be valid integer: {e}"}, status=status.HTTP_400_BAD_REQUEST)
-        filters = {"payments__date__month": month, "payments__date__year": year}
-        expenses = Expense.objects.filter(**filters)
-        total = sum(expense.amount for expense in expenses)
-        serializer = self.get_serializer(expenses, many=True)
-        response = {"month": date.strftime("%B"), "expenses": serializer.data, "total": total}
+        start, end = DateRangeFilter().get_date_range(request, month_default=True)
+        expenses = self.get_month_expenses(start, end)
+        rollups = self.get_month_rollups(request, start)
+        if rollups is not None:
+            total = sum(rollup['total'] for rollup in rollups)
+        else:
+            total = expenses.aggregate(total=Sum('amount'))['total'] or 0
+        expenses = self.serialize(expenses)
+        response = {"month": timezone.localtime(start).strftime("%B"), "expenses": expenses, "total": total}
         return Response(response)
 
     @action(detail=False, methods=['get'])
+    @cached_response
     def expenses_so_far(self, request):
-        today = timezone.now()
-        filters = {"payments__date__month": today.month, "payments__date__year": today.year,
-                   "payments__date__lte": today.date()}
-        expenses = Expense.objects.filter(**filters)
-        total = sum(expense.amount for expense in expenses)
-        serializer = self.get_serializer(expenses, many=True)
-        response = {"month": today.strftime("%B"), "expenses": serializer.data, "total": total}
+        start, end = DateRangeFilter().get_date_range(request, month_default=True)
+        end = min(end, day_range(timezone.localdate())[1])
+        expenses = self.get_month_expenses(start, end)
+        total = expenses.aggregate(total=Sum('amount'))['total'] or 0
+        expenses = self.serialize(expenses)
+        response = {"month": timezone.localtime(start).strftime("%B"), "expenses": expenses, "total": total}
+        return Response(response)
+
+    @action(detail=False, methods=['get'])
+    def summary(self, request):
+        start, end = DateRangeFilter().get_date_range(request, month_default=True)
+        categories = self.get_month_rollups(request, start)
+        if categories is None:
+            categories = list(
+                self.get_month_expenses(start, end)
+                .order_by('category')
+                .values('category')
+                .annotate(total=Sum('amount'), count=Count('id'))
+            )
+        response = {
+            "month": timezone.localtime(start).strftime("%B"),
+            "year": timezone.localtime(start).year,
+            "total": sum(category['total'] for category in categories),
+            "count": sum(category['count'] for category in categories),
+            "categories": categories,
+        }
         return Response(response)
 
 
-class PaymentViewSet(viewsets.ReadOnlyModelViewSet):
+class PaymentViewSet(AsyncViewSetMixin, ReplicaReadMixin, ConditionalGetMixin, ValuesListMixin,
+                     viewsets.ReadOnlyModelViewSet):
     permission_classes = [IsAuthenticated, PaymentPermission]
-    queryset = Payment.objects.all()
+    queryset = Payment.objects.select_related('expense')
     serializer_class = PaymentSerializer
     pagination_class = PaymentResultsSetPagination
+    date_range_field = 'date'
+    # Payments only change together with their expense.
+    modified_field = 'expense__date_modified'
+    async_actions = ('list', 'retrieve', 'upcoming_payments')
+
+    def get_queryset(self):
+        return self.queryset.filter(expense__account=get_account(self.request))
+
+    @conditional_response
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional_response
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
 
     @action(detail=False, methods=['get'])
+    @cached_response
     def upcoming_payments(self, request):
-        today = timezone.now()
-        filters = {'date__gt': today.date()}
+        today = timezone.localdate()
+        backend = DateRangeFilter()
+        start, end = backend.get_date_range(request)
+        tomorrow = day_range(today)[1]
+        start = tomorrow if start is None else max(start, tomorrow)
         this_month = request.query_params.get('this_month', None)
         if this_month is not None:
-            filters['date__month'] = today.month
-            filters['date__year'] = today.year
-
-        payments = Payment.objects.filter(**filters)
-        print(payments)
-        page = self.paginate_queryset(payments)
+            month_end = month_range(today.year, today.month)[1]
+            end = month_end if end is None else min(end, month_end)
 
-        if page:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-
-        serializer = self.get_serializer(payments, many=True)
-        return Response(serializer.data)
+        payments = backend.filter_date_range(self.get_queryset(), self.date_range_field, start, end)
+        expenses = Expense.objects.filter(account=get_account(request))
+        virtual = virtual_expenses(expenses, start, end)
+        if virtual:
+            payments = UpcomingPayments(payments.order_by('-date'), virtual, start, end)
+        return self.list_response(payments)
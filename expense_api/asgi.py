@@ -3,6 +3,15 @@ ASGI config for expense_api project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Run it with an ASGI server, e.g. uvicorn:
+
+    pip install uvicorn
+    ASYNC_VIEWS=1 uvicorn expense_api.asgi:application --workers 4
+
+ASYNC_VIEWS=1 serves the read-only expense and payment actions with coroutine views
+(see api.async_views), leave it unset when deploying expense_api.wsgi. Compare both
+deployments with `python manage.py benchmark_asgi`.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/4.0/howto/deployment/asgi/
 """
@@ -20,10 +20,17 @@ from rest_framework_simplejwt.views import (
     TokenRefreshView,
 )
 
+from api.serializers import AccountTokenObtainPairSerializer, DenylistTokenRefreshSerializer
+from api.views import metrics, revoke_token
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api-auth/', include('rest_framework.urls')),
-    path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
-    path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('api/token/', TokenObtainPairView.as_view(serializer_class=AccountTokenObtainPairSerializer),
+         name='token_obtain_pair'),
+    path('api/token/refresh/', TokenRefreshView.as_view(serializer_class=DenylistTokenRefreshSerializer),
+         name='token_refresh'),
+    path('api/token/revoke/', revoke_token, name='token_revoke'),
     path('api/', include('api.urls')),
+    path('metrics', metrics, name='metrics'),
 ]